@@ -0,0 +1,241 @@
+"""
+Auditoria dos planos de execução das consultas de telemetria e alertas
+Execute: python auditar_consultas.py [--database-url URL]
+
+Exercita os endpoints de routes/api.py e routes/main.py e a verificação de
+regras de services/regras_service.py, captura todas as consultas emitidas e
+roda EXPLAIN em cada uma. Termina com código 1 se alguma consulta fizer
+varredura completa (full table scan) em uma das tabelas grandes.
+
+Sem --database-url, usa um banco SQLite temporário populado com dados
+sintéticos. Com --database-url, usa o banco informado, que já deve estar
+populado (por exemplo com populate_database.py).
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+# Tabelas que crescem com a telemetria e não podem ser varridas por inteiro
+TABELAS_MONITORADAS = {
+    'medicoes_telemetria', 'alertas',
+    'agregados_inversor_hora', 'agregados_inversor_dia', 'agregados_parque_hora', 'agregados_parque_dia'
+}
+
+# Endpoints que não terminam (streams) e por isso não são exercitados
+ENDPOINTS_IGNORADOS = {'api.dashboard_stream'}
+
+# Variações de parâmetros exercitadas por endpoint
+PARAMETROS_ENDPOINTS = {
+    'api.dashboard_metricas': [
+        {}, {'periodo': 'semana'}, {'periodo': 'mes'},
+        {'periodo': 'mes', 'parque_id': 1}, {'periodo': 'mes', 'inversor_id': 1},
+        {'status_placa': 'ligada'}
+    ],
+    'api.dashboard_inversores': [{}, {'parque_id': 1}],
+    'api.chart_geracao_tempo': [{}, {'dias': 30}],
+    'api.chart_temperatura_geracao': [{}, {'dias': 30}],
+    'api.chart_bundle': [{}, {'dias': 30, 'dias_temperatura': 15}],
+    'api.obter_telemetria_inversor': [
+        {}, {'limite': 5, 'campos': 'geracao_kw'}, {'inicio': '2000-01-01', 'fim': '2100-01-01'},
+        {'limite': 5, 'cursor': 'MjEwMC0wMS0wMVQwMDowMDowMHwx'}
+    ],
+    'api.exportar_telemetria': [{'parque_id': 1}, {'inversor_id': 1, 'formato': 'ndjson', 'inicio': '2000-01-01'}],
+    'api.serie_telemetria_api': [
+        {'inversor_id': 1}, {'inversor_id': 1, 'metodo': 'minmax', 'pontos': 10},
+        {'parque_id': 1, 'pontos': 10}, {'parque_id': 1, 'inicio': '2000-01-01', 'pontos': 3}
+    ],
+}
+
+def configurar_banco(database_url):
+    """Define DATABASE_URL antes de importar o app. Retorna True se o banco for temporário."""
+    if database_url:
+        os.environ['DATABASE_URL'] = database_url
+        return False
+    diretorio = tempfile.mkdtemp(prefix='helios_auditoria_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(diretorio, 'auditoria.db')
+    return True
+
+def popular_banco_sintetico(dias=30, parques=3, inversores_por_parque=4):
+    """Popula o banco temporário com um volume de dados suficiente para o planejador usar índices"""
+    from datetime import date, time, timedelta
+    from database import db
+    from models import Parque, Inversor, PlacaSolar, Regra, MedicaoTelemetria, Alerta
+    from services.agregados import reconstruir_agregados
+    
+    hoje = date.today()
+    for p in range(parques):
+        parque = Parque(nome=f'Parque {p + 1}', localizacao='Auditoria', capacidade_total_kw=500,
+                        data_instalacao=hoje - timedelta(days=365))
+        db.session.add(parque)
+        db.session.flush()
+        for i in range(inversores_por_parque):
+            inversor = Inversor(codigo_serie=f'AUD-{p + 1}-{i + 1}', modelo='Auditoria', capacidade_kw=50,
+                                data_instalacao=parque.data_instalacao, parque_id=parque.id)
+            db.session.add(inversor)
+            db.session.flush()
+            db.session.add(PlacaSolar(codigo_serie=f'PL-{inversor.id}', modelo='Auditoria', potencia_wp=550,
+                                      largura_cm=113, altura_cm=227, area_m2=2.56, posicao_x=0, posicao_y=0,
+                                      inversor_id=inversor.id, data_instalacao=parque.data_instalacao))
+    
+    regras = [
+        Regra(nome='Eficiência baixa', descricao='Auditoria', tipo='eficiencia', operador='<', valor_threshold=20),
+        Regra(nome='Temperatura alta', descricao='Auditoria', tipo='temperatura', operador='>', valor_threshold=60),
+    ]
+    db.session.add_all(regras)
+    db.session.commit()
+    
+    linhas = []
+    for inversor in Inversor.query.all():
+        for d in range(dias):
+            for h in range(6, 19):
+                linhas.append({
+                    'inversor_id': inversor.id,
+                    'data_medicao': hoje - timedelta(days=d),
+                    'hora_medicao': time(h, 0),
+                    'geracao_kw': 5.0 * (h - 5),
+                    'temperatura': 30.0 + h,
+                    'tensao': 220.0,
+                    'corrente': 10.0,
+                    'frequencia': 60.0,
+                    'eficiencia': 10.0 * (h - 5)
+                })
+    db.session.execute(db.insert(MedicaoTelemetria), linhas)
+    db.session.commit()
+    reconstruir_agregados()
+    for inversor in Inversor.query.all():
+        for regra in regras:
+            db.session.add(Alerta(inversor_id=inversor.id, regra_id=regra.id, mensagem='Auditoria',
+                                  severidade='media', resolvido=True))
+    db.session.commit()
+
+def capturar_consultas(app):
+    """Exercita os endpoints e serviços auditados e retorna as consultas emitidas por origem"""
+    from flask import url_for
+    from sqlalchemy import event
+    from database import db
+    from services.regras_service import verificar_todos_alertas
+    
+    consultas = []
+    origem = {'atual': None}
+    
+    def registrar(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and re.match(r'\s*(SELECT|UPDATE|DELETE)\b', statement, re.IGNORECASE):
+            consultas.append((origem['atual'], statement, parameters))
+    
+    app.config['WTF_CSRF_ENABLED'] = False
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['_user_id'] = '1'
+        sessao['_fresh'] = True
+    
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', registrar)
+        try:
+            with app.test_request_context():
+                rotas = []
+                for regra in app.url_map.iter_rules():
+                    if not regra.endpoint.startswith(('api.', 'main.')) or regra.endpoint in ENDPOINTS_IGNORADOS:
+                        continue
+                    if 'GET' not in regra.methods:
+                        continue
+                    for parametros in PARAMETROS_ENDPOINTS.get(regra.endpoint, [{}]):
+                        valores = {argumento: 1 for argumento in regra.arguments}
+                        rotas.append((regra.endpoint, url_for(regra.endpoint, **valores, **parametros)))
+            
+            for endpoint, url in rotas:
+                origem['atual'] = f'GET {url}'
+                # buffered consome as respostas em stream, cujas consultas rodam durante a leitura do corpo
+                cliente.get(url, buffered=True)
+            
+            origem['atual'] = 'POST /api/telemetria/data'
+            cliente.post('/api/telemetria/data', json={'inversor_id': 1, 'geracao_kw': 1.0, 'temperatura': 70.0})
+            origem['atual'] = 'POST /api/telemetria/batch'
+            cliente.post('/api/telemetria/batch', json=[
+                {'inversor_id': 2, 'geracao_kw': 1.0, 'temperatura': 70.0},
+                {'inversor_id': 3, 'geracao_kw': 2.0, 'temperatura': 40.0}
+            ])
+            origem['atual'] = 'services.regras_service.verificar_todos_alertas'
+            verificar_todos_alertas()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', registrar)
+    
+    return consultas
+
+def varreduras_completas(conn, statement, parameters):
+    """Roda EXPLAIN na consulta e retorna as tabelas monitoradas lidas por varredura completa"""
+    dialeto = conn.dialect.name
+    if dialeto == 'sqlite':
+        plano = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        tabelas = set()
+        for linha in plano:
+            detalhe = linha[-1]
+            encontrado = re.match(r'SCAN (?:TABLE )?(\w+)(?: AS \w+)?$', detalhe)
+            if encontrado:
+                tabelas.add(encontrado.group(1))
+        return tabelas & TABELAS_MONITORADAS, plano
+    if dialeto == 'mysql':
+        plano = [dict(linha) for linha in conn.exec_driver_sql('EXPLAIN ' + statement, parameters).mappings()]
+        tabelas = {linha['table'] for linha in plano if linha['type'] == 'ALL'}
+        return tabelas & TABELAS_MONITORADAS, plano
+    if dialeto == 'postgresql':
+        plano = conn.exec_driver_sql('EXPLAIN ' + statement, parameters).fetchall()
+        tabelas = set()
+        for (linha,) in plano:
+            encontrado = re.search(r'Seq Scan on (\w+)', linha)
+            if encontrado:
+                tabelas.add(encontrado.group(1))
+        return tabelas & TABELAS_MONITORADAS, plano
+    raise NotImplementedError(f'EXPLAIN não suportado para o banco {dialeto}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Audita os planos de execução das consultas de telemetria')
+    parser.add_argument('--database-url', help='Banco já populado a auditar (padrão: SQLite temporário)')
+    args = parser.parse_args()
+    
+    temporario = configurar_banco(args.database_url)
+    
+    from app import app
+    from database import db
+    
+    print("=" * 60)
+    print("AUDITORIA DE PLANOS DE CONSULTA - HELIOS")
+    print("=" * 60)
+    
+    if temporario:
+        with app.app_context():
+            popular_banco_sintetico()
+        print("[OK] Banco SQLite temporário populado")
+    
+    consultas = capturar_consultas(app)
+    
+    # Cada consulta distinta é analisada uma vez
+    unicas = {}
+    for origem, statement, parameters in consultas:
+        unicas.setdefault(statement, (origem, parameters))
+    print(f"[OK] {len(consultas)} consultas capturadas, {len(unicas)} distintas\n")
+    
+    falhas = 0
+    with app.app_context():
+        with db.engine.connect() as conn:
+            for statement, (origem, parameters) in unicas.items():
+                tabelas, plano = varreduras_completas(conn, statement, parameters)
+                if tabelas:
+                    falhas += 1
+                    print(f"[FALHA] {origem}: varredura completa em {', '.join(sorted(tabelas))}")
+                    print(f"        {' '.join(statement.split())}")
+                    for linha in plano:
+                        print(f"        -> {linha if isinstance(linha, dict) else tuple(linha)}")
+                    print()
+    
+    print("=" * 60)
+    if falhas:
+        print(f"{falhas} consulta(s) com varredura completa em {', '.join(sorted(TABELAS_MONITORADAS))}")
+        sys.exit(1)
+    print("[OK] Nenhuma varredura completa nas tabelas de telemetria")
+
+
+if __name__ == '__main__':
+    main()
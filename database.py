@@ -1,12 +1,88 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
 
 db = SQLAlchemy()
 
+def _modulo_insert_dialeto():
+    """Retorna o construtor de INSERT específico do dialeto do banco em uso"""
+    dialeto = db.session.get_bind().dialect.name
+    if dialeto == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+    elif dialeto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialeto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise NotImplementedError(f'Upsert não suportado para o banco {dialeto}')
+    return dialeto, insert
 
+def upsert(tabela, chaves, colunas_atualizar):
+    """Monta um INSERT que atualiza colunas_atualizar quando a chave única já existe.
 
+    MySQL usa ON DUPLICATE KEY UPDATE; SQLite e PostgreSQL usam ON CONFLICT.
+    O comando pode ser executado com uma lista de linhas (executemany).
+    """
+    dialeto, insert = _modulo_insert_dialeto()
+    stmt = insert(tabela)
+    if dialeto == 'mysql':
+        return stmt.on_duplicate_key_update({coluna: stmt.inserted[coluna] for coluna in colunas_atualizar})
+    return stmt.on_conflict_do_update(
+        index_elements=chaves,
+        set_={coluna: stmt.excluded[coluna] for coluna in colunas_atualizar}
+    )
 
+def upsert_acumulando(tabela, chaves, somar=(), minimos=(), maximos=()):
+    """Monta um INSERT que, quando a chave única já existe, acumula os valores na linha gravada.
 
+    As colunas somar recebem a soma, e as colunas minimos e maximos o menor e
+    o maior entre o valor gravado e o novo. NULL de um lado mantém o valor do
+    outro. SQLite usa min()/max() de dois argumentos; MySQL e PostgreSQL usam
+    LEAST/GREATEST. O comando pode ser executado com uma lista de linhas.
+    """
+    dialeto, insert = _modulo_insert_dialeto()
+    stmt = insert(tabela)
+    novo = stmt.inserted if dialeto == 'mysql' else stmt.excluded
+    menor, maior = (func.min, func.max) if dialeto == 'sqlite' else (func.least, func.greatest)
+    valores = {}
+    for coluna in somar:
+        valores[coluna] = func.coalesce(tabela.c[coluna] + novo[coluna], tabela.c[coluna], novo[coluna])
+    for funcao, colunas in ((menor, minimos), (maior, maximos)):
+        for coluna in colunas:
+            valores[coluna] = funcao(func.coalesce(tabela.c[coluna], novo[coluna]),
+                                     func.coalesce(novo[coluna], tabela.c[coluna]))
+    if dialeto == 'mysql':
+        return stmt.on_duplicate_key_update(valores)
+    return stmt.on_conflict_do_update(index_elements=chaves, set_=valores)
 
+def upsert_linha(tabela, chaves, colunas_atualizar, linha):
+    """Executa o upsert de uma linha e retorna o id da linha inserida ou atualizada, sem outra consulta.
 
+    SQLite e PostgreSQL usam RETURNING. O MySQL não tem RETURNING: o UPDATE da
+    chave duplicada faz id = LAST_INSERT_ID(id), então o lastrowid do comando
+    é o id também quando a linha já existia. O commit fica com quem chama.
+    """
+    dialeto, insert = _modulo_insert_dialeto()
+    stmt = insert(tabela).values(linha)
+    if dialeto == 'mysql':
+        valores = {coluna: stmt.inserted[coluna] for coluna in colunas_atualizar}
+        valores['id'] = func.last_insert_id(tabela.c.id)
+        return db.session.execute(stmt.on_duplicate_key_update(valores)).lastrowid
+    stmt = stmt.on_conflict_do_update(
+        index_elements=chaves,
+        set_={coluna: stmt.excluded[coluna] for coluna in colunas_atualizar}
+    ).returning(tabela.c.id)
+    return db.session.execute(stmt).scalar()
 
 
+def insert_ignorando_duplicatas(tabela, linhas):
+    """Monta um INSERT de várias linhas que descarta as que violam uma chave única.
+
+    MySQL usa INSERT IGNORE; SQLite e PostgreSQL usam ON CONFLICT DO NOTHING.
+    As linhas vão em um único comando, então o rowcount do resultado é a
+    quantidade realmente inserida.
+    """
+    dialeto, insert = _modulo_insert_dialeto()
+    stmt = insert(tabela).values(linhas)
+    if dialeto == 'mysql':
+        return stmt.prefix_with('IGNORE')
+    return stmt.on_conflict_do_nothing()
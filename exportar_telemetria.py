@@ -0,0 +1,72 @@
+"""
+Exportação das medições brutas de um parque ou inversor
+Execute: python exportar_telemetria.py (--parque ID | --inversor ID) [--inicio 2024-01-01] [--fim 2024-12-31]
+         [--formato csv|ndjson|parquet] [--gzip] [--saida arquivo]
+
+Usa o mesmo stream de /api/telemetria/exportar: as medições são lidas do
+banco em blocos com cursor no servidor e gravadas à medida que chegam, com
+memória constante para qualquer período. Sem --saida, escreve na saída
+padrão.
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+logger = logging.getLogger('exportar_telemetria')
+
+def main():
+    parser = argparse.ArgumentParser(description='Exporta as medições brutas de um parque ou inversor')
+    origem = parser.add_mutually_exclusive_group(required=True)
+    origem.add_argument('--parque', type=int, help='Id do parque exportado')
+    origem.add_argument('--inversor', type=int, help='Id do inversor exportado')
+    parser.add_argument('--inicio', help='Data ou data e hora ISO do início do período')
+    parser.add_argument('--fim', help='Data ou data e hora ISO do fim do período (uma data inclui o dia inteiro)')
+    parser.add_argument('--formato', choices=('csv', 'ndjson', 'parquet'), default='csv', help='Formato (padrão: csv)')
+    parser.add_argument('--gzip', action='store_true', help='Compacta a saída com gzip')
+    parser.add_argument('--saida', help='Arquivo de saída (padrão: saída padrão)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s', stream=sys.stderr)
+
+    from app import app
+    from database import db
+    from services.historico_telemetria import ler_instante
+    from services.exportacao_telemetria import exportar_medicoes, listar_inversores_exportacao, parquet_disponivel
+
+    if args.formato == 'parquet' and not parquet_disponivel():
+        parser.error('o formato parquet requer pandas e pyarrow instalados')
+    try:
+        inicio = ler_instante(args.inicio)
+        fim = ler_instante(args.fim, fim=True)
+    except ValueError as e:
+        parser.error(f'período inválido: {e}')
+
+    inicio_exportacao = time.monotonic()
+    with app.app_context():
+        try:
+            inversores = listar_inversores_exportacao(args.inversor, args.parque)
+            if not inversores:
+                parser.error('inversor ou parque sem inversores cadastrados')
+
+            saida = open(args.saida, 'wb') if args.saida else sys.stdout.buffer
+            total = 0
+            try:
+                for parte in exportar_medicoes(inversores, args.formato, inicio, fim, args.gzip):
+                    saida.write(parte)
+                    total += len(parte)
+            finally:
+                if args.saida:
+                    saida.close()
+                else:
+                    saida.flush()
+        finally:
+            db.session.remove()
+
+    logger.info('Exportação concluída: %d inversor(es), %d bytes em %.2fs',
+                len(inversores), total, time.monotonic() - inicio_exportacao)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, BooleanField, FloatField, DateField, TextAreaField, SelectField, FileField
-from wtforms.validators import DataRequired, Email, Length, NumberRange, ValidationError
+from wtforms import StringField, PasswordField, BooleanField, FloatField, IntegerField, DateField, TextAreaField, SelectField, FileField
+from wtforms.validators import DataRequired, Email, Length, NumberRange, Optional, ValidationError
 from datetime import date
 
 class LoginForm(FlaskForm):
@@ -58,8 +58,10 @@ class RegraForm(FlaskForm):
         ('temperatura', 'Temperatura (°C)'),
         ('geracao', 'Geração (kW)'),
         ('tensao', 'Tensão (V)'),
-        ('corrente', 'Corrente (A)')
+        ('corrente', 'Corrente (A)'),
+        ('expressao', 'Expressão composta')
     ], validators=[DataRequired()])
+    expressao = TextAreaField('Expressão', validators=[Optional(), Length(max=500)])
     operador = SelectField('Operador', choices=[
         ('<', 'Menor que (<)'),
         ('>', 'Maior que (>)'),
@@ -67,7 +69,13 @@ class RegraForm(FlaskForm):
         ('>=', 'Maior ou igual (>=)'),
         ('==', 'Igual a (==)')
     ], validators=[DataRequired()])
-    valor_threshold = FloatField('Valor Limite', validators=[DataRequired()])
+    valor_threshold = FloatField('Valor Limite', validators=[Optional()])
+    janela_tipo = SelectField('Avaliação', choices=[
+        ('instantanea', 'Última leitura'),
+        ('media', 'Média da janela (minutos)'),
+        ('consecutivas', 'Leituras consecutivas')
+    ], default='instantanea')
+    janela = IntegerField('Tamanho da Janela', validators=[Optional(), NumberRange(min=1, max=512)])
     severidade = SelectField('Severidade', choices=[
         ('baixa', 'Baixa'),
         ('media', 'Média'),
@@ -75,6 +83,19 @@ class RegraForm(FlaskForm):
         ('critica', 'Crítica')
     ], default='media')
     ativo = BooleanField('Regra Ativa', default=True)
+    parque_id = SelectField('Parque', coerce=int, default=0)
+    modelo_inversor = StringField('Modelo de Inversor', validators=[Optional(), Length(max=100)])
+    inversores_ids = StringField('IDs de Inversores', validators=[Optional(), Length(max=2000)])
+    
+    def __init__(self, *args, **kwargs):
+        super(RegraForm, self).__init__(*args, **kwargs)
+        from models import Parque
+        self.parque_id.choices = [(0, 'Todos os parques')] + [(p.id, p.nome) for p in Parque.query.all()]
+    
+    def validate_inversores_ids(self, field):
+        itens = [item.strip() for item in (field.data or '').split(',') if item.strip()]
+        if not all(item.isdigit() for item in itens):
+            raise ValidationError('Informe os IDs dos inversores separados por vírgula.')
 
 class UploadCSVForm(FlaskForm):
     arquivo = FileField('Arquivo CSV', validators=[DataRequired()])
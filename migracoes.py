@@ -0,0 +1,255 @@
+"""
+Script de migração do esquema do banco de dados HELIOS
+Execute: python migracoes.py
+
+Bancos novos já são criados com o esquema atual por db.create_all().
+Este script atualiza bancos existentes. Cada migração verifica o estado
+do banco antes de alterar, então o script pode ser executado várias vezes.
+"""
+
+from app import app
+from database import db
+from models import EXPRESSAO_INVERSOR_ABERTO, MedicaoTelemetria, AgregadoInversorHora
+from datetime import datetime
+from sqlalchemy import inspect, text
+
+def indices_tabela(tabela):
+    """Retorna os nomes dos índices e restrições únicas de uma tabela"""
+    inspetor = inspect(db.engine)
+    nomes = {indice['name'] for indice in inspetor.get_indexes(tabela)}
+    nomes.update(restricao['name'] for restricao in inspetor.get_unique_constraints(tabela))
+    return nomes
+
+def colunas_tabela(tabela):
+    """Retorna os nomes das colunas de uma tabela"""
+    return {coluna['name'] for coluna in inspect(db.engine).get_columns(tabela)}
+
+# Linhas atualizadas por transação ao preencher colunas novas em tabelas grandes
+TAMANHO_BLOCO_BACKFILL = 50000
+
+def chave_natural_medicoes():
+    """Remove medições duplicadas e cria o índice único (inversor_id, data_medicao, hora_medicao)"""
+    if 'uq_medicao_inversor_momento' in indices_tabela('medicoes_telemetria'):
+        return False
+    
+    # Mantém a primeira medição de cada chave natural
+    db.session.execute(text("""
+        DELETE FROM medicoes_telemetria
+        WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT MIN(id) AS id FROM medicoes_telemetria
+                GROUP BY inversor_id, data_medicao, hora_medicao
+            ) AS manter
+        )
+    """))
+    db.session.execute(text(
+        'CREATE UNIQUE INDEX uq_medicao_inversor_momento '
+        'ON medicoes_telemetria (inversor_id, data_medicao, hora_medicao)'
+    ))
+    db.session.commit()
+    return True
+
+def medido_em_medicoes():
+    """Cria a coluna medido_em (data + hora), preenche a partir das colunas existentes e indexa por inversor"""
+    if 'ix_medicao_inversor_medido_em' in indices_tabela('medicoes_telemetria'):
+        return False
+    
+    dialeto = db.engine.dialect.name
+    if 'medido_em' not in colunas_tabela('medicoes_telemetria'):
+        tipo = db.DateTime().compile(dialect=db.engine.dialect)
+        db.session.execute(text(f'ALTER TABLE medicoes_telemetria ADD COLUMN medido_em {tipo}'))
+        db.session.commit()
+    
+    if dialeto == 'mysql':
+        expressao = 'TIMESTAMP(data_medicao, hora_medicao)'
+    elif dialeto == 'sqlite':
+        # Mesmo formato de texto que o SQLAlchemy usa para DateTime no SQLite
+        expressao = "data_medicao || ' ' || hora_medicao"
+    else:
+        expressao = 'data_medicao + hora_medicao'
+    
+    # Preencher em blocos de ids para não manter uma transação longa
+    maior_id = db.session.execute(text('SELECT MAX(id) FROM medicoes_telemetria')).scalar() or 0
+    for inicio in range(0, maior_id + 1, TAMANHO_BLOCO_BACKFILL):
+        db.session.execute(text(
+            f'UPDATE medicoes_telemetria SET medido_em = {expressao} '
+            'WHERE id >= :inicio AND id < :fim AND medido_em IS NULL'
+        ), {'inicio': inicio, 'fim': inicio + TAMANHO_BLOCO_BACKFILL})
+        db.session.commit()
+    
+    if dialeto == 'mysql':
+        db.session.execute(text('ALTER TABLE medicoes_telemetria MODIFY medido_em DATETIME NOT NULL'))
+    elif dialeto == 'postgresql':
+        db.session.execute(text('ALTER TABLE medicoes_telemetria ALTER COLUMN medido_em SET NOT NULL'))
+    
+    db.session.execute(text(
+        'CREATE INDEX ix_medicao_inversor_medido_em ON medicoes_telemetria (inversor_id, medido_em)'
+    ))
+    db.session.commit()
+    return True
+
+# Índices secundários das tabelas de telemetria e alertas: nome -> (tabela, colunas)
+INDICES_TELEMETRIA = {
+    'ix_medicao_medido_em': ('medicoes_telemetria', 'medido_em'),
+    'ix_medicao_registro_em': ('medicoes_telemetria', 'registro_em'),
+    'ix_alerta_inversor_regra_resolvido': ('alertas', 'inversor_id, regra_id, resolvido'),
+    'ix_alerta_resolvido': ('alertas', 'resolvido'),
+    'ix_alerta_regra_criado_em': ('alertas', 'regra_id, criado_em'),
+}
+
+def indices_telemetria():
+    """Cria os índices de consulta de medicoes_telemetria e alertas"""
+    criados = False
+    for nome, (tabela, colunas) in INDICES_TELEMETRIA.items():
+        if nome in indices_tabela(tabela):
+            continue
+        db.session.execute(text(f'CREATE INDEX {nome} ON {tabela} ({colunas})'))
+        db.session.commit()
+        criados = True
+    return criados
+
+def janela_regras():
+    """Cria as colunas janela_tipo e janela das regras com janela deslizante"""
+    colunas = colunas_tabela('regras')
+    if 'janela_tipo' in colunas and 'janela' in colunas:
+        return False
+    
+    if 'janela_tipo' not in colunas:
+        db.session.execute(text(
+            "ALTER TABLE regras ADD COLUMN janela_tipo VARCHAR(20) NOT NULL DEFAULT 'instantanea'"
+        ))
+    if 'janela' not in colunas:
+        db.session.execute(text('ALTER TABLE regras ADD COLUMN janela INTEGER'))
+    db.session.commit()
+    return True
+
+def expressao_regras():
+    """Cria a coluna expressao das regras compostas"""
+    if 'expressao' in colunas_tabela('regras'):
+        return False
+    
+    db.session.execute(text('ALTER TABLE regras ADD COLUMN expressao TEXT'))
+    db.session.commit()
+    return True
+
+def escopo_regras():
+    """Cria as colunas de escopo das regras (parque, modelo de inversor e ids de inversores)"""
+    colunas = colunas_tabela('regras')
+    novas = {
+        'parque_id': 'INTEGER REFERENCES parques (id)',
+        'modelo_inversor': 'VARCHAR(100)',
+        'inversores_ids': 'TEXT'
+    }
+    pendentes = {nome: tipo for nome, tipo in novas.items() if nome not in colunas}
+    if not pendentes:
+        return False
+    
+    for nome, tipo in pendentes.items():
+        db.session.execute(text(f'ALTER TABLE regras ADD COLUMN {nome} {tipo}'))
+    db.session.commit()
+    return True
+
+def alerta_aberto_unico():
+    """Resolve alertas abertos duplicados e cria a chave única de alerta aberto por inversor e regra"""
+    if 'uq_alerta_aberto_inversor_regra' in indices_tabela('alertas'):
+        return False
+    
+    # Mantém aberto o alerta mais antigo de cada par (inversor, regra)
+    db.session.execute(text("""
+        UPDATE alertas SET resolvido = :sim, resolvido_em = :agora
+        WHERE (resolvido = :nao OR resolvido IS NULL)
+        AND id NOT IN (
+            SELECT id FROM (
+                SELECT MIN(id) AS id FROM alertas
+                WHERE resolvido = :nao OR resolvido IS NULL
+                GROUP BY inversor_id, regra_id
+            ) AS manter
+        )
+    """), {'sim': True, 'nao': False, 'agora': datetime.utcnow()})
+    db.session.commit()
+    
+    if 'inversor_aberto' not in colunas_tabela('alertas'):
+        # SQLite só aceita colunas calculadas VIRTUAL em ALTER TABLE
+        armazenamento = 'VIRTUAL' if db.engine.dialect.name == 'sqlite' else 'STORED'
+        db.session.execute(text(
+            'ALTER TABLE alertas ADD COLUMN inversor_aberto INTEGER '
+            f'GENERATED ALWAYS AS ({EXPRESSAO_INVERSOR_ABERTO}) {armazenamento}'
+        ))
+        db.session.commit()
+    
+    db.session.execute(text(
+        'CREATE UNIQUE INDEX uq_alerta_aberto_inversor_regra ON alertas (inversor_aberto, regra_id)'
+    ))
+    db.session.commit()
+    return True
+
+def notificacao_alertas():
+    """Cria a coluna notificado dos alertas; alertas existentes não são notificados"""
+    if 'ix_alerta_notificado' in indices_tabela('alertas'):
+        return False
+    
+    if 'notificado' not in colunas_tabela('alertas'):
+        db.session.execute(text('ALTER TABLE alertas ADD COLUMN notificado BOOLEAN NOT NULL DEFAULT FALSE'))
+        db.session.execute(text('UPDATE alertas SET notificado = :sim'), {'sim': True})
+        db.session.commit()
+    
+    db.session.execute(text('CREATE INDEX ix_alerta_notificado ON alertas (notificado)'))
+    db.session.commit()
+    return True
+
+def agregados_telemetria():
+    """Preenche as tabelas de agregados por hora e por dia a partir das medições existentes"""
+    from services.agregados import reconstruir_agregados
+    
+    # As tabelas são criadas vazias por db.create_all() ao importar o app
+    if db.session.query(AgregadoInversorHora.inversor_id).first() is not None:
+        return False
+    if db.session.query(MedicaoTelemetria.id).first() is None:
+        return False
+    
+    reconstruir_agregados()
+    return True
+
+def progresso_importacoes():
+    """Cria a coluna atualizado_em das importações CSV (usada para detectar importações interrompidas)"""
+    if 'atualizado_em' in colunas_tabela('importacoes_csv'):
+        return False
+    
+    tipo = db.DateTime().compile(dialect=db.engine.dialect)
+    db.session.execute(text(f'ALTER TABLE importacoes_csv ADD COLUMN atualizado_em {tipo}'))
+    db.session.execute(text('UPDATE importacoes_csv SET atualizado_em = COALESCE(concluido_em, criado_em)'))
+    db.session.commit()
+    return True
+
+# Migrações na ordem em que devem ser aplicadas
+MIGRACOES = [
+    chave_natural_medicoes,
+    medido_em_medicoes,
+    indices_telemetria,
+    janela_regras,
+    expressao_regras,
+    escopo_regras,
+    alerta_aberto_unico,
+    notificacao_alertas,
+    agregados_telemetria,
+    progresso_importacoes,
+]
+
+def main():
+    """Aplica as migrações pendentes"""
+    print("=" * 60)
+    print("MIGRANDO BANCO DE DADOS HELIOS")
+    print("=" * 60)
+    
+    with app.app_context():
+        for migracao in MIGRACOES:
+            if migracao():
+                print(f"[OK] {migracao.__name__}: aplicada")
+            else:
+                print(f"[--] {migracao.__name__}: já aplicada")
+    
+    print("\n[OK] Banco de dados atualizado!")
+
+
+if __name__ == '__main__':
+    main()
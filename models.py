@@ -1,7 +1,9 @@
 from flask_login import UserMixin
-from datetime import datetime
+from datetime import datetime, time, timedelta
 from werkzeug.security import check_password_hash
 from database import db
+from sqlalchemy import func
+import operator
 
 class Usuario(UserMixin, db.Model):
     __tablename__ = 'usuarios'
@@ -46,7 +48,7 @@ class Parque(db.Model):
         from sqlalchemy import func
         hoje = date.today()
         total = db.session.query(func.sum(MedicaoTelemetria.geracao_kw)).filter(
-            MedicaoTelemetria.data_medicao == hoje,
+            MedicaoTelemetria.no_periodo(hoje, hoje),
             MedicaoTelemetria.inversor_id.in_([inv.id for inv in self.inversores])
         ).scalar()
         return total or 0.0
@@ -76,53 +78,122 @@ class Inversor(db.Model):
         """Calcula a eficiência atual do inversor"""
         medicao_recente = MedicaoTelemetria.query.filter_by(
             inversor_id=self.id
-        ).order_by(MedicaoTelemetria.data_medicao.desc(), MedicaoTelemetria.hora_medicao.desc()).first()
+        ).order_by(MedicaoTelemetria.medido_em.desc()).first()
         
         if medicao_recente and self.capacidade_kw > 0:
             return (medicao_recente.geracao_kw / self.capacidade_kw) * 100
         return 0.0
 
+# Operadores de comparação aceitos pelas regras
+OPERADORES_REGRA = {
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '==': operator.eq
+}
+
+# Coluna de MedicaoTelemetria avaliada por cada tipo de regra
+METRICAS_REGRA = {
+    'eficiencia': 'eficiencia',
+    'temperatura': 'temperatura',
+    'geracao': 'geracao_kw',
+    'tensao': 'tensao',
+    'corrente': 'corrente'
+}
+
 class Regra(db.Model):
     __tablename__ = 'regras'
     
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
     descricao = db.Column(db.Text, nullable=False)
-    tipo = db.Column(db.String(50), nullable=False)  # eficiencia, temperatura, geracao, etc
+    tipo = db.Column(db.String(50), nullable=False)  # eficiencia, temperatura, geracao, etc, ou expressao
     operador = db.Column(db.String(10), nullable=False)  # <, >, <=, >=, ==
     valor_threshold = db.Column(db.Float, nullable=False)
     severidade = db.Column(db.String(20), default='media')  # baixa, media, alta, critica
     ativo = db.Column(db.Boolean, default=True)
+    # instantanea (última leitura), media (média dos últimos `janela` minutos)
+    # ou consecutivas (condição satisfeita nas últimas `janela` leituras)
+    janela_tipo = db.Column(db.String(20), nullable=False, default='instantanea', server_default='instantanea')
+    janela = db.Column(db.Integer)
+    # Condição composta das regras do tipo expressao (ver services/expressoes.py)
+    expressao = db.Column(db.Text)
+    # Escopo opcional: a regra vale só para os inversores que atendem a todos os campos preenchidos
+    parque_id = db.Column(db.Integer, db.ForeignKey('parques.id'))
+    modelo_inversor = db.Column(db.String(100))
+    inversores_ids = db.Column(db.Text)  # ids separados por vírgula
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
     atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relacionamento com Alertas
     alertas = db.relationship('Alerta', backref='regra', lazy=True)
+    parque = db.relationship('Parque', backref=db.backref('regras', lazy=True))
     
     def __repr__(self):
         return f'<Regra {self.nome}>'
     
     def verificar_condicao(self, valor):
         """Verifica se a condição da regra é satisfeita"""
-        if self.operador == '<':
-            return valor < self.valor_threshold
-        elif self.operador == '>':
-            return valor > self.valor_threshold
-        elif self.operador == '<=':
-            return valor <= self.valor_threshold
-        elif self.operador == '>=':
-            return valor >= self.valor_threshold
-        elif self.operador == '==':
-            return valor == self.valor_threshold
-        return False
+        comparar = OPERADORES_REGRA.get(self.operador)
+        if comparar is None:
+            return False
+        return comparar(valor, self.valor_threshold)
+    
+    def descricao_condicao(self):
+        """Condição da regra em texto"""
+        if self.tipo == 'expressao':
+            return self.expressao
+        return f'{self.tipo.title()} {self.operador} {self.valor_threshold}'
+    
+    def lista_inversores_ids(self):
+        """Ids de inversores do escopo da regra (lista vazia se não houver)"""
+        if not self.inversores_ids:
+            return []
+        return [int(item) for item in self.inversores_ids.split(',') if item.strip()]
+    
+    def descricao_escopo(self):
+        """Escopo da regra em texto"""
+        partes = []
+        if self.parque_id:
+            partes.append(f'Parque {self.parque.nome if self.parque else self.parque_id}')
+        if self.modelo_inversor:
+            partes.append(f'Modelo {self.modelo_inversor}')
+        if self.inversores_ids:
+            partes.append(f'Inversores {self.inversores_ids}')
+        return ', '.join(partes) if partes else 'Todos os inversores'
+    
+    def descricao_janela(self):
+        """Descrição da janela de avaliação da regra"""
+        if self.janela_tipo == 'media':
+            return f'Média dos últimos {self.janela} minutos'
+        if self.janela_tipo == 'consecutivas':
+            return f'{self.janela} leituras consecutivas'
+        return 'Última leitura'
+
+def _medido_em_padrao(contexto):
+    """Combina data e hora da medição quando medido_em não é informado"""
+    parametros = contexto.get_current_parameters()
+    return datetime.combine(parametros['data_medicao'], parametros['hora_medicao'])
 
 class MedicaoTelemetria(db.Model):
     __tablename__ = 'medicoes_telemetria'
+    __table_args__ = (
+        # Chave natural: reenvios do gateway não duplicam medições
+        db.UniqueConstraint('inversor_id', 'data_medicao', 'hora_medicao', name='uq_medicao_inversor_momento'),
+        # Últimas medições e intervalos de tempo por inversor
+        db.Index('ix_medicao_inversor_medido_em', 'inversor_id', 'medido_em'),
+        # Agregações e últimas medições da frota inteira por período
+        db.Index('ix_medicao_medido_em', 'medido_em'),
+        # Medições recebidas recentemente (fallback de eficiência do dashboard)
+        db.Index('ix_medicao_registro_em', 'registro_em'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     inversor_id = db.Column(db.Integer, db.ForeignKey('inversores.id'), nullable=False)
     data_medicao = db.Column(db.Date, nullable=False)
     hora_medicao = db.Column(db.Time, nullable=False)
+    medido_em = db.Column(db.DateTime, nullable=False, default=_medido_em_padrao)  # data_medicao + hora_medicao
     geracao_kw = db.Column(db.Float, nullable=False)
     temperatura = db.Column(db.Float)
     tensao = db.Column(db.Float)
@@ -133,9 +204,116 @@ class MedicaoTelemetria(db.Model):
     
     def __repr__(self):
         return f'<MedicaoTelemetria {self.inversor_id} - {self.data_medicao}>'
+    
+    @staticmethod
+    def no_periodo(inicio, fim):
+        """Filtro das medições entre as datas inicio e fim (inclusivas) sobre medido_em"""
+        return db.and_(
+            MedicaoTelemetria.medido_em >= datetime.combine(inicio, time.min),
+            MedicaoTelemetria.medido_em < datetime.combine(fim + timedelta(days=1), time.min)
+        )
+
+# Métricas das tabelas de agregados; cada uma tem soma, quantidade (leituras
+# com valor), mínimo e máximo, e a média é soma / quantidade
+METRICAS_AGREGADAS = ('geracao_kw', 'temperatura', 'tensao', 'corrente', 'frequencia', 'eficiencia')
+
+# Estatísticas de cada métrica e como combinar linhas de agregados
+ESTATISTICAS_AGREGADAS = ('soma', 'qtd', 'min', 'max')
+
+class AgregadoMixin:
+    """Colunas comuns das tabelas de agregados de telemetria por hora e por dia"""
+    
+    leituras = db.Column(db.Integer, nullable=False, default=0)
+    
+    @classmethod
+    def colunas_estatisticas(cls):
+        """Nomes das colunas de estatísticas (leituras e as de cada métrica)"""
+        return ['leituras'] + [f'{metrica}_{estatistica}'
+                               for metrica in METRICAS_AGREGADAS for estatistica in ESTATISTICAS_AGREGADAS]
+    
+    @classmethod
+    def soma(cls, metrica):
+        """Expressão SQL da soma da métrica sobre as linhas agrupadas"""
+        return func.sum(getattr(cls, f'{metrica}_soma'))
+    
+    @classmethod
+    def media(cls, metrica):
+        """Expressão SQL da média da métrica sobre as linhas agrupadas (NULL sem leituras)"""
+        return func.sum(getattr(cls, f'{metrica}_soma')) / func.nullif(func.sum(getattr(cls, f'{metrica}_qtd')), 0)
+
+for _metrica in METRICAS_AGREGADAS:
+    setattr(AgregadoMixin, f'{_metrica}_soma', db.Column(db.Float))
+    setattr(AgregadoMixin, f'{_metrica}_qtd', db.Column(db.Integer, nullable=False, default=0))
+    setattr(AgregadoMixin, f'{_metrica}_min', db.Column(db.Float))
+    setattr(AgregadoMixin, f'{_metrica}_max', db.Column(db.Float))
+del _metrica
+
+class AgregadoInversorHora(AgregadoMixin, db.Model):
+    """Estatísticas das medições de um inversor em uma hora (inicio truncado na hora)"""
+    __tablename__ = 'agregados_inversor_hora'
+    __table_args__ = (
+        db.Index('ix_agregado_inversor_hora_inicio', 'inicio'),
+    )
+    
+    inversor_id = db.Column(db.Integer, db.ForeignKey('inversores.id'), primary_key=True)
+    inicio = db.Column(db.DateTime, primary_key=True)
+    
+    inversor = db.relationship('Inversor', backref=db.backref('agregados_hora', lazy=True, cascade='all, delete-orphan'))
+
+class AgregadoInversorDia(AgregadoMixin, db.Model):
+    """Estatísticas das medições de um inversor em um dia"""
+    __tablename__ = 'agregados_inversor_dia'
+    __table_args__ = (
+        db.Index('ix_agregado_inversor_dia_data', 'data'),
+    )
+    
+    inversor_id = db.Column(db.Integer, db.ForeignKey('inversores.id'), primary_key=True)
+    data = db.Column(db.Date, primary_key=True)
+    
+    inversor = db.relationship('Inversor', backref=db.backref('agregados_dia', lazy=True, cascade='all, delete-orphan'))
+
+class AgregadoParqueHora(AgregadoMixin, db.Model):
+    """Estatísticas das medições dos inversores de um parque em uma hora"""
+    __tablename__ = 'agregados_parque_hora'
+    __table_args__ = (
+        db.Index('ix_agregado_parque_hora_inicio', 'inicio'),
+    )
+    
+    parque_id = db.Column(db.Integer, db.ForeignKey('parques.id'), primary_key=True)
+    inicio = db.Column(db.DateTime, primary_key=True)
+    
+    parque = db.relationship('Parque', backref=db.backref('agregados_hora', lazy=True, cascade='all, delete-orphan'))
+
+class AgregadoParqueDia(AgregadoMixin, db.Model):
+    """Estatísticas das medições dos inversores de um parque em um dia"""
+    __tablename__ = 'agregados_parque_dia'
+    __table_args__ = (
+        db.Index('ix_agregado_parque_dia_data', 'data'),
+    )
+    
+    parque_id = db.Column(db.Integer, db.ForeignKey('parques.id'), primary_key=True)
+    data = db.Column(db.Date, primary_key=True)
+    
+    parque = db.relationship('Parque', backref=db.backref('agregados_dia', lazy=True, cascade='all, delete-orphan'))
+
+
+# Chave de alerta aberto: repete inversor_id enquanto o alerta não foi resolvido
+EXPRESSAO_INVERSOR_ABERTO = 'CASE WHEN resolvido THEN NULL ELSE inversor_id END'
 
 class Alerta(db.Model):
     __tablename__ = 'alertas'
+    __table_args__ = (
+        # Verificação de alerta aberto por inversor e regra
+        db.Index('ix_alerta_inversor_regra_resolvido', 'inversor_id', 'regra_id', 'resolvido'),
+        # No máximo um alerta aberto por inversor e regra (inversor_aberto é NULL nos resolvidos)
+        db.UniqueConstraint('inversor_aberto', 'regra_id', name='uq_alerta_aberto_inversor_regra'),
+        # Alertas ainda não distribuídos aos destinos de notificação
+        db.Index('ix_alerta_notificado', 'notificado'),
+        # Contagem de alertas ativos
+        db.Index('ix_alerta_resolvido', 'resolvido'),
+        # Alertas recentes de uma regra
+        db.Index('ix_alerta_regra_criado_em', 'regra_id', 'criado_em'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     inversor_id = db.Column(db.Integer, db.ForeignKey('inversores.id'), nullable=False)
@@ -145,10 +323,138 @@ class Alerta(db.Model):
     resolvido = db.Column(db.Boolean, default=False)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
     resolvido_em = db.Column(db.DateTime)
+    # Calculada pelo banco: inversor_id enquanto o alerta está aberto
+    inversor_aberto = db.Column(db.Integer, db.Computed(EXPRESSAO_INVERSOR_ABERTO, persisted=True))
+    # Já distribuído aos destinos de notificação pelo worker de notificações
+    notificado = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     
     def __repr__(self):
         return f'<Alerta {self.id} - {self.severidade}>'
 
+class EnvioNotificacao(db.Model):
+    """Entrega pendente ou concluída de um alerta a um destino de notificação"""
+    __tablename__ = 'envios_notificacao'
+    __table_args__ = (
+        # Um envio por alerta e destino, mesmo se a distribuição for repetida
+        db.UniqueConstraint('destino', 'alerta_id', name='uq_envio_destino_alerta'),
+        # Envios pendentes de um destino com tentativa vencida
+        db.Index('ix_envio_destino_status_proxima', 'destino', 'status', 'proxima_tentativa_em'),
+        # Latência das entregas recentes de um destino
+        db.Index('ix_envio_destino_enviado_em', 'destino', 'enviado_em'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    destino = db.Column(db.String(50), nullable=False)
+    alerta_id = db.Column(db.Integer, db.ForeignKey('alertas.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pendente')  # pendente, enviado, falhou
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    erro = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    enviado_em = db.Column(db.DateTime)
+    
+    alerta = db.relationship('Alerta', backref=db.backref('envios', lazy=True, cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<EnvioNotificacao {self.destino} alerta {self.alerta_id} - {self.status}>'
+
+class ImportacaoCSV(db.Model):
+    __tablename__ = 'importacoes_csv'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    inversor_id = db.Column(db.Integer, db.ForeignKey('inversores.id'), nullable=False)
+    nome_arquivo = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), default='pendente')  # pendente, processando, concluida, falhou
+    tamanho_bytes = db.Column(db.BigInteger, default=0)
+    bytes_processados = db.Column(db.BigInteger, default=0)
+    linhas_processadas = db.Column(db.Integer, default=0)
+    linhas_erro = db.Column(db.Integer, default=0)
+    erros = db.Column(db.Text)  # JSON com as primeiras linhas com erro
+    mensagem = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # último progresso gravado
+    concluido_em = db.Column(db.DateTime)
+    
+    inversor = db.relationship('Inversor', backref=db.backref('importacoes', lazy=True, cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<ImportacaoCSV {self.id} - {self.status}>'
+    
+    def progresso(self):
+        """Percentual do arquivo já processado"""
+        if self.status == 'concluida':
+            return 100.0
+        if not self.tamanho_bytes:
+            return 0.0
+        return min(100.0, (self.bytes_processados or 0) * 100.0 / self.tamanho_bytes)
+
+class MedicaoRejeitada(db.Model):
+    """Medição já aceita pela API que não pôde ser gravada (fila de mensagens mortas).
+
+    A fila de ingestão assíncrona guarda aqui as linhas que o banco recusou,
+    para inspeção e reenvio manual.
+    """
+    __tablename__ = 'medicoes_rejeitadas'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    origem = db.Column(db.String(50), nullable=False)
+    dados = db.Column(db.Text, nullable=False)  # JSON da medição
+    erro = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<MedicaoRejeitada {self.id} - {self.origem}>'
+
+class VersaoCache(db.Model):
+    """Versão de dados mantidos em cache pelos processos (regras, inversores, etc).
+
+    Cada alteração incrementa a versão; os processos comparam a versão em
+    cache com a do banco para saber quando recarregar.
+    """
+    __tablename__ = 'versoes_cache'
+    
+    chave = db.Column(db.String(50), primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<VersaoCache {self.chave} v{self.versao}>'
+    
+    @staticmethod
+    def obter(chave):
+        """Retorna a versão atual da chave (0 se nunca foi incrementada)"""
+        return db.session.query(VersaoCache.versao).filter_by(chave=chave).scalar() or 0
+    
+    @staticmethod
+    def incrementar(chave):
+        """Incrementa a versão da chave na transação atual (o commit fica com quem chama)"""
+        atualizados = VersaoCache.query.filter_by(chave=chave).update({
+            'versao': VersaoCache.versao + 1,
+            'atualizado_em': datetime.utcnow()
+        })
+        if not atualizados:
+            db.session.add(VersaoCache(chave=chave, versao=1))
+
+class VersaoTelemetriaDia(db.Model):
+    """Versão da telemetria em que as medições de cada dia mudaram pela última vez.
+
+    Guarda o valor da versão 'telemetria' de versoes_cache da gravação que
+    alterou o dia. Uma resposta em cache que lê um período depende só da
+    maior versão entre os dias do período; dias sem linha nunca mudaram.
+    """
+    __tablename__ = 'versoes_telemetria_dia'
+    
+    data = db.Column(db.Date, primary_key=True)
+    versao = db.Column(db.Integer, nullable=False)
+    
+    __table_args__ = (
+        # Carga incremental dos dias alterados desde uma versão
+        db.Index('ix_versao_telemetria_dia_versao', 'versao'),
+    )
+    
+    def __repr__(self):
+        return f'<VersaoTelemetriaDia {self.data} v{self.versao}>'
+
 class PlacaSolar(db.Model):
     __tablename__ = 'placas_solares'
     
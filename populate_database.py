@@ -9,6 +9,7 @@ from models import (
     Usuario, Parque, Inversor, PlacaSolar, Regra, 
     MedicaoTelemetria, Alerta
 )
+from services.agregados import reconstruir_agregados
 from werkzeug.security import generate_password_hash
 from datetime import datetime, date, time, timedelta
 import random
@@ -511,6 +512,10 @@ def criar_medicoes_telemetria(inversores, dias_historico=30):
     
     db.session.commit()
     print(f"[OK] {len(medicoes)} medicoes de telemetria criadas")
+    
+    # Medições inseridas direto pelo ORM: calcular os agregados dos gráficos
+    reconstruir_agregados()
+    print("[OK] Agregados de telemetria por hora e por dia calculados")
     return medicoes
 
 
@@ -574,7 +579,9 @@ def criar_alertas(inversores, regras, medicoes):
                                 regra_id=regra.id,
                                 mensagem=mensagem,
                                 severidade=regra.severidade,
-                                resolvido=random.choice([True, False]) if random.random() < 0.4 else False
+                                resolvido=random.choice([True, False]) if random.random() < 0.4 else False,
+                                # Histórico de demonstração: não é enviado pelo worker de notificações
+                                notificado=True
                             )
                             
                             if alerta.resolvido:
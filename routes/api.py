@@ -1,12 +1,48 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask_login import login_required
-from models import MedicaoTelemetria, Inversor, PlacaSolar, Parque, db
-from datetime import datetime, date, timedelta
-from sqlalchemy import func, extract
+from models import Inversor, Parque, Regra, METRICAS_AGREGADAS, db
+from datetime import date, timedelta
 from services.regras_service import verificar_alertas_inversor
+from services.telemetria_service import preparar_medicao, inserir_medicoes, inserir_medicao, agrupar_por_inversor
+from services.fila_ingestao import obter_fila
+from services.cache_inversores import obter_inversor, obter_inversores
+from services.regras_compiladas import compilar_regra
+from services.backtest_regras import backtest_regra
+from services.notificadores import obter_destinos
+from services.notificacoes_service import estatisticas_notificacoes
+from services.dashboard_metricas import obter_metricas_dashboard
+from services.dashboard_eventos import assinar_dashboard, transmitir
+from services.graficos import (grafico_geracao_tempo, grafico_status_placas, grafico_eficiencia_hora,
+                               grafico_temperatura_geracao, grafico_parques_comparacao, graficos_bundle,
+                               MAX_DIAS_GRAFICOS)
+from services.cache_respostas import (
+    resposta_em_cache, obter_cache_respostas, CHAVE_VERSAO_PARQUES, CHAVE_VERSAO_PLACAS
+)
+from services.series_telemetria import (serie_telemetria, periodo_serie, METODOS_REDUCAO, MIN_PONTOS,
+                                        MAX_PONTOS)
+from services.historico_telemetria import (pagina_medicoes, decodificar_cursor, ler_campos, ler_instante,
+                                           MAX_LIMITE_HISTORICO)
+from services.exportacao_telemetria import (exportar_medicoes, listar_inversores_exportacao, parquet_disponivel,
+                                            nome_arquivo_exportacao, FORMATOS_EXPORTACAO, TIPOS_CONTEUDO)
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 api_bp = Blueprint('api', __name__)
 
+def _ultimos_dias(*parametros):
+    """Período lido pelos gráficos diários: os últimos N dias, N o maior dos parâmetros (padrão 7)"""
+    def periodo():
+        dias = max(request.args.get(parametro, 7, type=int) for parametro in parametros)
+        hoje = date.today()
+        return hoje - timedelta(days=dias - 1), hoje
+    return periodo
+
+def _hoje():
+    hoje = date.today()
+    return hoje, hoje
+
 @api_bp.route('/telemetria/data', methods=['POST'])
 def receber_telemetria():
     """API RESTful para receber dados de telemetria em tempo real"""
@@ -19,326 +55,416 @@ def receber_telemetria():
         
         inversor_id = data.get('inversor_id')
         geracao_kw = data.get('geracao_kw')
-        data_medicao = data.get('data_medicao')
-        hora_medicao = data.get('hora_medicao')
         
         if not inversor_id or geracao_kw is None:
             return jsonify({'erro': 'Campos obrigatórios: inversor_id, geracao_kw'}), 400
         
         # Verificar se inversor existe
-        inversor = Inversor.query.get(inversor_id)
+        inversor = obter_inversor(inversor_id)
         if not inversor:
             return jsonify({'erro': 'Inversor não encontrado'}), 404
         
-        # Processar data e hora
-        if data_medicao:
-            try:
-                data_med = datetime.strptime(data_medicao, '%Y-%m-%d').date()
-            except ValueError:
-                return jsonify({'erro': 'Formato de data inválido. Use YYYY-MM-DD'}), 400
-        else:
-            data_med = datetime.now().date()
+        try:
+            valores = preparar_medicao(data, inversor)
+        except ValueError as e:
+            return jsonify({'erro': str(e)}), 400
         
-        if hora_medicao:
-            try:
-                hora_med = datetime.strptime(hora_medicao, '%H:%M:%S').time()
-            except ValueError:
-                return jsonify({'erro': 'Formato de hora inválido. Use HH:MM:SS'}), 400
-        else:
-            hora_med = datetime.now().time()
+        # Modo assíncrono: enfileirar e responder imediatamente
+        if current_app.config['INGESTAO_ASSINCRONA']:
+            fila = obter_fila()
+            if not fila.enfileirar([valores]):
+                return _resposta_fila_cheia(fila)
+            return jsonify({
+                'sucesso': True,
+                'mensagem': 'Medição enfileirada para gravação'
+            }), 202
         
-        # Calcular eficiência
-        eficiencia = None
-        if inversor.capacidade_kw > 0:
-            eficiencia = (float(geracao_kw) / inversor.capacidade_kw) * 100
+        # Gravar medição (reenvios com a mesma data/hora substituem a anterior)
+        medicao_id = inserir_medicao(valores)
         
-        # Criar medição
-        medicao = MedicaoTelemetria(
-            inversor_id=inversor_id,
-            data_medicao=data_med,
-            hora_medicao=hora_med,
-            geracao_kw=float(geracao_kw),
-            temperatura=data.get('temperatura'),
-            tensao=data.get('tensao'),
-            corrente=data.get('corrente'),
-            frequencia=data.get('frequencia'),
-            eficiencia=eficiencia
-        )
-        
-        db.session.add(medicao)
-        db.session.commit()
-        
-        # Verificar regras de alerta
-        verificar_alertas_inversor(inversor_id)
+        # Verificar regras de alerta; a medição já está gravada, então uma falha
+        # aqui não muda a resposta (a varredura periódica reavalia as regras)
+        _verificar_alertas({inversor.id: [valores]})
         
         return jsonify({
             'sucesso': True,
             'mensagem': 'Medição registrada com sucesso',
-            'medicao_id': medicao.id
+            'medicao_id': medicao_id
         }), 201
     
     except Exception as e:
         db.session.rollback()
         return jsonify({'erro': f'Erro ao processar telemetria: {str(e)}'}), 500
 
+def _verificar_alertas(grupos):
+    """Verifica as regras de cada inversor ({inversor_id: medições}) após a gravação, sem propagar erros"""
+    for inversor_id, medicoes in grupos.items():
+        try:
+            verificar_alertas_inversor(inversor_id, medicoes)
+        except Exception:
+            db.session.rollback()
+            logger.exception('Erro ao verificar as regras do inversor %s', inversor_id)
+
+def _resposta_fila_cheia(fila):
+    resposta = jsonify({'erro': 'Fila de ingestão cheia. Tente novamente mais tarde.'})
+    resposta.headers['Retry-After'] = str(fila.retry_after())
+    return resposta, 429
+
+# Limite de registros aceitos em uma única requisição de lote
+MAX_REGISTROS_LOTE = 5000
+
+def _ler_registros_lote():
+    """Lê o corpo da requisição de lote como JSON array ou NDJSON.
+
+    Retorna uma lista de tuplas (registro, erro), uma por registro recebido.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        registros = []
+        for linha in request.get_data(as_text=True).splitlines():
+            if not linha.strip():
+                continue
+            try:
+                registros.append((json.loads(linha), None))
+            except ValueError:
+                registros.append((None, 'Linha NDJSON inválida'))
+        return registros
+    
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, list):
+        return None
+    return [(registro, None) for registro in dados]
+
+@api_bp.route('/telemetria/batch', methods=['POST'])
+def receber_telemetria_lote():
+    """API para receber lotes de medições de vários inversores em uma única requisição"""
+    try:
+        registros = _ler_registros_lote()
+        
+        if registros is None:
+            return jsonify({'erro': 'Envie um array JSON ou NDJSON (application/x-ndjson)'}), 400
+        if not registros:
+            return jsonify({'erro': 'Nenhuma medição fornecida'}), 400
+        if len(registros) > MAX_REGISTROS_LOTE:
+            return jsonify({'erro': f'Lote excede o limite de {MAX_REGISTROS_LOTE} medições'}), 413
+        
+        # Pré-carregar no cache os inversores do lote, com no máximo uma consulta
+        obter_inversores(
+            registro.get('inversor_id') for registro, erro in registros if isinstance(registro, dict)
+        )
+        
+        resultados = []
+        linhas = []
+        for indice, (registro, erro) in enumerate(registros):
+            if erro is None:
+                if not isinstance(registro, dict):
+                    erro = 'Registro deve ser um objeto JSON'
+                elif not registro.get('inversor_id') or registro.get('geracao_kw') is None:
+                    erro = 'Campos obrigatórios: inversor_id, geracao_kw'
+                else:
+                    inversor = obter_inversor(registro['inversor_id'])
+                    if inversor is None:
+                        erro = 'Inversor não encontrado'
+                    else:
+                        try:
+                            linhas.append(preparar_medicao(registro, inversor))
+                        except ValueError as e:
+                            erro = str(e)
+            
+            if erro:
+                resultados.append({'indice': indice, 'aceito': False, 'erro': erro})
+            else:
+                resultados.append({'indice': indice, 'aceito': True})
+        
+        if linhas and current_app.config['INGESTAO_ASSINCRONA']:
+            fila = obter_fila()
+            if not fila.enfileirar(linhas):
+                return _resposta_fila_cheia(fila)
+            return jsonify({
+                'sucesso': True,
+                'aceitas': len(linhas),
+                'rejeitadas': len(resultados) - len(linhas),
+                'resultados': resultados
+            }), 202
+        
+        if linhas:
+            inserir_medicoes(linhas)
+            
+            # Verificar regras de alerta uma vez por inversor, com as leituras do lote
+            _verificar_alertas(agrupar_por_inversor(linhas))
+        
+        return jsonify({
+            'sucesso': bool(linhas),
+            'aceitas': len(linhas),
+            'rejeitadas': len(resultados) - len(linhas),
+            'resultados': resultados
+        }), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': f'Erro ao processar lote de telemetria: {str(e)}'}), 500
+
+@api_bp.route('/telemetria/fila', methods=['GET'])
+@login_required
+def estatisticas_fila_ingestao():
+    """API para monitoramento da fila de ingestão assíncrona"""
+    if not current_app.config['INGESTAO_ASSINCRONA']:
+        return jsonify({'ativa': False}), 200
+    return jsonify({'ativa': True, **obter_fila().estatisticas()}), 200
+
+@api_bp.route('/cache/estatisticas', methods=['GET'])
+@login_required
+def estatisticas_cache_respostas():
+    """API para monitoramento do cache de respostas dos gráficos e filtros"""
+    cache = obter_cache_respostas()
+    if cache is None:
+        return jsonify({'ativo': False}), 200
+    return jsonify({'ativo': True, **cache.estatisticas()}), 200
+
+@api_bp.route('/notificacoes/estatisticas', methods=['GET'])
+@login_required
+def estatisticas_notificacoes_api():
+    """API para monitoramento do backlog e da latência das notificações de alertas"""
+    return jsonify(estatisticas_notificacoes(obter_destinos())), 200
+
 @api_bp.route('/telemetria/inversor/<int:inversor_id>', methods=['GET'])
 def obter_telemetria_inversor(inversor_id):
-    """API para obter últimas medições de um inversor"""
+    """API para obter as medições de um inversor, da mais recente para a mais antiga.
+
+    A resposta traz proximo_cursor enquanto houver medições mais antigas;
+    envie-o em cursor para obter a página seguinte. inicio e fim (data ou
+    data e hora ISO) limitam o período e campos escolhe as colunas.
+    """
     try:
         limite = request.args.get('limite', 10, type=int)
-        
-        medicoes = MedicaoTelemetria.query.filter_by(
-            inversor_id=inversor_id
-        ).order_by(
-            MedicaoTelemetria.data_medicao.desc(),
-            MedicaoTelemetria.hora_medicao.desc()
-        ).limit(limite).all()
-        
-        resultado = []
-        for med in medicoes:
-            resultado.append({
-                'id': med.id,
-                'data_medicao': med.data_medicao.isoformat(),
-                'hora_medicao': med.hora_medicao.isoformat(),
-                'geracao_kw': med.geracao_kw,
-                'temperatura': med.temperatura,
-                'tensao': med.tensao,
-                'corrente': med.corrente,
-                'frequencia': med.frequencia,
-                'eficiencia': med.eficiencia
-            })
-        
-        return jsonify({'medicoes': resultado}), 200
+        if limite < 1 or limite > MAX_LIMITE_HISTORICO:
+            return jsonify({'erro': f'limite deve estar entre 1 e {MAX_LIMITE_HISTORICO}'}), 400
+        try:
+            campos = ler_campos(request.args.get('campos'))
+            cursor = request.args.get('cursor')
+            cursor = decodificar_cursor(cursor) if cursor else None
+            inicio = ler_instante(request.args.get('inicio'))
+            fim = ler_instante(request.args.get('fim'), fim=True)
+        except ValueError as e:
+            return jsonify({'erro': f'Parâmetro inválido: {str(e)}'}), 400
+        
+        medicoes, proximo_cursor = pagina_medicoes(inversor_id, limite, cursor, inicio, fim, campos)
+        
+        return jsonify({'medicoes': medicoes, 'proximo_cursor': proximo_cursor}), 200
     
     except Exception as e:
         return jsonify({'erro': f'Erro ao obter telemetria: {str(e)}'}), 500
 
+@api_bp.route('/telemetria/serie', methods=['GET'])
+@login_required
+def serie_telemetria_api():
+    """API para séries longas de uma métrica de um inversor ou parque, reduzidas a `pontos` pontos.
+
+    inicio e fim aceitam data ou data e hora ISO (padrão: últimos 7 dias);
+    metodo é lttb (padrão) ou minmax.
+    """
+    try:
+        inversor_id = request.args.get('inversor_id', type=int)
+        parque_id = request.args.get('parque_id', type=int)
+        if (inversor_id is None) == (parque_id is None):
+            return jsonify({'erro': 'Informe inversor_id ou parque_id'}), 400
+        
+        metrica = request.args.get('metrica', 'geracao_kw')
+        if metrica not in METRICAS_AGREGADAS:
+            return jsonify({'erro': f'metrica deve ser uma de: {", ".join(METRICAS_AGREGADAS)}'}), 400
+        metodo = request.args.get('metodo', 'lttb')
+        if metodo not in METODOS_REDUCAO:
+            return jsonify({'erro': f'metodo deve ser um de: {", ".join(METODOS_REDUCAO)}'}), 400
+        pontos = request.args.get('pontos', 500, type=int)
+        if pontos < MIN_PONTOS or pontos > MAX_PONTOS:
+            return jsonify({'erro': f'pontos deve estar entre {MIN_PONTOS} e {MAX_PONTOS}'}), 400
+        try:
+            inicio, fim = periodo_serie(request.args.get('inicio'), request.args.get('fim'))
+        except ValueError as e:
+            return jsonify({'erro': f'Período inválido: {str(e)}'}), 400
+        
+        resultado = serie_telemetria(metrica, inicio, fim, pontos, metodo,
+                                     inversor_id=inversor_id, parque_id=parque_id)
+        if inversor_id is not None:
+            resultado['inversor_id'] = inversor_id
+        else:
+            resultado['parque_id'] = parque_id
+        resultado['pontos'] = len(resultado['serie'])
+        return jsonify(resultado), 200
+    
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao obter série de telemetria: {str(e)}'}), 500
+
+@api_bp.route('/telemetria/exportar', methods=['GET'])
+@login_required
+def exportar_telemetria():
+    """Download em stream das medições brutas de um inversor ou parque.
+
+    formato é csv (padrão), ndjson ou parquet; gzip=1 compacta a saída.
+    inicio e fim (data ou data e hora ISO) limitam o período.
+    """
+    try:
+        inversor_id = request.args.get('inversor_id', type=int)
+        parque_id = request.args.get('parque_id', type=int)
+        if (inversor_id is None) == (parque_id is None):
+            return jsonify({'erro': 'Informe inversor_id ou parque_id'}), 400
+        formato = request.args.get('formato', 'csv')
+        if formato not in FORMATOS_EXPORTACAO:
+            return jsonify({'erro': f'formato deve ser um de: {", ".join(FORMATOS_EXPORTACAO)}'}), 400
+        if formato == 'parquet' and not parquet_disponivel():
+            return jsonify({'erro': 'Exportação em Parquet requer pandas e pyarrow instalados'}), 400
+        compactar = request.args.get('gzip', 'false').lower() in ('1', 'true', 'sim')
+        try:
+            inicio = ler_instante(request.args.get('inicio'))
+            fim = ler_instante(request.args.get('fim'), fim=True)
+        except ValueError as e:
+            return jsonify({'erro': f'Período inválido: {str(e)}'}), 400
+        
+        inversores = listar_inversores_exportacao(inversor_id, parque_id)
+        if not inversores:
+            return jsonify({'erro': 'Inversor ou parque sem inversores cadastrados'}), 404
+        
+        nome = nome_arquivo_exportacao(formato, compactar, inversor_id, parque_id)
+        return Response(
+            stream_with_context(exportar_medicoes(inversores, formato, inicio, fim, compactar)),
+            mimetype='application/gzip' if compactar else TIPOS_CONTEUDO[formato],
+            headers={'Content-Disposition': f'attachment; filename="{nome}"', 'X-Accel-Buffering': 'no'}
+        )
+    
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao exportar telemetria: {str(e)}'}), 500
+
+# Período máximo, em dias, aceito pelo backtest de regras
+MAX_DIAS_BACKTEST = 365
+
+@api_bp.route('/regras/<int:regra_id>/backtest', methods=['GET'])
+@login_required
+def backtest_regra_api(regra_id):
+    """API para simular uma regra sobre o histórico de telemetria sem gerar alertas.
+
+    operador, valor_threshold, janela_tipo, janela e expressao podem ser
+    informados para testar a regra com outros parâmetros antes de salvá-la.
+    """
+    try:
+        regra = db.session.get(Regra, regra_id)
+        if not regra:
+            return jsonify({'erro': 'Regra não encontrada'}), 404
+        dias = request.args.get('dias', 30, type=int)
+        if dias < 1 or dias > MAX_DIAS_BACKTEST:
+            return jsonify({'erro': f'dias deve estar entre 1 e {MAX_DIAS_BACKTEST}'}), 400
+        
+        # Cópia transitória da regra com os parâmetros informados (não é gravada)
+        simulada = Regra(
+            id=regra.id,
+            nome=regra.nome,
+            tipo=regra.tipo,
+            operador=request.args.get('operador', regra.operador),
+            valor_threshold=request.args.get('valor_threshold', regra.valor_threshold, type=float),
+            severidade=regra.severidade,
+            janela_tipo=request.args.get('janela_tipo', regra.janela_tipo),
+            janela=request.args.get('janela', regra.janela, type=int),
+            expressao=request.args.get('expressao', regra.expressao),
+            parque_id=regra.parque_id,
+            modelo_inversor=regra.modelo_inversor,
+            inversores_ids=regra.inversores_ids
+        )
+        compilada = compilar_regra(simulada)
+        if compilada is None:
+            return jsonify({'erro': 'Parâmetros da regra inválidos'}), 400
+        
+        resultado = backtest_regra(
+            compilada,
+            dias=dias,
+            parque_id=request.args.get('parque_id', type=int),
+            inversor_id=request.args.get('inversor_id', type=int)
+        )
+        resultado['regra'] = {
+            'id': regra.id,
+            'nome': regra.nome,
+            'tipo': compilada.tipo,
+            'operador': compilada.operador,
+            'valor_threshold': compilada.valor_threshold,
+            'janela_tipo': compilada.janela_tipo,
+            'janela': compilada.janela,
+            'expressao': compilada.expressao.texto if compilada.expressao else None
+        }
+        return jsonify(resultado), 200
+    
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao executar backtest: {str(e)}'}), 500
+
 @api_bp.route('/charts/geracao-tempo', methods=['GET'])
 @login_required
+@resposta_em_cache(periodo=_ultimos_dias('dias'))
 def chart_geracao_tempo():
     """API para gráfico de geração ao longo do tempo (últimos 7 dias)"""
     try:
         dias = request.args.get('dias', 7, type=int)
-        fim = date.today()
-        inicio = fim - timedelta(days=dias-1)
-        
-        medicoes = db.session.query(
-            MedicaoTelemetria.data_medicao,
-            func.sum(MedicaoTelemetria.geracao_kw).label('total_geracao')
-        ).filter(
-            MedicaoTelemetria.data_medicao >= inicio,
-            MedicaoTelemetria.data_medicao <= fim
-        ).group_by(
-            MedicaoTelemetria.data_medicao
-        ).order_by(
-            MedicaoTelemetria.data_medicao
-        ).all()
-        
-        labels = []
-        dados = []
-        
-        # Preencher todos os dias, mesmo sem dados
-        for i in range(dias):
-            dia = inicio + timedelta(days=i)
-            labels.append(dia.strftime('%d/%m'))
-            
-            # Buscar dados para este dia
-            geracao = 0.0
-            for med in medicoes:
-                if med.data_medicao == dia:
-                    geracao = float(med.total_geracao)
-                    break
-            dados.append(round(geracao, 2))
-        
-        return jsonify({
-            'labels': labels,
-            'datasets': [{
-                'label': 'Geração (kW)',
-                'data': dados,
-                'borderColor': '#4a9eff',
-                'backgroundColor': 'rgba(74, 158, 255, 0.1)',
-                'tension': 0.4
-            }]
-        }), 200
+        return jsonify(grafico_geracao_tempo(dias)), 200
     
     except Exception as e:
         return jsonify({'erro': f'Erro ao obter dados: {str(e)}'}), 500
 
 @api_bp.route('/charts/status-placas', methods=['GET'])
 @login_required
+@resposta_em_cache(versoes=(CHAVE_VERSAO_PLACAS,))
 def chart_status_placas():
     """API para gráfico de pizza - distribuição de status das placas"""
     try:
-        status_counts = db.session.query(
-            PlacaSolar.status,
-            func.count(PlacaSolar.id).label('total')
-        ).group_by(PlacaSolar.status).all()
-        
-        labels = []
-        dados = []
-        cores = {
-            'ligada': '#4ade80',
-            'desligada': '#6b6b65',
-            'manutencao': '#fbbf24'
-        }
-        
-        cores_list = []
-        for status, total in status_counts:
-            labels.append(status.capitalize())
-            dados.append(int(total))
-            cores_list.append(cores.get(status, '#4a9eff'))
-        
-        return jsonify({
-            'labels': labels,
-            'datasets': [{
-                'data': dados,
-                'backgroundColor': cores_list,
-                'borderColor': '#252525',
-                'borderWidth': 2
-            }]
-        }), 200
+        return jsonify(grafico_status_placas()), 200
     
     except Exception as e:
         return jsonify({'erro': f'Erro ao obter dados: {str(e)}'}), 500
 
 @api_bp.route('/charts/eficiencia-hora', methods=['GET'])
 @login_required
+@resposta_em_cache(periodo=_hoje)
 def chart_eficiencia_hora():
     """API para gráfico de barras - eficiência média por hora do dia"""
     try:
-        hoje = date.today()
-        
-        medicoes = db.session.query(
-            extract('hour', MedicaoTelemetria.hora_medicao).label('hora'),
-            func.avg(MedicaoTelemetria.eficiencia).label('eficiencia_media')
-        ).filter(
-            MedicaoTelemetria.data_medicao == hoje,
-            MedicaoTelemetria.eficiencia.isnot(None)
-        ).group_by(
-            extract('hour', MedicaoTelemetria.hora_medicao)
-        ).order_by(
-            extract('hour', MedicaoTelemetria.hora_medicao)
-        ).all()
-        
-        # Criar array para todas as 24 horas
-        labels = [f'{h:02d}:00' for h in range(24)]
-        dados = [0.0] * 24
-        
-        for med in medicoes:
-            hora = int(med.hora)
-            if 0 <= hora < 24:
-                dados[hora] = round(float(med.eficiencia_media), 2)
-        
-        return jsonify({
-            'labels': labels,
-            'datasets': [{
-                'label': 'Eficiência Média (%)',
-                'data': dados,
-                'backgroundColor': 'rgba(74, 158, 255, 0.6)',
-                'borderColor': '#4a9eff',
-                'borderWidth': 1
-            }]
-        }), 200
+        return jsonify(grafico_eficiencia_hora()), 200
     
     except Exception as e:
         return jsonify({'erro': f'Erro ao obter dados: {str(e)}'}), 500
 
 @api_bp.route('/charts/temperatura-geracao', methods=['GET'])
 @login_required
+@resposta_em_cache(periodo=_ultimos_dias('dias'))
 def chart_temperatura_geracao():
     """API para gráfico de linha - temperatura vs geração"""
     try:
         dias = request.args.get('dias', 7, type=int)
-        fim = date.today()
-        inicio = fim - timedelta(days=dias-1)
-        
-        medicoes = db.session.query(
-            MedicaoTelemetria.data_medicao,
-            func.avg(MedicaoTelemetria.temperatura).label('temp_media'),
-            func.sum(MedicaoTelemetria.geracao_kw).label('total_geracao')
-        ).filter(
-            MedicaoTelemetria.data_medicao >= inicio,
-            MedicaoTelemetria.data_medicao <= fim,
-            MedicaoTelemetria.temperatura.isnot(None)
-        ).group_by(
-            MedicaoTelemetria.data_medicao
-        ).order_by(
-            MedicaoTelemetria.data_medicao
-        ).all()
-        
-        labels = []
-        temperatura = []
-        geracao = []
-        
-        for med in medicoes:
-            labels.append(med.data_medicao.strftime('%d/%m'))
-            temperatura.append(round(float(med.temp_media), 1))
-            geracao.append(round(float(med.total_geracao), 2))
-        
-        return jsonify({
-            'labels': labels,
-            'datasets': [
-                {
-                    'label': 'Temperatura Média (°C)',
-                    'data': temperatura,
-                    'borderColor': '#f87171',
-                    'backgroundColor': 'rgba(248, 113, 113, 0.1)',
-                    'yAxisID': 'y',
-                    'tension': 0.4
-                },
-                {
-                    'label': 'Geração Total (kW)',
-                    'data': geracao,
-                    'borderColor': '#4ade80',
-                    'backgroundColor': 'rgba(74, 222, 128, 0.1)',
-                    'yAxisID': 'y1',
-                    'tension': 0.4
-                }
-            ]
-        }), 200
+        return jsonify(grafico_temperatura_geracao(dias)), 200
     
     except Exception as e:
         return jsonify({'erro': f'Erro ao obter dados: {str(e)}'}), 500
 
 @api_bp.route('/charts/parques-comparacao', methods=['GET'])
 @login_required
+@resposta_em_cache(periodo=_hoje, versoes=('inversores', CHAVE_VERSAO_PARQUES))
 def chart_parques_comparacao():
     """API para gráfico de barras - comparação de geração por parque"""
     try:
-        hoje = date.today()
-        
-        parques = db.session.query(
-            Parque.nome,
-            func.coalesce(func.sum(MedicaoTelemetria.geracao_kw), 0).label('total_geracao')
-        ).select_from(Parque).join(
-            Inversor, Parque.id == Inversor.parque_id
-        ).outerjoin(
-            MedicaoTelemetria,
-            (Inversor.id == MedicaoTelemetria.inversor_id) &
-            (MedicaoTelemetria.data_medicao == hoje)
-        ).group_by(
-            Parque.id, Parque.nome
-        ).order_by(
-            func.sum(MedicaoTelemetria.geracao_kw).desc()
-        ).limit(10).all()
-        
-        labels = []
-        dados = []
-        
-        for parque, geracao in parques:
-            labels.append(parque)
-            dados.append(round(float(geracao), 2))
-        
-        return jsonify({
-            'labels': labels,
-            'datasets': [{
-                'label': 'Geração Hoje (kW)',
-                'data': dados,
-                'backgroundColor': 'rgba(74, 158, 255, 0.6)',
-                'borderColor': '#4a9eff',
-                'borderWidth': 1
-            }]
-        }), 200
+        return jsonify(grafico_parques_comparacao()), 200
+    
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao obter dados: {str(e)}'}), 500
+
+@api_bp.route('/charts/bundle', methods=['GET'])
+@login_required
+@resposta_em_cache(periodo=_ultimos_dias('dias', 'dias_temperatura'),
+                   versoes=('inversores', CHAVE_VERSAO_PARQUES, CHAVE_VERSAO_PLACAS))
+def chart_bundle():
+    """API com os cinco gráficos da página de gráficos em uma resposta.
+    
+    dias é o período da geração ao longo do tempo e dias_temperatura o de
+    temperatura vs geração (padrão: 7 dias cada).
+    """
+    try:
+        dias = request.args.get('dias', 7, type=int)
+        dias_temperatura = request.args.get('dias_temperatura', 7, type=int)
+        if not (1 <= dias <= MAX_DIAS_GRAFICOS and 1 <= dias_temperatura <= MAX_DIAS_GRAFICOS):
+            return jsonify({'erro': f'Os períodos devem ter entre 1 e {MAX_DIAS_GRAFICOS} dias'}), 400
+        return jsonify(graficos_bundle(dias, dias_temperatura)), 200
     
     except Exception as e:
         return jsonify({'erro': f'Erro ao obter dados: {str(e)}'}), 500
@@ -346,184 +472,49 @@ def chart_parques_comparacao():
 @api_bp.route('/dashboard/metricas', methods=['GET'])
 @login_required
 def dashboard_metricas():
-    """API para obter métricas do dashboard com filtros"""
+    """API para obter métricas do dashboard com filtros.
+    
+    Responde 304 quando o If-None-Match confere com o ETag das métricas em cache.
+    """
     try:
-        from routes.main import calcular_metricas_performance
-        from datetime import timedelta
-        
         # Filtros
         periodo = request.args.get('periodo', 'hoje')  # hoje, semana, mes
         parque_id = request.args.get('parque_id', type=int)
         inversor_id = request.args.get('inversor_id', type=int)
         status_placa = request.args.get('status_placa')  # ligada, desligada, manutencao
         
-        hoje = date.today()
-        
-        # Calcular data inicial baseado no período
-        if periodo == 'hoje':
-            data_inicio = hoje
-        elif periodo == 'semana':
-            data_inicio = hoje - timedelta(days=7)
-        elif periodo == 'mes':
-            data_inicio = hoje - timedelta(days=30)
-        else:
-            data_inicio = hoje
-        
-        # Query base para medições
-        query_medicoes = MedicaoTelemetria.query.filter(
-            MedicaoTelemetria.data_medicao >= data_inicio,
-            MedicaoTelemetria.data_medicao <= hoje
-        )
-        
-        # Aplicar filtros
-        if inversor_id:
-            query_medicoes = query_medicoes.filter(MedicaoTelemetria.inversor_id == inversor_id)
-        elif parque_id:
-            inversores_parque = db.session.query(Inversor.id).filter(Inversor.parque_id == parque_id).subquery()
-            query_medicoes = query_medicoes.filter(MedicaoTelemetria.inversor_id.in_(
-                db.session.query(inversores_parque.c.id)
-            ))
-        
-        # Calcular métricas
-        geracao_total = db.session.query(func.sum(MedicaoTelemetria.geracao_kw)).filter(
-            MedicaoTelemetria.data_medicao >= data_inicio,
-            MedicaoTelemetria.data_medicao <= hoje
-        )
-        
-        if inversor_id:
-            geracao_total = geracao_total.filter(MedicaoTelemetria.inversor_id == inversor_id)
-        elif parque_id:
-            inversores_parque = db.session.query(Inversor.id).filter(Inversor.parque_id == parque_id).subquery()
-            geracao_total = geracao_total.filter(MedicaoTelemetria.inversor_id.in_(
-                db.session.query(inversores_parque.c.id)
-            ))
-        
-        geracao_total = geracao_total.scalar() or 0.0
-        
-        # Eficiência média
-        eficiencia_media = db.session.query(func.avg(MedicaoTelemetria.eficiencia)).filter(
-            MedicaoTelemetria.data_medicao >= data_inicio,
-            MedicaoTelemetria.data_medicao <= hoje,
-            MedicaoTelemetria.eficiencia.isnot(None)
-        )
-        
-        if inversor_id:
-            eficiencia_media = eficiencia_media.filter(MedicaoTelemetria.inversor_id == inversor_id)
-        elif parque_id:
-            inversores_parque = db.session.query(Inversor.id).filter(Inversor.parque_id == parque_id).subquery()
-            eficiencia_media = eficiencia_media.filter(MedicaoTelemetria.inversor_id.in_(
-                db.session.query(inversores_parque.c.id)
-            ))
-        
-        eficiencia_media = eficiencia_media.scalar() or 0.0
-        
-        # Contadores
-        query_placas = PlacaSolar.query
-        if status_placa:
-            query_placas = query_placas.filter(PlacaSolar.status == status_placa)
-        
-        total_placas = query_placas.count()
-        placas_ligadas = query_placas.filter(PlacaSolar.status == 'ligada').count() if not status_placa else total_placas
+        dados, etag = obter_metricas_dashboard(periodo, parque_id, inversor_id, status_placa)
         
-        # Últimas medições
-        ultimas_medicoes = query_medicoes.order_by(
-            MedicaoTelemetria.data_medicao.desc(),
-            MedicaoTelemetria.hora_medicao.desc()
-        ).limit(10).all()
-        
-        medicoes_data = []
-        for med in ultimas_medicoes:
-            medicoes_data.append({
-                'id': med.id,
-                'inversor_codigo': med.inversor.codigo_serie[:10] if med.inversor else 'N/A',
-                'data': med.data_medicao.strftime('%d/%m'),
-                'hora': med.hora_medicao.strftime('%H:%M') if med.hora_medicao else '',
-                'geracao_kw': round(float(med.geracao_kw), 2),
-                'eficiencia': round(float(med.eficiencia or 0), 1)
-            })
-        
-        # Parques com mais geração
-        query_parques = db.session.query(
-            Parque.id,
-            Parque.nome,
-            func.coalesce(func.sum(MedicaoTelemetria.geracao_kw), 0).label('total_geracao')
-        ).select_from(Parque).join(
-            Inversor, Parque.id == Inversor.parque_id
-        ).outerjoin(
-            MedicaoTelemetria,
-            (Inversor.id == MedicaoTelemetria.inversor_id) &
-            (MedicaoTelemetria.data_medicao >= data_inicio) &
-            (MedicaoTelemetria.data_medicao <= hoje)
-        )
-        
-        if parque_id:
-            query_parques = query_parques.filter(Parque.id == parque_id)
-        
-        parques_geracao = query_parques.group_by(
-            Parque.id, Parque.nome
-        ).having(
-            func.coalesce(func.sum(MedicaoTelemetria.geracao_kw), 0) > 0
-        ).order_by(
-            func.sum(MedicaoTelemetria.geracao_kw).desc()
-        ).limit(5).all()
-        
-        parques_data = []
-        for parque_id, parque_nome, geracao in parques_geracao:
-            parques_data.append({
-                'nome': parque_nome,
-                'geracao': round(float(geracao), 2)
-            })
-        
-        # Inversores performance
-        query_inversores = db.session.query(
-            Inversor.id,
-            Inversor.codigo_serie,
-            Inversor.capacidade_kw,
-            func.coalesce(func.avg(MedicaoTelemetria.eficiencia), 0).label('eficiencia_media'),
-            func.coalesce(func.sum(MedicaoTelemetria.geracao_kw), 0).label('geracao_total')
-        ).outerjoin(
-            MedicaoTelemetria,
-            (Inversor.id == MedicaoTelemetria.inversor_id) &
-            (MedicaoTelemetria.data_medicao >= data_inicio) &
-            (MedicaoTelemetria.data_medicao <= hoje)
-        )
-        
-        if inversor_id:
-            query_inversores = query_inversores.filter(Inversor.id == inversor_id)
-        elif parque_id:
-            query_inversores = query_inversores.filter(Inversor.parque_id == parque_id)
-        
-        inversores_performance = query_inversores.group_by(
-            Inversor.id, Inversor.codigo_serie, Inversor.capacidade_kw
-        ).having(
-            func.coalesce(func.avg(MedicaoTelemetria.eficiencia), 0) > 0
-        ).order_by(
-            func.avg(MedicaoTelemetria.eficiencia).desc()
-        ).limit(5).all()
-        
-        inversores_data = []
-        for inv in inversores_performance:
-            inversores_data.append({
-                'codigo': inv.codigo_serie[:10] if inv.codigo_serie else 'N/A',
-                'eficiencia': round(float(inv.eficiencia_media), 1),
-                'geracao': round(float(inv.geracao_total), 2)
-            })
-        
-        return jsonify({
-            'geracao_total': round(geracao_total, 2),
-            'eficiencia_media': round(eficiencia_media, 1),
-            'total_placas': total_placas,
-            'placas_ligadas': placas_ligadas,
-            'ultimas_medicoes': medicoes_data,
-            'parques_geracao': parques_data,
-            'inversores_performance': inversores_data
-        }), 200
+        resposta = jsonify(dados)
+        resposta.set_etag(etag)
+        resposta.cache_control.private = True
+        resposta.cache_control.no_cache = True
+        return resposta.make_conditional(request)
     
     except Exception as e:
         return jsonify({'erro': f'Erro ao obter métricas: {str(e)}'}), 500
 
+@api_bp.route('/dashboard/stream', methods=['GET'])
+@login_required
+def dashboard_stream():
+    """Stream SSE com as alterações das métricas do dashboard e os alertas novos"""
+    ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('ultimo_id')
+    assinatura = assinar_dashboard(current_app._get_current_object(), ultimo_id)
+    if assinatura is None:
+        resposta = jsonify({'erro': 'Limite de conexões do stream atingido'})
+        resposta.headers['Retry-After'] = '30'
+        return resposta, 503
+    
+    config = current_app.config
+    return Response(
+        transmitir(assinatura, config['DASHBOARD_STREAM_HEARTBEAT'], config['DASHBOARD_STREAM_DURACAO']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @api_bp.route('/dashboard/parques', methods=['GET'])
 @login_required
+@resposta_em_cache(versoes=(CHAVE_VERSAO_PARQUES,))
 def dashboard_parques():
     """API para listar parques para filtro"""
     try:
@@ -536,6 +527,7 @@ def dashboard_parques():
 
 @api_bp.route('/dashboard/inversores', methods=['GET'])
 @login_required
+@resposta_em_cache(versoes=('inversores',))
 def dashboard_inversores():
     """API para listar inversores para filtro"""
     try:
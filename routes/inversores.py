@@ -1,11 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify, current_app
 from flask_login import login_required
 from forms import InversorForm, UploadCSVForm
-from models import Inversor, Parque, MedicaoTelemetria, db
+from models import Inversor, Parque, MedicaoTelemetria, ImportacaoCSV, db
+from services.cache_inversores import invalidar_inversor, marcar_alteracao_inversores
+from services.importacao_csv import iniciar_importacao, status_importacao
+from services.agregados import recalcular_agregados_parques
 from datetime import datetime, date, time
-import csv
-import io
 import os
+import uuid
 from werkzeug.utils import secure_filename
 
 inversores_bp = Blueprint('inversores', __name__)
@@ -66,7 +68,9 @@ def criar():
         )
         
         db.session.add(inversor)
+        marcar_alteracao_inversores()
         db.session.commit()
+        invalidar_inversor(inversor.id)
         
         flash('Inversor criado com sucesso!', 'success')
         return redirect(url_for('inversores.listar'))
@@ -92,6 +96,7 @@ def editar(id):
             flash('Código de série já existe!', 'error')
             return render_template('inversores/form.html', form=form, titulo='Editar Inversor', inversor=inversor)
         
+        parque_anterior = inversor.parque_id
         inversor.codigo_serie = form.codigo_serie.data
         inversor.modelo = form.modelo.data
         inversor.capacidade_kw = form.capacidade_kw.data
@@ -101,7 +106,13 @@ def editar(id):
         inversor.parque_id = form.parque_id.data
         inversor.atualizado_em = datetime.utcnow()
         
+        marcar_alteracao_inversores()
         db.session.commit()
+        invalidar_inversor(inversor.id)
+        
+        # O histórico do inversor passa a contar no agregado do novo parque
+        if inversor.parque_id != parque_anterior:
+            recalcular_agregados_parques([parque_anterior, inversor.parque_id])
         
         flash('Inversor atualizado com sucesso!', 'success')
         return redirect(url_for('inversores.listar'))
@@ -120,7 +131,9 @@ def excluir(id):
         return redirect(url_for('inversores.listar'))
     
     db.session.delete(inversor)
+    marcar_alteracao_inversores()
     db.session.commit()
+    invalidar_inversor(id)
     
     flash('Inversor excluído com sucesso!', 'success')
     return redirect(url_for('inversores.listar'))
@@ -136,12 +149,17 @@ def detalhes(id):
     ultimas_medicoes = MedicaoTelemetria.query.filter_by(
         inversor_id=inversor.id
     ).order_by(
-        MedicaoTelemetria.data_medicao.desc(),
-        MedicaoTelemetria.hora_medicao.desc()
+        MedicaoTelemetria.medido_em.desc()
     ).limit(20).all()
     
+    # Importações de CSV recentes
+    importacoes = ImportacaoCSV.query.filter_by(
+        inversor_id=inversor.id
+    ).order_by(ImportacaoCSV.criado_em.desc()).limit(5).all()
+    
     return render_template('inversores/detalhes.html', inversor=inversor, 
-                         eficiencia=eficiencia, medicoes=ultimas_medicoes)
+                         eficiencia=eficiencia, medicoes=ultimas_medicoes,
+                         importacoes=importacoes)
 
 @inversores_bp.route('/upload-csv', methods=['GET', 'POST'])
 @login_required
@@ -159,72 +177,15 @@ def upload_csv():
         inversor_id = form.inversor_id.data
         
         if arquivo and allowed_file(arquivo.filename):
-            inversor = Inversor.query.get_or_404(inversor_id)
+            Inversor.query.get_or_404(inversor_id)
             filename = secure_filename(arquivo.filename)
-            filepath = os.path.join('uploads', filename)
+            # Nome único: o arquivo é processado depois que a requisição termina
+            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], f'{uuid.uuid4().hex}_{filename}')
             arquivo.save(filepath)
             
-            # Processar CSV
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    linhas_processadas = 0
-                    linhas_erro = 0
-                    
-                    # Loop para processar cada linha do CSV
-                    for linha in reader:
-                        try:
-                            # Validação de dados
-                            if not linha.get('data') or not linha.get('hora'):
-                                linhas_erro += 1
-                                continue
-                            
-                            data_medicao = datetime.strptime(linha['data'], '%Y-%m-%d').date()
-                            hora_medicao = datetime.strptime(linha['hora'], '%H:%M:%S').time()
-                            geracao_kw = float(linha.get('geracao_kw', 0))
-                            temperatura = float(linha.get('temperatura', 0)) if linha.get('temperatura') else None
-                            tensao = float(linha.get('tensao', 0)) if linha.get('tensao') else None
-                            corrente = float(linha.get('corrente', 0)) if linha.get('corrente') else None
-                            frequencia = float(linha.get('frequencia', 0)) if linha.get('frequencia') else None
-                            
-                            # Calcular eficiência
-                            eficiencia = None
-                            if inversor.capacidade_kw > 0:
-                                eficiencia = (geracao_kw / inversor.capacidade_kw) * 100
-                            
-                            medicao = MedicaoTelemetria(
-                                inversor_id=inversor_id,
-                                data_medicao=data_medicao,
-                                hora_medicao=hora_medicao,
-                                geracao_kw=geracao_kw,
-                                temperatura=temperatura,
-                                tensao=tensao,
-                                corrente=corrente,
-                                frequencia=frequencia,
-                                eficiencia=eficiencia
-                            )
-                            
-                            db.session.add(medicao)
-                            linhas_processadas += 1
-                        except (ValueError, KeyError) as e:
-                            linhas_erro += 1
-                            continue
-                    
-                    db.session.commit()
-                    
-                    flash(f'CSV processado com sucesso! {linhas_processadas} linhas importadas. {linhas_erro} linhas com erro.', 'success')
-                    
-                    # Verificar regras de alerta após importação
-                    from services.regras_service import verificar_alertas_inversor
-                    verificar_alertas_inversor(inversor_id)
-                    
-            except Exception as e:
-                db.session.rollback()
-                flash(f'Erro ao processar CSV: {str(e)}', 'error')
-            finally:
-                # Remover arquivo após processamento
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+            # Processar CSV em segundo plano
+            importacao = iniciar_importacao(filepath, inversor_id, filename)
+            flash(f'Importação #{importacao.id} iniciada. Acompanhe o progresso nos detalhes do inversor.', 'success')
             
             return redirect(url_for('inversores.detalhes', id=inversor_id))
         else:
@@ -232,3 +193,9 @@ def upload_csv():
     
     return render_template('inversores/upload_csv.html', form=form)
 
+@inversores_bp.route('/importacao/<int:id>')
+@login_required
+def importacao_status(id):
+    """Retorna o andamento de uma importação de CSV"""
+    importacao = ImportacaoCSV.query.get_or_404(id)
+    return jsonify(status_importacao(importacao))
@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required
 from forms import ParqueForm
 from models import Parque, Inversor, MedicaoTelemetria, db
+from services.cache_respostas import marcar_alteracao_parques
 from datetime import datetime
 from sqlalchemy import func
 import csv
@@ -24,7 +25,7 @@ def listar():
     hoje = datetime.now().date()
     for parque in parques:
         parque.geracao_hoje = db.session.query(func.sum(MedicaoTelemetria.geracao_kw)).filter(
-            MedicaoTelemetria.data_medicao == hoje,
+            MedicaoTelemetria.no_periodo(hoje, hoje),
             MedicaoTelemetria.inversor_id.in_([inv.id for inv in parque.inversores])
         ).scalar() or 0.0
     
@@ -52,6 +53,7 @@ def criar():
         )
         
         db.session.add(parque)
+        marcar_alteracao_parques()
         db.session.commit()
         
         flash('Parque criado com sucesso!', 'success')
@@ -80,6 +82,7 @@ def editar(id):
         parque.descricao = form.descricao.data
         parque.atualizado_em = datetime.utcnow()
         
+        marcar_alteracao_parques()
         db.session.commit()
         
         flash('Parque atualizado com sucesso!', 'success')
@@ -98,7 +101,13 @@ def excluir(id):
         flash('Não é possível excluir o parque. Existem inversores associados!', 'error')
         return redirect(url_for('parques.listar'))
     
+    # Verificar se existem regras restritas ao parque
+    if parque.regras:
+        flash('Não é possível excluir o parque. Existem regras restritas a ele!', 'error')
+        return redirect(url_for('parques.listar'))
+    
     db.session.delete(parque)
+    marcar_alteracao_parques()
     db.session.commit()
     
     flash('Parque excluído com sucesso!', 'success')
@@ -113,7 +122,7 @@ def detalhes(id):
     # Calcular estatísticas
     hoje = datetime.now().date()
     geracao_hoje = db.session.query(func.sum(MedicaoTelemetria.geracao_kw)).filter(
-        MedicaoTelemetria.data_medicao == hoje,
+        MedicaoTelemetria.no_periodo(hoje, hoje),
         MedicaoTelemetria.inversor_id.in_([inv.id for inv in parque.inversores])
     ).scalar() or 0.0
     
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from models import PlacaSolar, Inversor, Parque, db
+from services.cache_respostas import marcar_alteracao_placas
 from datetime import datetime, date
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload
@@ -92,6 +93,7 @@ def criar():
                 placa.area_m2 = placa.calcular_area()
             
             db.session.add(placa)
+            marcar_alteracao_placas()
             db.session.commit()
             flash('Placa solar criada com sucesso!', 'success')
             return redirect(url_for('placas.mapeamento'))
@@ -129,6 +131,7 @@ def editar(id):
             placa.area_m2 = placa.calcular_area()
             placa.atualizado_em = datetime.utcnow()
             
+            marcar_alteracao_placas()
             db.session.commit()
             flash('Placa solar atualizada com sucesso!', 'success')
             return redirect(url_for('placas.mapeamento'))
@@ -146,6 +149,7 @@ def excluir(id):
     placa = PlacaSolar.query.get_or_404(id)
     try:
         db.session.delete(placa)
+        marcar_alteracao_placas()
         db.session.commit()
         flash('Placa solar excluída com sucesso!', 'success')
     except Exception as e:
@@ -160,6 +164,7 @@ def toggle(id):
     placa = PlacaSolar.query.get_or_404(id)
     novo_status = placa.toggle_status()
     try:
+        marcar_alteracao_placas()
         db.session.commit()
         return jsonify({
             'success': True,
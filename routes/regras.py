@@ -2,10 +2,37 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required
 from forms import RegraForm
 from models import Regra, Alerta, db
+from services.regras_compiladas import invalidar_regras
+from services.regras_service import resolver_alertas
+from services.expressoes import compilar_expressao
 from datetime import datetime
 
 regras_bp = Blueprint('regras', __name__)
 
+def _ids_inversores(form):
+    """Normaliza os ids de inversores do escopo ("1, 2,3" -> "1,2,3"), ou None se vazio"""
+    ids = [item.strip() for item in (form.inversores_ids.data or '').split(',') if item.strip()]
+    return ','.join(str(int(item)) for item in ids) or None
+
+def _validar_regra(form):
+    """Validações da regra que dependem de mais de um campo. Retorna a mensagem de erro ou None."""
+    if form.tipo.data == 'expressao':
+        try:
+            compilar_expressao(form.expressao.data)
+        except ValueError as e:
+            return f'Expressão inválida: {e}'
+        if form.janela_tipo.data != 'instantanea':
+            return 'Regras com expressão são avaliadas sobre a última leitura!'
+        return None
+    
+    if form.valor_threshold.data is None:
+        return 'Informe o valor limite!'
+    if form.valor_threshold.data < 0:
+        return 'O valor limite deve ser positivo!'
+    if form.janela_tipo.data != 'instantanea' and not form.janela.data:
+        return 'Informe o tamanho da janela para regras com janela!'
+    return None
+
 @regras_bp.route('/')
 @login_required
 def listar():
@@ -26,8 +53,9 @@ def criar():
     
     if form.validate_on_submit():
         # Validação de dados
-        if form.valor_threshold.data < 0:
-            flash('O valor limite deve ser positivo!', 'error')
+        erro = _validar_regra(form)
+        if erro:
+            flash(erro, 'error')
             return render_template('regras/form.html', form=form, titulo='Criar Regra')
         
         regra = Regra(
@@ -35,12 +63,19 @@ def criar():
             descricao=form.descricao.data,
             tipo=form.tipo.data,
             operador=form.operador.data,
-            valor_threshold=form.valor_threshold.data,
+            valor_threshold=form.valor_threshold.data or 0,
+            expressao=form.expressao.data.strip() if form.tipo.data == 'expressao' else None,
+            janela_tipo=form.janela_tipo.data,
+            janela=form.janela.data if form.janela_tipo.data != 'instantanea' else None,
             severidade=form.severidade.data,
-            ativo=form.ativo.data
+            ativo=form.ativo.data,
+            parque_id=form.parque_id.data or None,
+            modelo_inversor=(form.modelo_inversor.data or '').strip() or None,
+            inversores_ids=_ids_inversores(form)
         )
         
         db.session.add(regra)
+        invalidar_regras()
         db.session.commit()
         
         flash('Regra criada com sucesso!', 'success')
@@ -57,19 +92,27 @@ def editar(id):
     
     if form.validate_on_submit():
         # Validação de dados
-        if form.valor_threshold.data < 0:
-            flash('O valor limite deve ser positivo!', 'error')
+        erro = _validar_regra(form)
+        if erro:
+            flash(erro, 'error')
             return render_template('regras/form.html', form=form, titulo='Editar Regra', regra=regra)
         
         regra.nome = form.nome.data
         regra.descricao = form.descricao.data
         regra.tipo = form.tipo.data
         regra.operador = form.operador.data
-        regra.valor_threshold = form.valor_threshold.data
+        regra.valor_threshold = form.valor_threshold.data or 0
+        regra.expressao = form.expressao.data.strip() if form.tipo.data == 'expressao' else None
+        regra.janela_tipo = form.janela_tipo.data
+        regra.janela = form.janela.data if form.janela_tipo.data != 'instantanea' else None
         regra.severidade = form.severidade.data
         regra.ativo = form.ativo.data
+        regra.parque_id = form.parque_id.data or None
+        regra.modelo_inversor = (form.modelo_inversor.data or '').strip() or None
+        regra.inversores_ids = _ids_inversores(form)
         regra.atualizado_em = datetime.utcnow()
         
+        invalidar_regras()
         db.session.commit()
         
         flash('Regra atualizada com sucesso!', 'success')
@@ -89,6 +132,7 @@ def excluir(id):
         return redirect(url_for('regras.listar'))
     
     db.session.delete(regra)
+    invalidar_regras()
     db.session.commit()
     
     flash('Regra excluída com sucesso!', 'success')
@@ -111,9 +155,23 @@ def ativar(id):
     """Ativa ou desativa uma regra"""
     regra = Regra.query.get_or_404(id)
     regra.ativo = not regra.ativo
+    invalidar_regras()
     db.session.commit()
     
     status = "ativada" if regra.ativo else "desativada"
     flash(f'Regra {status} com sucesso!', 'success')
     return redirect(url_for('regras.listar'))
 
+@regras_bp.route('/alertas/<int:id>/resolver', methods=['POST'])
+@login_required
+def resolver_alerta(id):
+    """Marca como resolvidos os alertas abertos da regra no inversor do alerta"""
+    alerta = Alerta.query.get_or_404(id)
+    
+    if alerta.resolvido:
+        flash('Este alerta já está resolvido!', 'info')
+    else:
+        resolver_alertas(alerta.inversor_id, alerta.regra_id)
+        flash('Alerta resolvido com sucesso!', 'success')
+    
+    return redirect(url_for('regras.detalhes', id=alerta.regra_id))
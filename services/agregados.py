@@ -0,0 +1,309 @@
+"""Agregados de telemetria por hora e por dia, por inversor e por parque.
+
+Cada gravação de medições soma as estatísticas do lote aos baldes (hora e
+dia, do inversor e do parque) na própria transação da gravação, com upserts
+aditivos: soma e quantidade acumulam a diferença entre o valor novo e o
+anterior (um reenvio substitui a medição), e mínimo e máximo ficam com o
+menor e o maior valor. Nenhuma linha é travada além dos próprios baldes, e o
+custo é proporcional ao lote, não às leituras já gravadas nas horas tocadas.
+Os gráficos e o dashboard leem só os agregados.
+
+Quando um reenvio troca o valor que era o mínimo ou o máximo do balde, o
+extremo antigo continua valendo até reconstruir_agregados, que também corrige
+medições inseridas por fora da aplicação.
+"""
+from models import (MedicaoTelemetria, Inversor, Parque, AgregadoMixin, AgregadoInversorHora, AgregadoInversorDia,
+                    AgregadoParqueHora, AgregadoParqueDia, VersaoCache, VersaoTelemetriaDia, METRICAS_AGREGADAS, db)
+from database import upsert, upsert_acumulando
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func, and_, or_
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Colunas de estatísticas comuns às quatro tabelas
+COLUNAS_AGREGADO = AgregadoMixin.colunas_estatisticas()
+
+# Linhas enviadas em cada upsert em lote
+TAMANHO_LOTE_AGREGADOS = 500
+
+# Faixas (inversor ou parque, período) por consulta ao recalcular agregados
+FAIXAS_POR_CONSULTA = 200
+
+# Chave em versoes_cache incrementada a cada gravação de telemetria (marca d'água da ingestão)
+CHAVE_VERSAO_TELEMETRIA = 'telemetria'
+
+# Dias de medições de um inversor recalculados por transação na reconstrução
+DIAS_BLOCO_RECONSTRUCAO = 31
+
+_EPOCA = datetime(1970, 1, 1)
+
+# Como combinar cada estatística entre linhas (leituras e qtd também somam)
+_COMBINAR = {'leituras': np.add, 'soma': np.add, 'qtd': np.add, 'min': np.fmin, 'max': np.fmax}
+_COMBINAR_SQL = {'leituras': func.sum, 'soma': func.sum, 'qtd': func.sum, 'min': func.min, 'max': func.max}
+
+def _estatistica(coluna):
+    return coluna if coluna == 'leituras' else coluna.rsplit('_', 1)[1]
+
+def _combinar(ids, baldes, estatisticas):
+    """Combina as linhas com o mesmo (id, balde).
+
+    ids e baldes são arrays inteiros; estatisticas é {coluna: array} com NaN
+    para valores ausentes. Retorna (chaves únicas [n, 2], {coluna: array}).
+    """
+    chaves, inverso = np.unique(np.column_stack([ids, baldes]).astype(np.int64), axis=0, return_inverse=True)
+    inverso = inverso.ravel()
+    combinadas = {}
+    for coluna, valores in estatisticas.items():
+        ufunc = _COMBINAR[_estatistica(coluna)]
+        if ufunc is np.add:
+            resultado = np.zeros(len(chaves))
+            ufunc.at(resultado, inverso, np.nan_to_num(valores))
+        else:
+            resultado = np.full(len(chaves), np.nan)
+            ufunc.at(resultado, inverso, valores)
+        combinadas[coluna] = resultado
+    # Soma sem nenhuma leitura com valor fica NULL (em diferenças, NULL mantém a soma gravada)
+    for metrica in METRICAS_AGREGADAS:
+        soma = combinadas[f'{metrica}_soma']
+        soma[(combinadas[f'{metrica}_qtd'] == 0) & (soma == 0)] = np.nan
+    return chaves, combinadas
+
+def _linhas(chaves, combinadas, coluna_id, coluna_balde, converter_balde):
+    """Converte o resultado de _combinar em dicionários para o upsert (NaN vira NULL)"""
+    linhas = []
+    for i, (chave_id, balde) in enumerate(chaves):
+        linha = {coluna_id: int(chave_id), coluna_balde: converter_balde(int(balde))}
+        for coluna, valores in combinadas.items():
+            valor = valores[i]
+            if _estatistica(coluna) in ('leituras', 'qtd'):
+                linha[coluna] = int(valor)
+            else:
+                linha[coluna] = None if np.isnan(valor) else float(valor)
+        linhas.append(linha)
+    return linhas
+
+def _gravar(modelo, chaves, linhas):
+    stmt = upsert(modelo.__table__, chaves, COLUNAS_AGREGADO)
+    for inicio in range(0, len(linhas), TAMANHO_LOTE_AGREGADOS):
+        db.session.execute(stmt, linhas[inicio:inicio + TAMANHO_LOTE_AGREGADOS])
+
+def _segundos(instantes):
+    return np.array(instantes, dtype='datetime64[s]').astype(np.int64)
+
+def _para_datetime(segundos):
+    return _EPOCA + timedelta(seconds=segundos)
+
+def _para_date(dias):
+    return date(1970, 1, 1) + timedelta(days=dias)
+
+def _filtros_faixas(coluna_id, coluna_tempo, faixas_por_id):
+    """Blocos de condições OR, cada uma (id, faixa de tempo), para consultar só as faixas tocadas"""
+    condicoes = [
+        and_(coluna_id == chave_id, coluna_tempo >= inicio, coluna_tempo < fim)
+        for chave_id, faixas in faixas_por_id.items() for inicio, fim in faixas
+    ]
+    for inicio in range(0, len(condicoes), FAIXAS_POR_CONSULTA):
+        yield or_(*condicoes[inicio:inicio + FAIXAS_POR_CONSULTA])
+
+def _recalcular_horas_inversores(faixas_por_inversor):
+    """Recalcula agregados_inversor_hora das faixas de horas ({inversor_id: [(inicio, fim)]}) a partir das medições"""
+    linhas = []
+    for filtro in _filtros_faixas(MedicaoTelemetria.inversor_id, MedicaoTelemetria.medido_em, faixas_por_inversor):
+        linhas += db.session.query(
+            MedicaoTelemetria.inversor_id,
+            MedicaoTelemetria.medido_em,
+            *[getattr(MedicaoTelemetria, metrica) for metrica in METRICAS_AGREGADAS]
+        ).filter(filtro).all()
+    if not linhas:
+        return
+
+    ids, instantes, *series = zip(*linhas)
+    estatisticas = {'leituras': np.ones(len(linhas))}
+    for metrica, serie in zip(METRICAS_AGREGADAS, series):
+        valores = np.array(serie, dtype=float)
+        estatisticas[f'{metrica}_soma'] = valores
+        estatisticas[f'{metrica}_qtd'] = (~np.isnan(valores)).astype(float)
+        estatisticas[f'{metrica}_min'] = valores
+        estatisticas[f'{metrica}_max'] = valores
+
+    baldes = _segundos(instantes) // 3600 * 3600
+    chaves, combinadas = _combinar(np.array(ids), baldes, estatisticas)
+    _gravar(AgregadoInversorHora, ['inversor_id', 'inicio'],
+            _linhas(chaves, combinadas, 'inversor_id', 'inicio', _para_datetime))
+
+def _recalcular_dias_inversores(faixas_por_inversor):
+    """Recalcula agregados_inversor_dia das faixas de dias ({inversor_id: [(data, data_fim)]}) a partir das horas"""
+    faixas_horas = {
+        inversor_id: [(datetime.combine(inicio, time.min), datetime.combine(fim, time.min)) for inicio, fim in faixas]
+        for inversor_id, faixas in faixas_por_inversor.items()
+    }
+    linhas = []
+    for filtro in _filtros_faixas(AgregadoInversorHora.inversor_id, AgregadoInversorHora.inicio, faixas_horas):
+        linhas += db.session.query(
+            AgregadoInversorHora.inversor_id,
+            AgregadoInversorHora.inicio,
+            *[getattr(AgregadoInversorHora, coluna) for coluna in COLUNAS_AGREGADO]
+        ).filter(filtro).all()
+    if not linhas:
+        return
+
+    ids, instantes, *series = zip(*linhas)
+    estatisticas = {coluna: np.array(serie, dtype=float) for coluna, serie in zip(COLUNAS_AGREGADO, series)}
+    chaves, combinadas = _combinar(np.array(ids), _segundos(instantes) // 86400, estatisticas)
+    _gravar(AgregadoInversorDia, ['inversor_id', 'data'],
+            _linhas(chaves, combinadas, 'inversor_id', 'data', _para_date))
+
+def _combinar_parques(origem, coluna_balde, parque_id, faixas):
+    """Agrupa as linhas de inversores de origem por parque e balde no banco (faixas None: todo o histórico)"""
+    balde = getattr(origem, coluna_balde)
+    colunas = [_COMBINAR_SQL[_estatistica(coluna)](getattr(origem, coluna)) for coluna in COLUNAS_AGREGADO]
+    filtros = [None] if faixas is None else _filtros_faixas(Inversor.parque_id, balde, {parque_id: faixas})
+    resultado = []
+    for filtro in filtros:
+        consulta = db.session.query(Inversor.parque_id, balde, *colunas).join(
+            Inversor, Inversor.id == origem.inversor_id
+        ).filter(Inversor.parque_id == parque_id)
+        if filtro is not None:
+            consulta = consulta.filter(filtro)
+        resultado += [{'parque_id': linha[0], coluna_balde: linha[1], **dict(zip(COLUNAS_AGREGADO, linha[2:]))}
+                      for linha in consulta.group_by(Inversor.parque_id, balde).all()]
+    return resultado
+
+def _recalcular_parque(parque_id, faixas_horas=None, faixas_dias=None):
+    """Recalcula as faixas de horas e de dias de um parque (todo o histórico sem faixas)"""
+    _gravar(AgregadoParqueHora, ['parque_id', 'inicio'],
+            _combinar_parques(AgregadoInversorHora, 'inicio', parque_id, faixas_horas))
+    _gravar(AgregadoParqueDia, ['parque_id', 'data'],
+            _combinar_parques(AgregadoInversorDia, 'data', parque_id, faixas_dias))
+
+def recalcular_agregados(inversores_ids, inicio, fim):
+    """Recalcula os agregados dos inversores nas horas que cobrem [inicio, fim]. Não faz commit."""
+    inicio = inicio.replace(minute=0, second=0, microsecond=0)
+    fim = fim.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    dia_fim = (fim - timedelta(seconds=1)).date() + timedelta(days=1)
+    inversores_ids = list(inversores_ids)
+
+    _recalcular_horas_inversores({inversor_id: [(inicio, fim)] for inversor_id in inversores_ids})
+    _recalcular_dias_inversores({inversor_id: [(inicio.date(), dia_fim)] for inversor_id in inversores_ids})
+
+def _medicoes_gravadas(linhas):
+    """Retorna {(inversor_id, medido_em): valores de METRICAS_AGREGADAS} das medições do lote já gravadas"""
+    instantes = {}
+    for linha in linhas:
+        instantes.setdefault(linha['inversor_id'], set()).add(linha['medido_em'])
+    gravadas = {}
+    for inversor_id, momentos in instantes.items():
+        momentos = sorted(momentos)
+        for inicio in range(0, len(momentos), TAMANHO_LOTE_AGREGADOS):
+            for inversor, medido_em, *valores in db.session.query(
+                MedicaoTelemetria.inversor_id,
+                MedicaoTelemetria.medido_em,
+                *[getattr(MedicaoTelemetria, metrica) for metrica in METRICAS_AGREGADAS]
+            ).filter(
+                MedicaoTelemetria.inversor_id == inversor_id,
+                MedicaoTelemetria.medido_em.in_(momentos[inicio:inicio + TAMANHO_LOTE_AGREGADOS])
+            ).all():
+                gravadas[(inversor, medido_em)] = valores
+    return gravadas
+
+def _acumular(modelo, chaves, linhas):
+    stmt = upsert_acumulando(
+        modelo.__table__, chaves,
+        somar=[coluna for coluna in COLUNAS_AGREGADO if _estatistica(coluna) in ('leituras', 'soma', 'qtd')],
+        minimos=[coluna for coluna in COLUNAS_AGREGADO if _estatistica(coluna) == 'min'],
+        maximos=[coluna for coluna in COLUNAS_AGREGADO if _estatistica(coluna) == 'max']
+    )
+    for inicio in range(0, len(linhas), TAMANHO_LOTE_AGREGADOS):
+        db.session.execute(stmt, linhas[inicio:inicio + TAMANHO_LOTE_AGREGADOS])
+
+def acumular_agregados(linhas):
+    """Soma as medições (dicionários de preparar_medicao) aos agregados de inversores e parques. Não faz commit.
+
+    Deve ser chamada na transação da gravação, antes do upsert das medições,
+    para enxergar os valores que um reenvio substitui. Os baldes são gravados
+    em ordem de chave, então transações simultâneas não entram em deadlock.
+    """
+    if not linhas:
+        return
+    gravadas = _medicoes_gravadas(linhas)
+    ausente = [None] * len(METRICAS_AGREGADAS)
+    anteriores = [gravadas.get((linha['inversor_id'], linha['medido_em']), ausente) for linha in linhas]
+
+    estatisticas = {'leituras': np.array([valores is ausente for valores in anteriores], dtype=float)}
+    for i, metrica in enumerate(METRICAS_AGREGADAS):
+        novos = np.array([linha.get(metrica) for linha in linhas], dtype=float)
+        antigos = np.array([valores[i] for valores in anteriores], dtype=float)
+        estatisticas[f'{metrica}_soma'] = np.nan_to_num(novos) - np.nan_to_num(antigos)
+        estatisticas[f'{metrica}_qtd'] = (~np.isnan(novos)).astype(float) - (~np.isnan(antigos))
+        estatisticas[f'{metrica}_min'] = novos
+        estatisticas[f'{metrica}_max'] = novos
+
+    ids = np.array([linha['inversor_id'] for linha in linhas])
+    segundos = _segundos([linha['medido_em'] for linha in linhas])
+    parque_de = dict(db.session.query(Inversor.id, Inversor.parque_id).filter(Inversor.id.in_(set(ids.tolist()))).all())
+    parques = np.array([parque_de[inversor_id] for inversor_id in ids.tolist()])
+
+    for modelo, coluna_id, origem in ((AgregadoInversorHora, 'inversor_id', ids), (AgregadoParqueHora, 'parque_id', parques)):
+        chaves, combinadas = _combinar(origem, segundos // 3600 * 3600, estatisticas)
+        _acumular(modelo, [coluna_id, 'inicio'], _linhas(chaves, combinadas, coluna_id, 'inicio', _para_datetime))
+    for modelo, coluna_id, origem in ((AgregadoInversorDia, 'inversor_id', ids), (AgregadoParqueDia, 'parque_id', parques)):
+        chaves, combinadas = _combinar(origem, segundos // 86400, estatisticas)
+        _acumular(modelo, [coluna_id, 'data'], _linhas(chaves, combinadas, coluna_id, 'data', _para_date))
+
+def marcar_alteracao_telemetria(datas=None):
+    """Incrementa a versão da telemetria na transação atual e a registra nos dias alterados.
+
+    Sem datas, registra a nova versão em todos os dias já conhecidos (usado
+    quando agregados de todo o histórico são refeitos). O commit fica com
+    quem chama.
+    """
+    VersaoCache.incrementar(CHAVE_VERSAO_TELEMETRIA)
+    versao = VersaoCache.obter(CHAVE_VERSAO_TELEMETRIA)
+    if datas is None:
+        VersaoTelemetriaDia.query.update({'versao': versao})
+    elif datas:
+        db.session.execute(upsert(VersaoTelemetriaDia.__table__, ['data'], ['versao']),
+                           [{'data': data, 'versao': versao} for data in datas])
+
+def recalcular_agregados_parques(parques_ids):
+    """Refaz todo o histórico dos agregados dos parques a partir dos inversores e faz o commit.
+
+    Usado quando um inversor é excluído ou muda de parque.
+    """
+    for parque_id in parques_ids:
+        # Serializa reconstruções simultâneas do mesmo parque
+        db.session.query(Parque.id).filter(Parque.id == parque_id).with_for_update().all()
+        AgregadoParqueHora.query.filter_by(parque_id=parque_id).delete()
+        AgregadoParqueDia.query.filter_by(parque_id=parque_id).delete()
+        _recalcular_parque(parque_id)
+        marcar_alteracao_telemetria()
+        db.session.commit()
+
+def reconstruir_agregados():
+    """Apaga e recalcula todos os agregados a partir das medições, em blocos por inversor.
+
+    Retorna a quantidade de inversores processados.
+    """
+    for modelo in (AgregadoInversorHora, AgregadoInversorDia, AgregadoParqueHora, AgregadoParqueDia):
+        modelo.query.delete()
+    db.session.commit()
+
+    inversores = db.session.query(Inversor.id).order_by(Inversor.id).all()
+    for (inversor_id,) in inversores:
+        primeira, ultima = db.session.query(
+            func.min(MedicaoTelemetria.medido_em), func.max(MedicaoTelemetria.medido_em)
+        ).filter(MedicaoTelemetria.inversor_id == inversor_id).one()
+        if primeira is None:
+            continue
+        inicio = datetime.combine(primeira.date(), time.min)
+        while inicio <= ultima:
+            fim = inicio + timedelta(days=DIAS_BLOCO_RECONSTRUCAO)
+            recalcular_agregados([inversor_id], inicio, fim - timedelta(hours=1))
+            db.session.commit()
+            inicio = fim
+
+    parques_ids = [parque_id for (parque_id,) in db.session.query(Inversor.parque_id).distinct().all()]
+    recalcular_agregados_parques(parques_ids)
+    return len(inversores)
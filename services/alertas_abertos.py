@@ -0,0 +1,96 @@
+"""Índice em memória dos pares (inversor, regra) com alerta aberto"""
+from models import Alerta, VersaoCache, db
+import threading
+import time
+
+# Chave em versoes_cache incrementada quando alertas são abertos ou resolvidos
+CHAVE_VERSAO = 'alertas'
+
+# Intervalo mínimo em segundos entre consultas à versão dos alertas no banco
+INTERVALO_VERIFICACAO = 5
+
+class IndiceAlertasAbertos:
+    """Conjunto de pares (inversor_id, regra_id) com alerta não resolvido.
+
+    É carregado do banco no primeiro uso e atualizado localmente ao abrir e
+    resolver alertas. Alterações feitas por outros processos são percebidas
+    pela versão em versoes_cache, consultada no máximo a cada
+    INTERVALO_VERIFICACAO segundos.
+    """
+
+    def __init__(self):
+        self._pares = None
+        self._versao = None
+        self._verificado_em = 0.0
+        self._lock = threading.Lock()
+
+    def _carregar(self, versao):
+        pares = db.session.query(Alerta.inversor_id, Alerta.regra_id).filter(
+            Alerta.resolvido == False
+        ).distinct().all()
+        self._pares = {tuple(par) for par in pares}
+        self._versao = versao
+
+    def _atualizar(self):
+        agora = time.monotonic()
+        if self._pares is not None and agora - self._verificado_em < INTERVALO_VERIFICACAO:
+            return
+        with self._lock:
+            if self._pares is not None and agora - self._verificado_em < INTERVALO_VERIFICACAO:
+                return
+            versao = VersaoCache.obter(CHAVE_VERSAO)
+            if self._pares is None or versao != self._versao:
+                self._carregar(versao)
+            self._verificado_em = agora
+
+    def aberto(self, inversor_id, regra_id):
+        """Indica se já existe alerta não resolvido para o inversor e a regra"""
+        self._atualizar()
+        return (inversor_id, regra_id) in self._pares
+
+    def pares(self):
+        """Retorna uma cópia do conjunto de pares abertos"""
+        self._atualizar()
+        with self._lock:
+            return set(self._pares)
+
+    def registrar(self, abertos=(), resolvidos=(), versao_incrementada=True):
+        """Aplica ao índice local uma alteração já gravada no banco.
+
+        Cada chamada com versao_incrementada corresponde a um incremento da
+        versão; se outro processo também alterou os alertas, a versão não
+        confere e o índice é recarregado.
+        """
+        with self._lock:
+            if self._pares is None:
+                return
+            self._pares.update(abertos)
+            self._pares.difference_update(resolvidos)
+            if versao_incrementada:
+                self._versao += 1
+
+_indice = IndiceAlertasAbertos()
+
+def alerta_aberto(inversor_id, regra_id):
+    """Indica se já existe alerta não resolvido para o inversor e a regra"""
+    return _indice.aberto(inversor_id, regra_id)
+
+def obter_alertas_abertos():
+    """Retorna o conjunto de pares (inversor_id, regra_id) com alerta aberto"""
+    return _indice.pares()
+
+def marcar_alteracao_alertas():
+    """Incrementa a versão dos alertas na transação atual (o commit fica com quem chama)"""
+    VersaoCache.incrementar(CHAVE_VERSAO)
+
+def registrar_alertas_abertos(pares, versao_incrementada=True):
+    """Atualiza o índice local após o commit de alertas novos.
+
+    Use versao_incrementada=False para pares que já estavam abertos no banco
+    (inserções descartadas pela chave única), sem incremento da versão.
+    """
+    _indice.registrar(abertos=pares, versao_incrementada=versao_incrementada)
+
+def registrar_alertas_resolvidos(pares):
+    """Atualiza o índice local após o commit de alertas resolvidos"""
+    _indice.registrar(resolvidos=pares)
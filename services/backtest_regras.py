@@ -0,0 +1,181 @@
+"""Backtest de regras de alerta sobre o histórico de telemetria, sem gravar alertas.
+
+As medições de cada inversor são lidas em blocos de colunas (instante e
+valor da métrica da regra) e avaliadas com NumPy. Apenas a cauda necessária
+para a janela da regra passa de um bloco para o seguinte, então a memória
+usada não depende do tamanho do período.
+"""
+from models import MedicaoTelemetria, Inversor, db
+from services.regras_service import OPERADORES_NUMPY
+from services.janelas import MIN_LEITURAS_JANELA
+from services.expressoes import COLUNAS_EXPRESSAO
+from datetime import date, datetime, timedelta
+from sqlalchemy import select
+import numpy as np
+
+# Linhas lidas do banco por bloco
+TAMANHO_BLOCO_BACKTEST = 50000
+
+_VAZIO = (np.empty(0), np.empty(0))
+
+def _avaliar_expressao(regra, tempos, colunas, capacidade_kw):
+    """Avalia uma regra com expressão sobre um bloco de leituras de um inversor"""
+    contexto = dict(colunas)
+    contexto['capacidade'] = capacidade_kw
+    contexto['hora'] = (tempos % 86400) // 3600
+    return np.broadcast_to(regra.expressao.avaliar(contexto), tempos.shape)
+
+def _avaliar_bloco(regra, tempos, valores, cauda):
+    """Avalia a regra sobre um bloco de leituras de um inversor.
+
+    tempos (segundos) e valores são os do bloco; cauda são as leituras do
+    bloco anterior ainda necessárias para a janela. Retorna (condição por
+    leitura do bloco, nova cauda).
+    """
+    comparar = OPERADORES_NUMPY[regra.operador]
+    n_cauda = len(cauda[0])
+    t = np.concatenate([cauda[0], tempos])
+    v = np.concatenate([cauda[1], valores])
+
+    if regra.janela_tipo == 'media':
+        janela = regra.janela * 60
+        somas = np.concatenate([[0.0], np.cumsum(v)])
+        fim = np.arange(n_cauda, len(v)) + 1
+        inicio = np.searchsorted(t, t[n_cauda:] - janela, side='left')
+        avaliados = (somas[fim] - somas[inicio]) / (fim - inicio)
+        # Mesmo mínimo de leituras da avaliação na ingestão
+        condicao = comparar(avaliados, regra.valor_threshold) & ((fim - inicio) >= MIN_LEITURAS_JANELA)
+        corte = np.searchsorted(t, t[-1] - janela, side='left')
+        return condicao, (t[corte:], v[corte:])
+
+    if regra.janela_tipo == 'consecutivas':
+        satisfeitas = np.concatenate([[0], np.cumsum(comparar(v, regra.valor_threshold))])
+        fim = np.arange(n_cauda, len(v)) + 1
+        inicio = fim - regra.janela
+        completas = inicio >= 0
+        contagem = satisfeitas[fim] - satisfeitas[np.maximum(inicio, 0)]
+        condicao = completas & (contagem == regra.janela)
+        corte = max(0, len(v) - (regra.janela - 1))
+        return condicao, (t[corte:], v[corte:])
+
+    return comparar(valores, regra.valor_threshold), _VAZIO
+
+def _blocos_inversor(inversor_id, colunas, inicio, fim, somente_preenchidas):
+    """Lê as medições de um inversor no período em blocos de arrays.
+
+    Produz (tempos em segundos, {coluna: valores}); valores ausentes viram NaN.
+    Com somente_preenchidas, leituras com a coluna vazia são descartadas.
+    """
+    consulta = select(
+        MedicaoTelemetria.medido_em, *[getattr(MedicaoTelemetria, coluna) for coluna in colunas]
+    ).where(
+        MedicaoTelemetria.inversor_id == inversor_id,
+        MedicaoTelemetria.no_periodo(inicio, fim)
+    ).order_by(MedicaoTelemetria.medido_em)
+    if somente_preenchidas:
+        consulta = consulta.where(getattr(MedicaoTelemetria, colunas[0]).isnot(None))
+
+    resultado = db.session.execute(consulta, execution_options={'yield_per': TAMANHO_BLOCO_BACKTEST})
+    for bloco in resultado.partitions():
+        instantes, *valores = zip(*bloco)
+        tempos = np.array(instantes, dtype='datetime64[s]').astype(np.int64).astype(float)
+        yield tempos, {coluna: np.array(serie, dtype=float) for coluna, serie in zip(colunas, valores)}
+
+def _data_iso(segundos):
+    return np.datetime64(int(segundos), 's').astype(datetime).isoformat()
+
+def backtest_regra(regra, dias=30, parque_id=None, inversor_id=None):
+    """Simula a regra compilada sobre os últimos `dias` dias de telemetria.
+
+    Cada transição da condição de falsa para verdadeira conta como um disparo,
+    que é quando um alerta seria aberto se o anterior tivesse sido resolvido.
+    Retorna totais, disparos por inversor (com primeiro e último disparo) e
+    um histograma diário de disparos.
+    """
+    fim = date.today()
+    inicio = fim - timedelta(days=dias - 1)
+    if regra.expressao is not None:
+        colunas = [coluna for coluna in COLUNAS_EXPRESSAO if coluna in regra.expressao.variaveis]
+    else:
+        colunas = [regra.coluna]
+
+    inversores = db.session.query(Inversor.id, Inversor.capacidade_kw)
+    if parque_id is not None:
+        inversores = inversores.filter(Inversor.parque_id == parque_id)
+    if inversor_id is not None:
+        inversores = inversores.filter(Inversor.id == inversor_id)
+
+    # Escopo da regra
+    if regra.parque_id is not None:
+        inversores = inversores.filter(Inversor.parque_id == regra.parque_id)
+    if regra.modelo_inversor is not None:
+        inversores = inversores.filter(Inversor.modelo == regra.modelo_inversor)
+    if regra.inversores_ids is not None:
+        inversores = inversores.filter(Inversor.id.in_(regra.inversores_ids))
+
+    total_leituras = 0
+    total_disparos = 0
+    histograma = {}
+    por_inversor = []
+
+    for id_inversor, capacidade_kw in inversores.order_by(Inversor.id).all():
+        cauda = _VAZIO
+        anterior = False
+        leituras = 0
+        em_violacao = 0
+        disparos = 0
+        primeiro = ultimo = None
+
+        with np.errstate(invalid='ignore'):
+            blocos = _blocos_inversor(id_inversor, colunas, inicio, fim, regra.expressao is None)
+            for tempos, valores in blocos:
+                if regra.expressao is not None:
+                    condicao = _avaliar_expressao(regra, tempos, valores, capacidade_kw)
+                else:
+                    condicao, cauda = _avaliar_bloco(regra, tempos, valores[regra.coluna], cauda)
+
+                # Disparo: condição verdadeira após leitura em que era falsa
+                anteriores = np.concatenate([[anterior], condicao[:-1]])
+                bordas = tempos[condicao & ~anteriores]
+                anterior = bool(condicao[-1])
+
+                leituras += len(tempos)
+                em_violacao += int(condicao.sum())
+                if len(bordas):
+                    disparos += len(bordas)
+                    if primeiro is None:
+                        primeiro = bordas[0]
+                    ultimo = bordas[-1]
+                    dias_bordas, contagens = np.unique(bordas // 86400, return_counts=True)
+                    for dia, contagem in zip(dias_bordas, contagens):
+                        dia = int(dia)
+                        histograma[dia] = histograma.get(dia, 0) + int(contagem)
+
+        total_leituras += leituras
+        total_disparos += disparos
+        if disparos:
+            por_inversor.append({
+                'inversor_id': id_inversor,
+                'disparos': disparos,
+                'leituras': leituras,
+                'leituras_em_violacao': em_violacao,
+                'primeiro_disparo': _data_iso(primeiro),
+                'ultimo_disparo': _data_iso(ultimo)
+            })
+
+    por_inversor.sort(key=lambda item: item['disparos'], reverse=True)
+    histograma_diario = []
+    for i in range(dias):
+        dia = inicio + timedelta(days=i)
+        chave = (dia - date(1970, 1, 1)).days
+        histograma_diario.append({'data': dia.isoformat(), 'disparos': histograma.get(chave, 0)})
+
+    return {
+        'inicio': inicio.isoformat(),
+        'fim': fim.isoformat(),
+        'leituras': total_leituras,
+        'disparos': total_disparos,
+        'inversores_com_disparo': len(por_inversor),
+        'inversores': por_inversor,
+        'histograma_diario': histograma_diario
+    }
@@ -0,0 +1,116 @@
+"""Cache em memória dos metadados de inversores usados na ingestão de telemetria"""
+from models import Inversor, VersaoCache, db
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+InversorMeta = namedtuple('InversorMeta', ['id', 'capacidade_kw', 'parque_id', 'status', 'modelo'])
+
+# Chave em versoes_cache incrementada a cada alteração de inversor
+CHAVE_VERSAO = 'inversores'
+
+# Intervalo mínimo em segundos entre consultas à versão dos inversores no banco
+INTERVALO_VERIFICACAO = 5
+
+# Marca inversores consultados que não existem, evitando repetir a consulta
+_INEXISTENTE = object()
+
+class CacheInversores:
+    """Cache LRU com expiração por tempo para metadados de inversores.
+
+    Alterações feitas por outros processos (workers do gunicorn) são
+    percebidas pela versão 'inversores' em versoes_cache, consultada no
+    máximo a cada INTERVALO_VERIFICACAO segundos; a expiração por tempo
+    é uma garantia adicional.
+    """
+
+    def __init__(self, max_itens=10000, ttl=60):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._versao = None
+        self._verificado_em = 0.0
+
+    def _verificar_versao(self, agora):
+        if agora - self._verificado_em < INTERVALO_VERIFICACAO:
+            return
+        versao = VersaoCache.obter(CHAVE_VERSAO)
+        with self._lock:
+            if versao != self._versao:
+                self._itens.clear()
+                self._versao = versao
+            self._verificado_em = agora
+
+    def obter_varios(self, ids):
+        """Retorna {id: InversorMeta} para os ids existentes, consultando o banco só para os ausentes do cache"""
+        agora = time.monotonic()
+        self._verificar_versao(agora)
+        encontrados = {}
+        faltantes = set()
+        with self._lock:
+            for inversor_id in ids:
+                item = self._itens.get(inversor_id)
+                if item is None or item[0] < agora:
+                    faltantes.add(inversor_id)
+                    continue
+                self._itens.move_to_end(inversor_id)
+                if item[1] is not _INEXISTENTE:
+                    encontrados[inversor_id] = item[1]
+
+        if faltantes:
+            linhas = db.session.query(
+                Inversor.id, Inversor.capacidade_kw, Inversor.parque_id, Inversor.status, Inversor.modelo
+            ).filter(Inversor.id.in_(faltantes)).all()
+            carregados = {linha.id: InversorMeta(*linha) for linha in linhas}
+            encontrados.update(carregados)
+
+            expira_em = agora + self.ttl
+            with self._lock:
+                for inversor_id in faltantes:
+                    self._itens[inversor_id] = (expira_em, carregados.get(inversor_id, _INEXISTENTE))
+                    self._itens.move_to_end(inversor_id)
+                while len(self._itens) > self.max_itens:
+                    self._itens.popitem(last=False)
+
+        return encontrados
+
+    def invalidar(self, inversor_id=None):
+        """Remove um inversor do cache, ou todos quando inversor_id é None"""
+        with self._lock:
+            # Verificar a versão na próxima consulta, já que ela mudou
+            self._verificado_em = 0.0
+            if inversor_id is None:
+                self._itens.clear()
+            else:
+                self._itens.pop(inversor_id, None)
+
+_cache = CacheInversores()
+
+def _normalizar_id(inversor_id):
+    try:
+        return int(inversor_id)
+    except (TypeError, ValueError):
+        return None
+
+def obter_inversor(inversor_id):
+    """Retorna o InversorMeta do inversor ou None se ele não existir"""
+    inversor_id = _normalizar_id(inversor_id)
+    if inversor_id is None:
+        return None
+    return _cache.obter_varios([inversor_id]).get(inversor_id)
+
+def obter_inversores(ids):
+    """Retorna {id: InversorMeta} para os inversores existentes entre os ids informados"""
+    ids = {i for i in (_normalizar_id(inversor_id) for inversor_id in ids) if i is not None}
+    if not ids:
+        return {}
+    return _cache.obter_varios(ids)
+
+def marcar_alteracao_inversores():
+    """Incrementa a versão dos inversores na transação atual (o commit fica com quem chama)"""
+    VersaoCache.incrementar(CHAVE_VERSAO)
+
+def invalidar_inversor(inversor_id=None):
+    """Invalida o cache após criar, editar ou excluir um inversor"""
+    _cache.invalidar(inversor_id)
@@ -0,0 +1,378 @@
+"""Cache das respostas JSON de /api/charts/* e dos filtros do dashboard.
+
+As respostas são iguais para todos os usuários, então ficam em um backend
+configurável (CACHE_RESPOSTAS): 'memoria' (LRU do processo, limitado por
+bytes, itens e TTL), 'arquivo' (um arquivo por resposta em um diretório
+compartilhado pelos workers do gunicorn) ou 'nenhum'.
+
+A chave de cada resposta inclui a maior versão dos dias do período que a
+view lê (versoes_telemetria_dia), então uma gravação de medições só
+invalida as respostas cujos períodos incluem os dias gravados. As versões
+são consultadas no banco no máximo a cada INTERVALO_VERIFICACAO segundos
+por processo; gravações feitas no próprio processo forçam a verificação.
+"""
+from flask import current_app, request, make_response
+from models import VersaoCache, VersaoTelemetriaDia, db
+from services.agregados import CHAVE_VERSAO_TELEMETRIA
+from collections import OrderedDict
+from datetime import timedelta
+from functools import wraps
+from urllib.parse import urlencode
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Intervalo mínimo em segundos entre consultas às versões no banco
+INTERVALO_VERIFICACAO = 5
+
+# Gravações entre duas podas do diretório do cache em arquivo
+PODA_A_CADA = 100
+
+# Versões em versoes_cache dos cadastros lidos por respostas em cache (a dos
+# inversores fica em services/cache_inversores.py)
+CHAVE_VERSAO_PARQUES = 'parques'
+CHAVE_VERSAO_PLACAS = 'placas'
+
+class BackendCache:
+    """Armazena corpos de resposta (bytes) por chave. Subclasses implementam _obter, _gravar e _ocupacao."""
+
+    nome = None
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.acertos = 0
+        self.faltas = 0
+        # Os contadores são atualizados por todas as threads do worker
+        self._lock_contadores = threading.Lock()
+
+    def obter(self, chave):
+        """Retorna o corpo em cache ou None"""
+        corpo = self._obter(chave)
+        with self._lock_contadores:
+            if corpo is None:
+                self.faltas += 1
+            else:
+                self.acertos += 1
+        return corpo
+
+    def gravar(self, chave, corpo):
+        self._gravar(chave, corpo)
+
+    def estatisticas(self):
+        """Acertos e faltas deste processo e ocupação do backend"""
+        with self._lock_contadores:
+            acertos, faltas = self.acertos, self.faltas
+        consultas = acertos + faltas
+        itens, ocupados = self._ocupacao()
+        return {
+            'backend': self.nome,
+            'acertos': acertos,
+            'faltas': faltas,
+            'taxa_acerto': round(acertos / consultas, 4) if consultas else None,
+            'itens': itens,
+            'bytes': ocupados,
+            'ttl_s': self.ttl
+        }
+
+    def _obter(self, chave):
+        raise NotImplementedError
+
+    def _gravar(self, chave, corpo):
+        raise NotImplementedError
+
+    def _ocupacao(self):
+        raise NotImplementedError
+
+class CacheMemoria(BackendCache):
+    """LRU em memória limitado por quantidade de itens, total de bytes e TTL"""
+
+    nome = 'memoria'
+
+    def __init__(self, max_bytes, max_itens=1000, ttl=300):
+        super().__init__(ttl)
+        self.max_bytes = max_bytes
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _obter(self, chave):
+        agora = time.monotonic()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            if item[0] <= agora:
+                self._remover(chave)
+                return None
+            self._itens.move_to_end(chave)
+            return item[1]
+
+    def _gravar(self, chave, corpo):
+        if len(corpo) > self.max_bytes:
+            return
+        with self._lock:
+            if chave in self._itens:
+                self._remover(chave)
+            self._itens[chave] = (time.monotonic() + self.ttl, corpo)
+            self._bytes += len(corpo)
+            while len(self._itens) > self.max_itens or self._bytes > self.max_bytes:
+                self._remover(next(iter(self._itens)))
+
+    def _remover(self, chave):
+        _, corpo = self._itens.pop(chave)
+        self._bytes -= len(corpo)
+
+    def _ocupacao(self):
+        with self._lock:
+            return len(self._itens), self._bytes
+
+    def estatisticas(self):
+        return {**super().estatisticas(), 'max_bytes': self.max_bytes, 'max_itens': self.max_itens}
+
+class CacheArquivo(BackendCache):
+    """Um arquivo por resposta em um diretório compartilhado entre processos.
+
+    Cada arquivo tem uma linha de cabeçalho JSON (chave e expiração) seguida
+    do corpo, e é gravado em um arquivo temporário renomeado por cima do
+    anterior, então leitores nunca veem um arquivo pela metade. A cada
+    PODA_A_CADA gravações o processo remove os expirados e, acima de
+    max_bytes, os mais antigos.
+    """
+
+    nome = 'arquivo'
+
+    def __init__(self, diretorio, max_bytes, ttl=300):
+        super().__init__(ttl)
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        self._gravacoes = 0
+        self._lock = threading.Lock()
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _caminho(self, chave):
+        return os.path.join(self.diretorio, hashlib.sha1(chave.encode('utf-8')).hexdigest() + '.cache')
+
+    def _obter(self, chave):
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, 'rb') as arquivo:
+                cabecalho = json.loads(arquivo.readline())
+                corpo = arquivo.read()
+        except (OSError, ValueError):
+            return None
+        if cabecalho.get('chave') != chave:
+            return None
+        if cabecalho.get('expira_em', 0) <= time.time():
+            self._apagar(caminho)
+            return None
+        return corpo
+
+    def _gravar(self, chave, corpo):
+        if len(corpo) > self.max_bytes:
+            return
+        cabecalho = json.dumps({'chave': chave, 'expira_em': time.time() + self.ttl}).encode('utf-8') + b'\n'
+        descritor, temporario = tempfile.mkstemp(dir=self.diretorio, suffix='.tmp')
+        try:
+            with os.fdopen(descritor, 'wb') as arquivo:
+                arquivo.write(cabecalho)
+                arquivo.write(corpo)
+            os.replace(temporario, self._caminho(chave))
+        except OSError:
+            self._apagar(temporario)
+            logger.exception('Erro ao gravar resposta no cache em %s', self.diretorio)
+            return
+
+        with self._lock:
+            self._gravacoes += 1
+            podar = self._gravacoes % PODA_A_CADA == 0
+        if podar:
+            self.podar()
+
+    def _entradas(self):
+        """Lista (caminho, tamanho, modificado_em) dos arquivos de cache"""
+        entradas = []
+        with os.scandir(self.diretorio) as arquivos:
+            for arquivo in arquivos:
+                if not arquivo.name.endswith('.cache'):
+                    continue
+                try:
+                    info = arquivo.stat()
+                except OSError:
+                    continue
+                entradas.append((arquivo.path, info.st_size, info.st_mtime))
+        return entradas
+
+    def podar(self):
+        """Remove as respostas expiradas e, acima de max_bytes, as gravadas há mais tempo"""
+        limite_expiracao = time.time() - self.ttl
+        restantes = []
+        for caminho, tamanho, modificado_em in self._entradas():
+            if modificado_em <= limite_expiracao:
+                self._apagar(caminho)
+            else:
+                restantes.append((caminho, tamanho, modificado_em))
+
+        total = sum(tamanho for _, tamanho, _ in restantes)
+        for caminho, tamanho, _ in sorted(restantes, key=lambda entrada: entrada[2]):
+            if total <= self.max_bytes:
+                break
+            self._apagar(caminho)
+            total -= tamanho
+
+    @staticmethod
+    def _apagar(caminho):
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+    def _ocupacao(self):
+        entradas = self._entradas()
+        return len(entradas), sum(tamanho for _, tamanho, _ in entradas)
+
+    def estatisticas(self):
+        return {**super().estatisticas(), 'max_bytes': self.max_bytes, 'diretorio': self.diretorio}
+
+class MarcasTelemetria:
+    """Versões por dia da telemetria e versões nomeadas de versoes_cache, em memória.
+
+    Quando a versão 'telemetria' muda, carrega só os dias alterados desde a
+    versão anterior (versao maior que a última vista).
+    """
+
+    def __init__(self, chaves=(CHAVE_VERSAO_TELEMETRIA,)):
+        self.chaves = tuple(chaves)
+        self._dias = {}
+        self._versoes = None
+        self._verificado_em = float('-inf')
+        self._lock = threading.Lock()
+
+    def _atualizar(self):
+        agora = time.monotonic()
+        if agora - self._verificado_em < INTERVALO_VERIFICACAO:
+            return
+        with self._lock:
+            if agora - self._verificado_em < INTERVALO_VERIFICACAO:
+                return
+            versoes = dict(db.session.query(VersaoCache.chave, VersaoCache.versao).filter(
+                VersaoCache.chave.in_(self.chaves)
+            ).all())
+            atual = versoes.get(CHAVE_VERSAO_TELEMETRIA, 0)
+            vista = self._versoes.get(CHAVE_VERSAO_TELEMETRIA, 0) if self._versoes is not None else None
+            if vista is None or atual < vista:
+                # Primeira carga (ou banco recriado): todos os dias
+                self._dias = dict(db.session.query(VersaoTelemetriaDia.data, VersaoTelemetriaDia.versao).all())
+            elif atual != vista:
+                # Novo dicionário em vez de update(): marca() itera o anterior sem o lock
+                novos = db.session.query(VersaoTelemetriaDia.data, VersaoTelemetriaDia.versao).filter(
+                    VersaoTelemetriaDia.versao > vista
+                ).all()
+                self._dias = {**self._dias, **dict(novos)}
+            self._versoes = versoes
+            self._verificado_em = agora
+
+    def marca(self, inicio, fim):
+        """Maior versão entre os dias de inicio a fim (inclusivos); 0 se nenhum mudou"""
+        self._atualizar()
+        dias = self._dias
+        quantidade = (fim - inicio).days + 1
+        if quantidade <= 0:
+            return 0
+        if quantidade > len(dias):
+            return max((versao for data, versao in dias.items() if inicio <= data <= fim), default=0)
+        return max((dias.get(inicio + timedelta(days=i), 0) for i in range(quantidade)), default=0)
+
+    def versao(self, chave):
+        """Versão atual de uma chave de versoes_cache acompanhada por este objeto"""
+        self._atualizar()
+        return self._versoes.get(chave, 0)
+
+    def verificar_na_proxima(self):
+        self._verificado_em = float('-inf')
+
+# A versão 'inversores' cobre a lista de inversores e os parques que têm inversores;
+# 'parques' e 'placas' cobrem os demais dados cadastrais dos gráficos e filtros
+_marcas = MarcasTelemetria((CHAVE_VERSAO_TELEMETRIA, 'inversores', CHAVE_VERSAO_PARQUES, CHAVE_VERSAO_PLACAS))
+
+_cache = None
+_cache_criado = False
+_cache_lock = threading.Lock()
+
+def criar_cache_respostas(config):
+    """Monta o backend configurado em CACHE_RESPOSTAS (None para 'nenhum')"""
+    backend = config['CACHE_RESPOSTAS']
+    max_bytes = int(config['CACHE_RESPOSTAS_MAX_MB'] * 1024 * 1024)
+    if backend == 'memoria':
+        return CacheMemoria(max_bytes, config['CACHE_RESPOSTAS_MAX_ITENS'], config['CACHE_RESPOSTAS_TTL'])
+    if backend == 'arquivo':
+        return CacheArquivo(config['CACHE_RESPOSTAS_DIRETORIO'], max_bytes, config['CACHE_RESPOSTAS_TTL'])
+    if backend == 'nenhum':
+        return None
+    raise ValueError(f'CACHE_RESPOSTAS inválido: {backend} (use memoria, arquivo ou nenhum)')
+
+def obter_cache_respostas():
+    """Retorna o backend de cache do processo, criando-o a partir da configuração do app"""
+    global _cache, _cache_criado
+    if not _cache_criado:
+        with _cache_lock:
+            if not _cache_criado:
+                _cache = criar_cache_respostas(current_app.config)
+                _cache_criado = True
+    return _cache
+
+def marcar_alteracao_parques():
+    """Incrementa a versão dos parques na transação atual (o commit fica com quem chama)"""
+    VersaoCache.incrementar(CHAVE_VERSAO_PARQUES)
+
+def marcar_alteracao_placas():
+    """Incrementa a versão das placas solares na transação atual (o commit fica com quem chama)"""
+    VersaoCache.incrementar(CHAVE_VERSAO_PLACAS)
+
+def verificar_marcas_telemetria():
+    """Faz a próxima resposta em cache conferir as versões no banco (após uma gravação neste processo)"""
+    _marcas.verificar_na_proxima()
+
+def resposta_em_cache(periodo=None, versoes=()):
+    """Decorador de views GET com resposta JSON igual para todos os usuários.
+
+    A chave é o endpoint com os argumentos da rota e da query string, mais a
+    maior versão dos dias do período retornado por periodo() (um par de
+    datas inicio, fim) e as versões das chaves de versoes_cache em versoes.
+    Views sem período dependem só do TTL. Só respostas 200 são guardadas.
+    """
+    def decorador(view):
+        @wraps(view)
+        def envoltorio(*args, **kwargs):
+            cache = obter_cache_respostas()
+            if cache is None:
+                return view(*args, **kwargs)
+
+            partes = [request.endpoint, urlencode(sorted(kwargs.items())),
+                      urlencode(sorted(request.args.items(multi=True)))]
+            if periodo is not None:
+                inicio, fim = periodo()
+                partes.append(f'{inicio.isoformat()}:{fim.isoformat()}:{_marcas.marca(inicio, fim)}')
+            for chave in versoes:
+                partes.append(f'{chave}:{_marcas.versao(chave)}')
+            chave_cache = '|'.join(partes)
+
+            corpo = cache.obter(chave_cache)
+            if corpo is not None:
+                resposta = current_app.response_class(corpo, mimetype='application/json')
+                resposta.headers['X-Cache'] = 'HIT'
+                return resposta
+
+            resposta = make_response(view(*args, **kwargs))
+            if resposta.status_code == 200 and resposta.is_json:
+                cache.gravar(chave_cache, resposta.get_data())
+            resposta.headers['X-Cache'] = 'MISS'
+            return resposta
+        return envoltorio
+    return decorador
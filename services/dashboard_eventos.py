@@ -0,0 +1,243 @@
+"""Eventos do dashboard em tempo real, transmitidos por Server-Sent Events em /api/dashboard/stream.
+
+Cada processo tem um difusor: enquanto houver assinantes, uma thread
+verifica as versões 'telemetria' e 'alertas' em versoes_cache (uma consulta
+por intervalo, independente da quantidade de clientes) e, quando mudam,
+calcula uma vez o evento com o que mudou nas métricas do dashboard (filtro
+padrão), as medições novas e os alertas novos, e o entrega a todos os
+assinantes. Gravações feitas no próprio processo acordam o difusor na hora.
+
+O id de cada evento é composto pelas versões e pelos últimos ids de medição
+e de alerta; um cliente que reconecta com Last-Event-ID recebe os eventos
+perdidos que ainda estão retidos, ou um snapshot completo.
+"""
+from models import MedicaoTelemetria, Alerta, Inversor, VersaoCache, db
+from services.agregados import CHAVE_VERSAO_TELEMETRIA
+from services.alertas_abertos import CHAVE_VERSAO as CHAVE_VERSAO_ALERTAS
+from services.dashboard_metricas import obter_metricas_dashboard, verificar_versao_metricas
+from collections import deque
+from sqlalchemy import func
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Eventos recentes retidos para a retomada de clientes reconectados
+EVENTOS_RETIDOS = 100
+
+# Alertas novos detalhados por evento (os demais só aparecem em alertas_ativos)
+ALERTAS_POR_EVENTO = 20
+
+# Eventos aguardando envio por assinante; quem encher a fila recebe um snapshot
+TAMANHO_FILA_ASSINANTE = 50
+
+class Assinatura:
+    """Conexão de um cliente do stream"""
+
+    def __init__(self):
+        self.fila = queue.Queue(maxsize=TAMANHO_FILA_ASSINANTE)
+
+    def entregar(self, evento, snapshot):
+        """Enfileira o evento; com a fila cheia, troca o que estiver pendente por um snapshot"""
+        try:
+            self.fila.put_nowait(evento)
+        except queue.Full:
+            with self.fila.mutex:
+                self.fila.queue.clear()
+            self.fila.put_nowait(snapshot)
+
+class DifusorDashboard:
+    """Calcula os eventos do dashboard uma vez por processo e os distribui às assinaturas"""
+
+    def __init__(self):
+        self._assinaturas = set()
+        self._eventos = deque(maxlen=EVENTOS_RETIDOS)
+        self._estado = None
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._thread = None
+
+    def assinar(self, app, ultimo_id=None, max_assinaturas=100):
+        """Registra uma assinatura, já com os eventos de retomada enfileirados.
+
+        Retorna None se o processo já tiver max_assinaturas conexões.
+        """
+        with self._lock:
+            if len(self._assinaturas) >= max_assinaturas:
+                return None
+            assinatura = Assinatura()
+            for evento in self._retomada(ultimo_id):
+                assinatura.fila.put_nowait(evento)
+            self._assinaturas.add(assinatura)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._executar, args=(app,), name='dashboard-eventos',
+                                                daemon=True)
+                self._thread.start()
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            self._assinaturas.discard(assinatura)
+
+    def notificar(self):
+        """Antecipa a próxima verificação (após uma gravação neste processo)"""
+        self._acordar.set()
+
+    def _retomada(self, ultimo_id):
+        """Eventos a enviar a um cliente novo: os perdidos desde ultimo_id ou um snapshot"""
+        if self._estado is None:
+            # O primeiro cálculo do difusor é enviado a todos como snapshot
+            return []
+        if ultimo_id == self._estado['id']:
+            return []
+        if ultimo_id:
+            perdidos = []
+            for evento in self._eventos:
+                if perdidos or evento['anterior'] == ultimo_id:
+                    perdidos.append(evento)
+            if 0 < len(perdidos) <= TAMANHO_FILA_ASSINANTE:
+                return perdidos
+        return [self._snapshot()]
+
+    def _snapshot(self):
+        estado = self._estado
+        return {
+            'id': estado['id'],
+            'tipo': 'snapshot',
+            'dados': {'metricas': estado['metricas'], 'alertas_ativos': estado['alertas_ativos']}
+        }
+
+    def _executar(self, app):
+        intervalo = app.config['DASHBOARD_STREAM_INTERVALO']
+        while True:
+            with self._lock:
+                if not self._assinaturas:
+                    self._thread = None
+                    return
+            with app.app_context():
+                try:
+                    self._verificar()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Erro ao calcular os eventos do dashboard')
+                finally:
+                    db.session.remove()
+            self._acordar.wait(intervalo)
+            self._acordar.clear()
+
+    def _verificar(self):
+        """Publica um evento se a telemetria ou os alertas mudaram desde o último"""
+        versoes = dict(db.session.query(VersaoCache.chave, VersaoCache.versao).filter(
+            VersaoCache.chave.in_([CHAVE_VERSAO_TELEMETRIA, CHAVE_VERSAO_ALERTAS])
+        ).all())
+        versoes = (versoes.get(CHAVE_VERSAO_TELEMETRIA, 0), versoes.get(CHAVE_VERSAO_ALERTAS, 0))
+        anterior = self._estado
+        if anterior is not None and anterior['versoes'] == versoes:
+            return
+
+        if anterior is None or anterior['versoes'][0] != versoes[0]:
+            verificar_versao_metricas()
+            metricas, _ = obter_metricas_dashboard('hoje')
+        else:
+            metricas = anterior['metricas']
+
+        ultima_medicao = db.session.query(func.max(MedicaoTelemetria.id)).scalar() or 0
+        if anterior is None or anterior['versoes'][1] != versoes[1]:
+            alertas_ativos = db.session.query(func.count(Alerta.id)).filter(Alerta.resolvido == False).scalar()
+        else:
+            alertas_ativos = anterior['alertas_ativos']
+
+        novos_alertas = []
+        if anterior is None:
+            ultimo_alerta = db.session.query(func.max(Alerta.id)).scalar() or 0
+        else:
+            ultimo_alerta = anterior['ultimo_alerta']
+            if anterior['versoes'][1] != versoes[1]:
+                novos_alertas = db.session.query(
+                    Alerta.id, Inversor.codigo_serie, Alerta.severidade, Alerta.mensagem, Alerta.criado_em
+                ).join(
+                    Inversor, Inversor.id == Alerta.inversor_id
+                ).filter(
+                    Alerta.id > ultimo_alerta
+                ).order_by(Alerta.id.desc()).limit(ALERTAS_POR_EVENTO).all()
+                if novos_alertas:
+                    ultimo_alerta = novos_alertas[0][0]
+
+        estado = {
+            'id': f'{versoes[0]}-{versoes[1]}-{ultima_medicao}-{ultimo_alerta}',
+            'versoes': versoes,
+            'metricas': metricas,
+            'alertas_ativos': alertas_ativos,
+            'ultima_medicao': ultima_medicao,
+            'ultimo_alerta': ultimo_alerta
+        }
+
+        with self._lock:
+            self._estado = estado
+            if anterior is None:
+                evento = self._snapshot()
+            else:
+                evento = {
+                    'id': estado['id'],
+                    'anterior': anterior['id'],
+                    'tipo': 'atualizacao',
+                    'dados': {
+                        'metricas': {chave: valor for chave, valor in metricas.items()
+                                     if anterior['metricas'].get(chave) != valor},
+                        # Pelo avanço do maior id; reenvios que substituem medições não contam
+                        'novas_medicoes': ultima_medicao - anterior['ultima_medicao'],
+                        'alertas_ativos': alertas_ativos,
+                        'novos_alertas': [{
+                            'id': alerta_id,
+                            'inversor': codigo,
+                            'severidade': severidade,
+                            'mensagem': mensagem,
+                            'criado_em': criado_em.isoformat()
+                        } for alerta_id, codigo, severidade, mensagem, criado_em in reversed(novos_alertas)]
+                    }
+                }
+                self._eventos.append(evento)
+            snapshot = self._snapshot()
+            for assinatura in self._assinaturas:
+                assinatura.entregar(evento, snapshot)
+
+_difusor = DifusorDashboard()
+
+def formatar_evento(evento):
+    """Serializa o evento no formato text/event-stream"""
+    dados = json.dumps(evento['dados'], ensure_ascii=False)
+    return f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {dados}\n\n"
+
+def transmitir(assinatura, heartbeat, duracao):
+    """Gerador do corpo da resposta SSE.
+
+    Envia um comentário a cada heartbeat segundos sem eventos e termina após
+    duracao segundos; o navegador reconecta sozinho, enviando Last-Event-ID.
+    """
+    fim = time.monotonic() + duracao
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            restante = fim - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                evento = assinatura.fila.get(timeout=min(heartbeat, restante))
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            yield formatar_evento(evento)
+    finally:
+        _difusor.cancelar(assinatura)
+
+def assinar_dashboard(app, ultimo_id=None):
+    """Cria uma assinatura do stream do dashboard, ou None se o limite de conexões foi atingido"""
+    return _difusor.assinar(app, ultimo_id, app.config['DASHBOARD_STREAM_MAX_CONEXOES'])
+
+def notificar_dashboard():
+    """Avisa o difusor e o cache de métricas deste processo de uma gravação já confirmada"""
+    verificar_versao_metricas()
+    _difusor.notificar()
@@ -0,0 +1,198 @@
+"""Métricas de /api/dashboard/metricas calculadas em uma passada e mantidas em cache.
+
+O conjunto de fatos do filtro (geração e eficiência por inversor no
+período, a partir de agregados_inversor_dia) é lido uma vez e todos os
+números (totais, parques e inversores com mais geração) saem dele. As
+respostas ficam em cache por filtro até a versão 'telemetria' mudar (a
+marca d'água incrementada a cada gravação de medições), com expiração por
+tempo como garantia para alterações cadastrais.
+"""
+from models import MedicaoTelemetria, Inversor, Parque, PlacaSolar, AgregadoInversorDia, VersaoCache, db
+from services.agregados import CHAVE_VERSAO_TELEMETRIA
+from collections import OrderedDict
+from datetime import date, timedelta
+from sqlalchemy import func, case
+import hashlib
+import json
+import threading
+import time
+
+# Dias antes de hoje incluídos em cada período (períodos desconhecidos valem 'hoje')
+PERIODOS = {'hoje': 0, 'semana': 7, 'mes': 30}
+
+# Intervalo mínimo em segundos entre consultas à versão da telemetria no banco
+INTERVALO_VERIFICACAO = 5
+
+def calcular_metricas_dashboard(periodo, parque_id=None, inversor_id=None, status_placa=None):
+    """Calcula as métricas do dashboard para o filtro com três consultas
+    (fatos por inversor, contagem de placas e últimas medições)"""
+    hoje = date.today()
+    data_inicio = hoje - timedelta(days=PERIODOS.get(periodo, 0))
+
+    filtros = []
+    if inversor_id:
+        filtros.append(Inversor.id == inversor_id)
+    elif parque_id:
+        filtros.append(Inversor.parque_id == parque_id)
+
+    # Fatos do filtro: uma linha por inversor com leituras no período
+    fatos = db.session.query(
+        Inversor.id,
+        Inversor.codigo_serie,
+        Parque.id,
+        Parque.nome,
+        func.sum(AgregadoInversorDia.geracao_kw_soma),
+        func.sum(AgregadoInversorDia.eficiencia_soma),
+        func.sum(AgregadoInversorDia.eficiencia_qtd)
+    ).select_from(AgregadoInversorDia).join(
+        Inversor, Inversor.id == AgregadoInversorDia.inversor_id
+    ).join(
+        Parque, Parque.id == Inversor.parque_id
+    ).filter(
+        AgregadoInversorDia.data >= data_inicio,
+        AgregadoInversorDia.data <= hoje,
+        *filtros
+    ).group_by(Inversor.id, Inversor.codigo_serie, Parque.id, Parque.nome).all()
+
+    geracao_total = 0.0
+    eficiencia_soma = 0.0
+    eficiencia_qtd = 0
+    geracao_parques = {}
+    inversores = []
+    for _, codigo, parque_id_fato, parque_nome, geracao, soma_ef, qtd_ef in fatos:
+        geracao = geracao or 0.0
+        geracao_total += geracao
+        eficiencia_soma += soma_ef or 0.0
+        eficiencia_qtd += qtd_ef or 0
+        nome_geracao = geracao_parques.setdefault(parque_id_fato, [parque_nome, 0.0])
+        nome_geracao[1] += geracao
+        eficiencia = (soma_ef or 0.0) / qtd_ef if qtd_ef else 0.0
+        if eficiencia > 0:
+            inversores.append((codigo, eficiencia, geracao))
+    eficiencia_media = eficiencia_soma / eficiencia_qtd if eficiencia_qtd else 0.0
+
+    parques_geracao = sorted(
+        (nome_geracao for nome_geracao in geracao_parques.values() if nome_geracao[1] > 0),
+        key=lambda nome_geracao: nome_geracao[1], reverse=True
+    )[:5]
+    inversores_performance = sorted(inversores, key=lambda inversor: inversor[1], reverse=True)[:5]
+
+    # Contadores de placas
+    query_placas = db.session.query(
+        func.count(PlacaSolar.id),
+        func.coalesce(func.sum(case((PlacaSolar.status == 'ligada', 1), else_=0)), 0)
+    )
+    if status_placa:
+        query_placas = query_placas.filter(PlacaSolar.status == status_placa)
+    total_placas, placas_ligadas = query_placas.one()
+
+    # Últimas medições, com o código do inversor na mesma consulta
+    query_medicoes = db.session.query(
+        MedicaoTelemetria.id,
+        Inversor.codigo_serie,
+        MedicaoTelemetria.data_medicao,
+        MedicaoTelemetria.hora_medicao,
+        MedicaoTelemetria.geracao_kw,
+        MedicaoTelemetria.eficiencia
+    ).join(
+        Inversor, Inversor.id == MedicaoTelemetria.inversor_id
+    ).filter(
+        MedicaoTelemetria.no_periodo(data_inicio, hoje)
+    )
+    if inversor_id:
+        query_medicoes = query_medicoes.filter(MedicaoTelemetria.inversor_id == inversor_id)
+    elif parque_id:
+        query_medicoes = query_medicoes.filter(Inversor.parque_id == parque_id)
+    ultimas_medicoes = query_medicoes.order_by(MedicaoTelemetria.medido_em.desc()).limit(10).all()
+
+    return {
+        'geracao_total': round(geracao_total, 2),
+        'eficiencia_media': round(eficiencia_media, 1),
+        'total_placas': total_placas,
+        'placas_ligadas': total_placas if status_placa else int(placas_ligadas),
+        'ultimas_medicoes': [{
+            'id': medicao_id,
+            'inversor_codigo': codigo[:10],
+            'data': data_medicao.strftime('%d/%m'),
+            'hora': hora_medicao.strftime('%H:%M') if hora_medicao else '',
+            'geracao_kw': round(float(geracao), 2),
+            'eficiencia': round(float(eficiencia or 0), 1)
+        } for medicao_id, codigo, data_medicao, hora_medicao, geracao, eficiencia in ultimas_medicoes],
+        'parques_geracao': [{'nome': nome, 'geracao': round(float(geracao), 2)}
+                            for nome, geracao in parques_geracao],
+        'inversores_performance': [{
+            'codigo': codigo[:10] if codigo else 'N/A',
+            'eficiencia': round(float(eficiencia), 1),
+            'geracao': round(float(geracao), 2)
+        } for codigo, eficiencia, geracao in inversores_performance]
+    }
+
+def gerar_etag(dados):
+    """ETag forte do conteúdo, igual em todos os processos para os mesmos dados"""
+    return hashlib.sha1(json.dumps(dados, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class CacheMetricasDashboard:
+    """Cache LRU das métricas do dashboard por (dia, periodo, parque_id, inversor_id, status_placa).
+
+    Todas as entradas são descartadas quando a versão da telemetria em
+    versoes_cache muda, consultada no máximo a cada INTERVALO_VERIFICACAO
+    segundos; a expiração por tempo cobre alterações cadastrais (placas,
+    nomes de parques) que não passam pela ingestão.
+    """
+
+    def __init__(self, max_itens=256, ttl=60):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._versao = None
+        self._verificado_em = 0.0
+
+    def _verificar_versao(self, agora):
+        if self._versao is not None and agora - self._verificado_em < INTERVALO_VERIFICACAO:
+            return self._versao
+        versao = VersaoCache.obter(CHAVE_VERSAO_TELEMETRIA)
+        with self._lock:
+            if versao != self._versao:
+                self._itens.clear()
+                self._versao = versao
+            self._verificado_em = agora
+        return versao
+
+    def obter(self, periodo, parque_id=None, inversor_id=None, status_placa=None):
+        """Retorna (métricas, etag) do filtro, calculando só se não estiverem em cache"""
+        if periodo not in PERIODOS:
+            periodo = 'hoje'
+        agora = time.monotonic()
+        versao = self._verificar_versao(agora)
+        chave = (date.today(), periodo, parque_id, inversor_id, status_placa)
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[0] > agora:
+                self._itens.move_to_end(chave)
+                return item[1], item[2]
+
+        dados = calcular_metricas_dashboard(periodo, parque_id, inversor_id, status_placa)
+        etag = gerar_etag(dados)
+        with self._lock:
+            # Se a versão mudou durante o cálculo, o resultado pode já estar desatualizado
+            if versao == self._versao:
+                self._itens[chave] = (agora + self.ttl, dados, etag)
+                self._itens.move_to_end(chave)
+                while len(self._itens) > self.max_itens:
+                    self._itens.popitem(last=False)
+        return dados, etag
+
+    def verificar_na_proxima(self):
+        """Faz a próxima consulta ao cache verificar a versão no banco (após uma gravação neste processo)"""
+        self._verificado_em = float('-inf')
+
+_cache = CacheMetricasDashboard()
+
+def obter_metricas_dashboard(periodo, parque_id=None, inversor_id=None, status_placa=None):
+    """Retorna (métricas, etag) do dashboard para o filtro"""
+    return _cache.obter(periodo, parque_id, inversor_id, status_placa)
+
+def verificar_versao_metricas():
+    """Faz o cache conferir a versão da telemetria na próxima consulta"""
+    _cache.verificar_na_proxima()
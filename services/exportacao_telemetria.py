@@ -0,0 +1,164 @@
+"""Exportação em stream das medições brutas de um parque ou inversor (CSV, NDJSON ou Parquet).
+
+Cada inversor é lido em uma consulta própria pela faixa do índice
+ix_medicao_inversor_medido_em, ordenada por medido_em, com cursor no
+servidor (yield_per) para o banco entregar as linhas em blocos. Cada bloco
+é convertido e entregue antes de o próximo ser lido, então a memória fica
+constante para qualquer período e o cabeçalho sai antes da primeira
+consulta. A saída pode ser compactada com gzip em stream.
+
+Parquet usa pandas e pyarrow (opcional: sem pyarrow, o formato não fica
+disponível).
+"""
+from models import MedicaoTelemetria, Inversor, db
+from sqlalchemy import select
+import csv
+import io
+import json
+import zlib
+
+FORMATOS_EXPORTACAO = ('csv', 'ndjson', 'parquet')
+
+TIPOS_CONTEUDO = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'parquet': 'application/vnd.apache.parquet'}
+
+# Colunas exportadas, nesta ordem
+COLUNAS_EXPORTACAO = ('inversor_id', 'codigo_serie', 'medido_em', 'geracao_kw', 'temperatura', 'tensao',
+                      'corrente', 'frequencia', 'eficiencia')
+
+# Linhas lidas do cursor e convertidas por vez
+TAMANHO_BLOCO_EXPORTACAO = 5000
+
+def parquet_disponivel():
+    """Indica se pandas e pyarrow estão instalados"""
+    try:
+        import pandas  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def listar_inversores_exportacao(inversor_id=None, parque_id=None):
+    """(id, codigo_serie) dos inversores exportados, em ordem de id"""
+    consulta = db.session.query(Inversor.id, Inversor.codigo_serie)
+    if inversor_id is not None:
+        consulta = consulta.filter(Inversor.id == inversor_id)
+    else:
+        consulta = consulta.filter(Inversor.parque_id == parque_id)
+    return consulta.order_by(Inversor.id).all()
+
+def _blocos(inversores, inicio, fim):
+    """Blocos de linhas (tuplas em COLUNAS_EXPORTACAO), inversor por inversor"""
+    for inversor_id, codigo in inversores:
+        consulta = select(
+            MedicaoTelemetria.medido_em,
+            MedicaoTelemetria.geracao_kw,
+            MedicaoTelemetria.temperatura,
+            MedicaoTelemetria.tensao,
+            MedicaoTelemetria.corrente,
+            MedicaoTelemetria.frequencia,
+            MedicaoTelemetria.eficiencia
+        ).where(MedicaoTelemetria.inversor_id == inversor_id)
+        if inicio is not None:
+            consulta = consulta.where(MedicaoTelemetria.medido_em >= inicio)
+        if fim is not None:
+            consulta = consulta.where(MedicaoTelemetria.medido_em < fim)
+        consulta = consulta.order_by(MedicaoTelemetria.medido_em, MedicaoTelemetria.id)
+
+        resultado = db.session.execute(consulta, execution_options={'yield_per': TAMANHO_BLOCO_EXPORTACAO})
+        try:
+            for bloco in resultado.partitions():
+                yield [(inversor_id, codigo, *linha) for linha in bloco]
+        finally:
+            resultado.close()
+
+def _csv(blocos):
+    saida = io.StringIO()
+    escritor = csv.writer(saida)
+    escritor.writerow(COLUNAS_EXPORTACAO)
+    yield saida.getvalue().encode('utf-8')
+    for bloco in blocos:
+        saida.seek(0)
+        saida.truncate()
+        escritor.writerows(
+            (inversor_id, codigo, medido_em.isoformat(), *valores)
+            for inversor_id, codigo, medido_em, *valores in bloco
+        )
+        yield saida.getvalue().encode('utf-8')
+
+def _ndjson(blocos):
+    for bloco in blocos:
+        linhas = []
+        for inversor_id, codigo, medido_em, *valores in bloco:
+            registro = dict(zip(COLUNAS_EXPORTACAO, (inversor_id, codigo, medido_em.isoformat(), *valores)))
+            linhas.append(json.dumps(registro, ensure_ascii=False))
+        yield ('\n'.join(linhas) + '\n').encode('utf-8')
+
+class _SaidaParquet:
+    """Destino do ParquetWriter que acumula os bytes escritos até serem retirados"""
+
+    def __init__(self):
+        self._partes = []
+        self._posicao = 0
+        self.closed = False
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def retirar(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        return dados
+
+def _parquet(blocos):
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = pa.schema([
+        ('inversor_id', pa.int64()),
+        ('codigo_serie', pa.string()),
+        ('medido_em', pa.timestamp('us')),
+        *[(coluna, pa.float64()) for coluna in COLUNAS_EXPORTACAO[3:]]
+    ])
+    saida = _SaidaParquet()
+    # Um row group por bloco; o rodapé com o índice dos row groups vai no fim
+    with pq.ParquetWriter(saida, esquema) as escritor:
+        for bloco in blocos:
+            tabela = pd.DataFrame.from_records(bloco, columns=COLUNAS_EXPORTACAO)
+            escritor.write_table(pa.Table.from_pandas(tabela, schema=esquema, preserve_index=False))
+            yield saida.retirar()
+    yield saida.retirar()
+
+def _gzip(partes):
+    compactador = zlib.compressobj(wbits=31)
+    for parte in partes:
+        # Z_SYNC_FLUSH entrega cada parte sem esperar o buffer do compactador encher
+        dados = compactador.compress(parte) + compactador.flush(zlib.Z_SYNC_FLUSH)
+        if dados:
+            yield dados
+    yield compactador.flush()
+
+def exportar_medicoes(inversores, formato='csv', inicio=None, fim=None, compactar=False):
+    """Gerador dos bytes da exportação das medições dos inversores ((id, codigo_serie), ...).
+
+    inicio e fim (datetimes, fim exclusivo) limitam o período. As linhas
+    saem agrupadas por inversor e, em cada um, em ordem de medido_em.
+    """
+    conversores = {'csv': _csv, 'ndjson': _ndjson, 'parquet': _parquet}
+    partes = conversores[formato](_blocos(inversores, inicio, fim))
+    return _gzip(partes) if compactar else partes
+
+def nome_arquivo_exportacao(formato, compactar, inversor_id=None, parque_id=None):
+    origem = f'inversor_{inversor_id}' if inversor_id is not None else f'parque_{parque_id}'
+    return f'telemetria_{origem}.{formato}' + ('.gz' if compactar else '')
@@ -0,0 +1,247 @@
+"""Linguagem de expressões das regras compostas.
+
+Exemplo: geracao_kw < 0.2 * capacidade AND temperatura > 60 AND hora BETWEEN 10 AND 15
+
+A expressão é analisada uma vez e compilada em funções aninhadas que usam
+ufuncs do NumPy. O mesmo avaliador recebe um contexto com valores escalares
+(uma leitura, na ingestão) ou com arrays (uma coluna por variável, na
+varredura e no backtest). Valores ausentes devem ser NaN.
+
+As condições usam lógica de três valores, como NULL no SQL: internamente
+valem 1.0 (verdadeira), 0.0 (falsa) ou NaN (desconhecida, quando a
+comparação envolve um valor ausente). NOT de uma condição desconhecida
+continua desconhecida, AND com uma condição falsa é falso e OR com uma
+verdadeira é verdadeiro. A regra só dispara quando a expressão inteira é
+verdadeira, então uma leitura sem temperatura não satisfaz
+NOT temperatura > 60.
+"""
+from collections import namedtuple
+import re
+import numpy as np
+
+# Variáveis disponíveis nas expressões
+VARIAVEIS_EXPRESSAO = {
+    'geracao_kw': 'Geração (kW)',
+    'temperatura': 'Temperatura (°C)',
+    'tensao': 'Tensão (V)',
+    'corrente': 'Corrente (A)',
+    'frequencia': 'Frequência (Hz)',
+    'eficiencia': 'Eficiência (%)',
+    'capacidade': 'Capacidade do inversor (kW)',
+    'hora': 'Hora da medição (0 a 23)'
+}
+
+# Variáveis que são colunas de MedicaoTelemetria
+COLUNAS_EXPRESSAO = ('geracao_kw', 'temperatura', 'tensao', 'corrente', 'frequencia', 'eficiencia')
+
+_COMPARACOES = {
+    '<': np.less,
+    '>': np.greater,
+    '<=': np.less_equal,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal
+}
+
+_ARITMETICAS = {
+    '+': np.add,
+    '-': np.subtract,
+    '*': np.multiply,
+    '/': np.divide
+}
+
+_TOKEN = re.compile(r'\s*(?:(\d+(?:\.\d*)?|\.\d+)|([A-Za-z_]\w*)|(<=|>=|==|!=|[<>+\-*/()]))')
+
+_PALAVRAS = {'AND', 'OR', 'NOT', 'BETWEEN'}
+
+ExpressaoCompilada = namedtuple('ExpressaoCompilada', ['texto', 'variaveis', 'avaliar'])
+
+def _condicao(resultado, *operandos):
+    """Condição em três valores: 1.0 ou 0.0, ou NaN quando algum operando é ausente"""
+    ausente = np.isnan(operandos[0])
+    for operando in operandos[1:]:
+        ausente = ausente | np.isnan(operando)
+    return np.where(ausente, np.nan, resultado)
+
+def _e_logico(a, b):
+    # Falso se algum lado é falso; senão desconhecido se algum é NaN (minimum propaga NaN)
+    return np.where((a == 0) | (b == 0), 0.0, np.minimum(a, b))
+
+def _ou_logico(a, b):
+    # Verdadeiro se algum lado é verdadeiro; senão desconhecido se algum é NaN
+    return np.where((a == 1) | (b == 1), 1.0, np.maximum(a, b))
+
+def _tokens(texto):
+    tokens = []
+    posicao = 0
+    texto = texto.rstrip()
+    while posicao < len(texto):
+        encontrado = _TOKEN.match(texto, posicao)
+        if not encontrado:
+            raise ValueError(f'Caractere inválido na expressão: {texto[posicao:].strip()[:10]!r}')
+        numero, nome, simbolo = encontrado.groups()
+        if numero is not None:
+            tokens.append(('numero', float(numero)))
+        elif nome is not None:
+            if nome.upper() in _PALAVRAS:
+                tokens.append(('palavra', nome.upper()))
+            else:
+                tokens.append(('nome', nome))
+        else:
+            tokens.append(('simbolo', simbolo))
+        posicao = encontrado.end()
+    return tokens
+
+class _Analisador:
+    """Analisador descendente recursivo. Cada regra gramatical retorna (tipo, função),
+    onde tipo é 'numero' ou 'logico' e função recebe o contexto."""
+
+    def __init__(self, texto):
+        self.tokens = _tokens(texto)
+        self.posicao = 0
+        self.variaveis = set()
+
+    def _atual(self):
+        return self.tokens[self.posicao] if self.posicao < len(self.tokens) else (None, None)
+
+    def _aceitar(self, tipo, valor=None):
+        token = self._atual()
+        if token[0] == tipo and (valor is None or token[1] == valor):
+            self.posicao += 1
+            return token
+        return None
+
+    def _exigir(self, tipo, valor, descricao):
+        if not self._aceitar(tipo, valor):
+            raise ValueError(f'Esperado {descricao} na expressão')
+
+    def analisar(self):
+        if not self.tokens:
+            raise ValueError('Expressão vazia')
+        tipo, funcao = self._ou()
+        if self.posicao < len(self.tokens):
+            raise ValueError(f'Trecho inesperado na expressão: {self.tokens[self.posicao][1]}')
+        if tipo != 'logico':
+            raise ValueError('A expressão deve ser uma condição (use <, >, <=, >=, ==, != ou BETWEEN)')
+        return funcao
+
+    def _logico(self, item, operador):
+        tipo, funcao = item
+        if tipo != 'logico':
+            raise ValueError(f'{operador} deve ligar condições, não valores numéricos')
+        return funcao
+
+    def _ou(self):
+        esquerda = self._e()
+        while self._aceitar('palavra', 'OR'):
+            a = self._logico(esquerda, 'OR')
+            b = self._logico(self._e(), 'OR')
+            esquerda = ('logico', lambda ctx, a=a, b=b: _ou_logico(a(ctx), b(ctx)))
+        return esquerda
+
+    def _e(self):
+        esquerda = self._nao()
+        while self._aceitar('palavra', 'AND'):
+            a = self._logico(esquerda, 'AND')
+            b = self._logico(self._nao(), 'AND')
+            esquerda = ('logico', lambda ctx, a=a, b=b: _e_logico(a(ctx), b(ctx)))
+        return esquerda
+
+    def _nao(self):
+        if self._aceitar('palavra', 'NOT'):
+            a = self._logico(self._nao(), 'NOT')
+            return ('logico', lambda ctx: 1.0 - a(ctx))
+        return self._comparacao()
+
+    def _numerico(self, item):
+        tipo, funcao = item
+        if tipo != 'numero':
+            raise ValueError('Comparações e operações aritméticas devem usar valores numéricos')
+        return funcao
+
+    def _comparacao(self):
+        esquerda = self._soma()
+        if self._aceitar('palavra', 'BETWEEN'):
+            valor = self._numerico(esquerda)
+            minimo = self._numerico(self._soma())
+            self._exigir('palavra', 'AND', 'AND após BETWEEN')
+            maximo = self._numerico(self._soma())
+            def entre(ctx):
+                v, a, b = valor(ctx), minimo(ctx), maximo(ctx)
+                return _condicao(np.greater_equal(v, a) & np.less_equal(v, b), v, a, b)
+            return ('logico', entre)
+        token = self._atual()
+        if token[0] == 'simbolo' and token[1] in _COMPARACOES:
+            self.posicao += 1
+            comparar = _COMPARACOES[token[1]]
+            a = self._numerico(esquerda)
+            b = self._numerico(self._soma())
+            def comparacao(ctx):
+                x, y = a(ctx), b(ctx)
+                return _condicao(comparar(x, y), x, y)
+            return ('logico', comparacao)
+        return esquerda
+
+    def _soma(self):
+        esquerda = self._termo()
+        while self._atual()[0] == 'simbolo' and self._atual()[1] in ('+', '-'):
+            operar = _ARITMETICAS[self._atual()[1]]
+            self.posicao += 1
+            a = self._numerico(esquerda)
+            b = self._numerico(self._termo())
+            esquerda = ('numero', lambda ctx, a=a, b=b, operar=operar: operar(a(ctx), b(ctx)))
+        return esquerda
+
+    def _termo(self):
+        esquerda = self._fator()
+        while self._atual()[0] == 'simbolo' and self._atual()[1] in ('*', '/'):
+            operar = _ARITMETICAS[self._atual()[1]]
+            self.posicao += 1
+            a = self._numerico(esquerda)
+            b = self._numerico(self._fator())
+            esquerda = ('numero', lambda ctx, a=a, b=b, operar=operar: operar(a(ctx), b(ctx)))
+        return esquerda
+
+    def _fator(self):
+        token = self._aceitar('numero')
+        if token:
+            valor = token[1]
+            return ('numero', lambda ctx: valor)
+        token = self._aceitar('nome')
+        if token:
+            nome = token[1]
+            if nome not in VARIAVEIS_EXPRESSAO:
+                raise ValueError(f'Variável desconhecida na expressão: {nome}')
+            self.variaveis.add(nome)
+            return ('numero', lambda ctx: ctx[nome])
+        if self._aceitar('simbolo', '-'):
+            a = self._numerico(self._fator())
+            return ('numero', lambda ctx: np.negative(a(ctx)))
+        if self._aceitar('simbolo', '('):
+            item = self._ou()
+            self._exigir('simbolo', ')', '")"')
+            return item
+        raise ValueError('Expressão incompleta' if self._atual()[0] is None
+                         else f'Trecho inesperado na expressão: {self._atual()[1]}')
+
+def compilar_expressao(texto):
+    """Analisa a expressão e retorna uma ExpressaoCompilada. Lança ValueError se for inválida."""
+    analisador = _Analisador(texto or '')
+    funcao = analisador.analisar()
+
+    def avaliar(contexto):
+        # Só dispara o que é verdadeiro: condições desconhecidas (NaN) contam como
+        # falsas. Divisões por zero e NaN não geram avisos
+        with np.errstate(all='ignore'):
+            return funcao(contexto) == 1.0
+
+    return ExpressaoCompilada(texto.strip(), frozenset(analisador.variaveis), avaliar)
+
+def contexto_medicao(medicao, capacidade_kw):
+    """Monta o contexto escalar de uma leitura (valores ausentes viram NaN)"""
+    contexto = {coluna: np.nan if medicao.get(coluna) is None else float(medicao[coluna])
+                for coluna in COLUNAS_EXPRESSAO}
+    contexto['capacidade'] = float(capacidade_kw) if capacidade_kw is not None else np.nan
+    medido_em = medicao.get('medido_em')
+    contexto['hora'] = float(medido_em.hour) if medido_em is not None else np.nan
+    return contexto
@@ -0,0 +1,261 @@
+"""Fila de ingestão assíncrona (write-behind) para medições de telemetria.
+
+As medições validadas são enfileiradas em memória e gravadas por uma thread
+em segundo plano, em micro-lotes fechados por tamanho ou por tempo.
+
+Como as medições já foram confirmadas com 202, um lote não é descartado por
+uma falha: erros transitórios do banco (conexão perdida, deadlock) são
+repetidos com espera crescente e, esgotadas as tentativas, o lote volta ao
+início da fila. Erros de dados dividem o lote ao meio até isolar as linhas
+recusadas, que vão para medicoes_rejeitadas. A verificação das regras roda
+depois do commit, e um erro nela não desfaz a gravação.
+"""
+from flask import current_app
+from collections import deque
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+import atexit
+import json
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Tentativas de gravação de um lote antes de devolvê-lo à fila, e espera inicial entre elas
+TENTATIVAS_GRAVACAO = 3
+ESPERA_TENTATIVA = 0.5
+
+def erro_transitorio(erro):
+    """Indica se a falha do banco tende a passar ao repetir (conexão, deadlock, lock wait)"""
+    if isinstance(erro, (OperationalError, InterfaceError)):
+        return True
+    return isinstance(erro, DBAPIError) and erro.connection_invalidated
+
+class FilaIngestao:
+    """Fila limitada de medições com gravação em micro-lotes"""
+
+    def __init__(self, app, capacidade=10000, tamanho_lote=500, intervalo=1.0):
+        self.app = app
+        self.capacidade = capacidade
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self._pendentes = deque()
+        self._condicao = threading.Condition()
+        self._thread = None
+        self._parar = False
+
+        # Estatísticas para monitoramento
+        self._gravacoes_recentes = deque()  # (instante, linhas) dos últimos 60s
+        self.linhas_gravadas = 0
+        self.linhas_rejeitadas = 0
+        self.lotes_gravados = 0
+        self.lotes_com_erro = 0
+        self.lotes_reenfileirados = 0
+        self.linhas_descartadas = 0
+        self.linhas_rejeitadas_banco = 0
+        self.erros_regras = 0
+        self.ultima_latencia = 0.0
+        self.latencia_maxima = 0.0
+
+    def enfileirar(self, linhas):
+        """Enfileira medições validadas. Retorna False se a fila estiver cheia."""
+        with self._condicao:
+            if len(self._pendentes) + len(linhas) > self.capacidade:
+                self.linhas_rejeitadas += len(linhas)
+                return False
+            self._pendentes.extend(linhas)
+            if len(self._pendentes) >= self.tamanho_lote:
+                self._condicao.notify()
+        self._iniciar()
+        return True
+
+    def retry_after(self):
+        """Estimativa em segundos até a fila ter espaço novamente"""
+        taxa = self.linhas_por_segundo()
+        if taxa <= 0:
+            return max(1, math.ceil(self.intervalo))
+        return max(1, min(60, math.ceil(len(self._pendentes) / taxa)))
+
+    def linhas_por_segundo(self):
+        """Taxa de gravação nos últimos 60 segundos"""
+        limite = time.monotonic() - 60
+        with self._condicao:
+            while self._gravacoes_recentes and self._gravacoes_recentes[0][0] < limite:
+                self._gravacoes_recentes.popleft()
+            total = sum(linhas for _, linhas in self._gravacoes_recentes)
+        return total / 60.0
+
+    def estatisticas(self):
+        """Retorna profundidade da fila, latência de gravação e vazão"""
+        return {
+            'profundidade': len(self._pendentes),
+            'capacidade': self.capacidade,
+            'tamanho_lote': self.tamanho_lote,
+            'intervalo_s': self.intervalo,
+            'linhas_gravadas': self.linhas_gravadas,
+            'linhas_rejeitadas': self.linhas_rejeitadas,
+            'lotes_gravados': self.lotes_gravados,
+            'lotes_com_erro': self.lotes_com_erro,
+            'lotes_reenfileirados': self.lotes_reenfileirados,
+            'linhas_descartadas': self.linhas_descartadas,
+            'linhas_rejeitadas_banco': self.linhas_rejeitadas_banco,
+            'erros_regras': self.erros_regras,
+            'ultima_latencia_ms': round(self.ultima_latencia * 1000, 2),
+            'latencia_maxima_ms': round(self.latencia_maxima * 1000, 2),
+            'linhas_por_segundo': round(self.linhas_por_segundo(), 2)
+        }
+
+    def parar(self):
+        """Interrompe a thread de gravação após esvaziar a fila"""
+        with self._condicao:
+            self._parar = True
+            self._condicao.notify()
+        if self._thread:
+            self._thread.join(timeout=30)
+
+    def _iniciar(self):
+        if self._thread is not None:
+            return
+        with self._condicao:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._executar, name='fila-ingestao', daemon=True)
+                self._thread.start()
+                atexit.register(self.parar)
+
+    def _executar(self):
+        while True:
+            with self._condicao:
+                if len(self._pendentes) < self.tamanho_lote and not self._parar:
+                    self._condicao.wait(timeout=self.intervalo)
+                if not self._pendentes:
+                    if self._parar:
+                        return
+                    continue
+                lote = [self._pendentes.popleft() for _ in range(min(self.tamanho_lote, len(self._pendentes)))]
+            if not self._gravar(lote):
+                self._devolver(lote)
+
+    def _devolver(self, lote):
+        """Recoloca no início da fila um lote que não pôde ser gravado por falha transitória"""
+        with self._condicao:
+            if self._parar:
+                # Encerrando com o banco indisponível: não há para onde devolver
+                self.linhas_descartadas += len(lote)
+                logger.error('Descartadas %d medições da fila de ingestão ao encerrar', len(lote))
+                return
+            self._pendentes.extendleft(reversed(lote))
+            self.lotes_reenfileirados += 1
+        time.sleep(self.intervalo)
+
+    def _gravar(self, lote):
+        """Grava o lote e verifica as regras. Retorna False se o banco continuou indisponível."""
+        from services.telemetria_service import agrupar_por_inversor
+        from services.regras_service import verificar_alertas_inversor
+        from database import db
+
+        inicio = time.monotonic()
+        with self.app.app_context():
+            try:
+                gravadas = self._gravar_com_tentativas(lote)
+            except Exception:
+                db.session.rollback()
+                self.lotes_com_erro += 1
+                logger.exception('Banco indisponível ao gravar lote de %d medições; lote devolvido à fila',
+                                 len(lote))
+                return False
+            finally:
+                db.session.remove()
+
+            # O lote já foi gravado: uma falha nas regras não o desfaz
+            try:
+                for inversor_id, medicoes in agrupar_por_inversor(gravadas).items():
+                    verificar_alertas_inversor(inversor_id, medicoes)
+            except Exception:
+                db.session.rollback()
+                self.erros_regras += 1
+                logger.exception('Erro ao verificar as regras após gravar lote da fila de ingestão')
+            finally:
+                db.session.remove()
+
+        duracao = time.monotonic() - inicio
+        with self._condicao:
+            self._gravacoes_recentes.append((time.monotonic(), len(gravadas)))
+            self.linhas_gravadas += len(gravadas)
+            self.lotes_gravados += 1
+            self.ultima_latencia = duracao
+            self.latencia_maxima = max(self.latencia_maxima, duracao)
+        return True
+
+    def _gravar_com_tentativas(self, lote):
+        """Repete a gravação em falhas transitórias; lança a última se todas falharem"""
+        from database import db
+
+        espera = ESPERA_TENTATIVA
+        for tentativa in range(1, TENTATIVAS_GRAVACAO + 1):
+            try:
+                return self._gravar_linhas(lote)
+            except Exception as erro:
+                db.session.rollback()
+                if not erro_transitorio(erro) or tentativa == TENTATIVAS_GRAVACAO:
+                    raise
+                logger.warning('Falha transitória ao gravar lote (tentativa %d de %d): %s',
+                               tentativa, TENTATIVAS_GRAVACAO, erro)
+                time.sleep(espera)
+                espera *= 2
+
+    def _gravar_linhas(self, linhas):
+        """Grava as linhas dividindo ao meio em erros de dados. Retorna as linhas gravadas."""
+        from services.telemetria_service import inserir_medicoes
+        from database import db
+
+        try:
+            inserir_medicoes(linhas)
+            return linhas
+        except Exception as erro:
+            db.session.rollback()
+            if erro_transitorio(erro):
+                raise
+            if len(linhas) == 1:
+                self._rejeitar(linhas[0], erro)
+                return []
+        meio = len(linhas) // 2
+        return self._gravar_linhas(linhas[:meio]) + self._gravar_linhas(linhas[meio:])
+
+    def _rejeitar(self, linha, erro):
+        """Guarda em medicoes_rejeitadas uma linha recusada pelo banco"""
+        from models import MedicaoRejeitada
+        from database import db
+
+        logger.error('Medição recusada pelo banco e movida para medicoes_rejeitadas: %r (%s)', linha, erro)
+        try:
+            db.session.add(MedicaoRejeitada(
+                origem='fila_ingestao',
+                dados=json.dumps(linha, default=str),
+                erro=str(erro)[:2000]
+            ))
+            db.session.commit()
+        except Exception:
+            # A linha já foi registrada no log acima
+            db.session.rollback()
+            logger.exception('Erro ao gravar a medição recusada em medicoes_rejeitadas')
+        with self._condicao:
+            self.linhas_rejeitadas_banco += 1
+
+_fila = None
+_fila_lock = threading.Lock()
+
+def obter_fila():
+    """Retorna a fila de ingestão do processo, criando-a a partir da configuração do app"""
+    global _fila
+    if _fila is None:
+        with _fila_lock:
+            if _fila is None:
+                config = current_app.config
+                _fila = FilaIngestao(
+                    current_app._get_current_object(),
+                    capacidade=config['FILA_INGESTAO_CAPACIDADE'],
+                    tamanho_lote=config['FILA_INGESTAO_LOTE'],
+                    intervalo=config['FILA_INGESTAO_INTERVALO']
+                )
+    return _fila
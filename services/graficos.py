@@ -0,0 +1,201 @@
+"""Dados dos gráficos da página de gráficos e do dashboard (formato do Chart.js).
+
+Os gráficos diários (geração ao longo do tempo, temperatura vs geração e
+comparação de parques) saem das mesmas linhas de agregados_parque_dia, uma
+por parque e dia, então graficos_bundle monta os cinco gráficos com uma
+leitura do período e uma consulta para cada uma das demais tabelas.
+"""
+from models import Parque, PlacaSolar, AgregadoParqueHora, AgregadoParqueDia, db
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func
+
+# Maior período aceito pelo bundle de gráficos
+MAX_DIAS_GRAFICOS = 366
+
+CORES_STATUS_PLACAS = {
+    'ligada': '#4ade80',
+    'desligada': '#6b6b65',
+    'manutencao': '#fbbf24'
+}
+
+def _dias_parques(inicio, fim):
+    """Geração e temperatura de cada parque por dia entre inicio e fim (inclusivos)"""
+    return db.session.query(
+        AgregadoParqueDia.parque_id,
+        AgregadoParqueDia.data,
+        AgregadoParqueDia.geracao_kw_soma,
+        AgregadoParqueDia.temperatura_soma,
+        AgregadoParqueDia.temperatura_qtd
+    ).filter(
+        AgregadoParqueDia.data >= inicio,
+        AgregadoParqueDia.data <= fim
+    ).all()
+
+def _geracao_tempo(linhas, inicio, dias):
+    geracao_por_dia = {}
+    for linha in linhas:
+        geracao_por_dia[linha.data] = geracao_por_dia.get(linha.data, 0.0) + (linha.geracao_kw_soma or 0.0)
+
+    labels = []
+    dados = []
+    # Preencher todos os dias, mesmo sem dados
+    for i in range(dias):
+        dia = inicio + timedelta(days=i)
+        labels.append(dia.strftime('%d/%m'))
+        dados.append(round(geracao_por_dia.get(dia, 0.0), 2))
+
+    return {
+        'labels': labels,
+        'datasets': [{
+            'label': 'Geração (kW)',
+            'data': dados,
+            'borderColor': '#4a9eff',
+            'backgroundColor': 'rgba(74, 158, 255, 0.1)',
+            'tension': 0.4
+        }]
+    }
+
+def _temperatura_geracao(linhas, inicio):
+    # data -> [soma das temperaturas, leituras de temperatura, geração]
+    por_dia = {}
+    for linha in linhas:
+        if linha.data < inicio:
+            continue
+        dia = por_dia.setdefault(linha.data, [0.0, 0, 0.0])
+        dia[0] += linha.temperatura_soma or 0.0
+        dia[1] += linha.temperatura_qtd
+        dia[2] += linha.geracao_kw_soma or 0.0
+
+    labels = []
+    temperatura = []
+    geracao = []
+    # Dias sem leitura de temperatura ficam fora do gráfico
+    for dia in sorted(por_dia):
+        soma, qtd, total_geracao = por_dia[dia]
+        if not qtd:
+            continue
+        labels.append(dia.strftime('%d/%m'))
+        temperatura.append(round(soma / qtd, 1))
+        geracao.append(round(total_geracao, 2))
+
+    return {
+        'labels': labels,
+        'datasets': [
+            {
+                'label': 'Temperatura Média (°C)',
+                'data': temperatura,
+                'borderColor': '#f87171',
+                'backgroundColor': 'rgba(248, 113, 113, 0.1)',
+                'yAxisID': 'y',
+                'tension': 0.4
+            },
+            {
+                'label': 'Geração Total (kW)',
+                'data': geracao,
+                'borderColor': '#4ade80',
+                'backgroundColor': 'rgba(74, 222, 128, 0.1)',
+                'yAxisID': 'y1',
+                'tension': 0.4
+            }
+        ]
+    }
+
+def _parques_comparacao(linhas, hoje):
+    geracao_hoje = {linha.parque_id: linha.geracao_kw_soma or 0.0 for linha in linhas if linha.data == hoje}
+    parques = db.session.query(Parque.id, Parque.nome).filter(Parque.inversores.any()).order_by(Parque.id).all()
+    parques = sorted(parques, key=lambda parque: geracao_hoje.get(parque.id, 0.0), reverse=True)[:10]
+
+    return {
+        'labels': [parque.nome for parque in parques],
+        'datasets': [{
+            'label': 'Geração Hoje (kW)',
+            'data': [round(float(geracao_hoje.get(parque.id, 0.0)), 2) for parque in parques],
+            'backgroundColor': 'rgba(74, 158, 255, 0.6)',
+            'borderColor': '#4a9eff',
+            'borderWidth': 1
+        }]
+    }
+
+def grafico_eficiencia_hora(hoje=None):
+    """Eficiência média por hora do dia, a partir dos agregados por hora dos parques"""
+    hoje = hoje or date.today()
+    medicoes = db.session.query(
+        AgregadoParqueHora.inicio,
+        AgregadoParqueHora.media('eficiencia').label('eficiencia_media')
+    ).filter(
+        AgregadoParqueHora.inicio >= datetime.combine(hoje, time.min),
+        AgregadoParqueHora.inicio < datetime.combine(hoje + timedelta(days=1), time.min)
+    ).group_by(
+        AgregadoParqueHora.inicio
+    ).all()
+
+    # Criar array para todas as 24 horas
+    labels = [f'{h:02d}:00' for h in range(24)]
+    dados = [0.0] * 24
+    for med in medicoes:
+        if med.eficiencia_media is not None:
+            dados[med.inicio.hour] = round(float(med.eficiencia_media), 2)
+
+    return {
+        'labels': labels,
+        'datasets': [{
+            'label': 'Eficiência Média (%)',
+            'data': dados,
+            'backgroundColor': 'rgba(74, 158, 255, 0.6)',
+            'borderColor': '#4a9eff',
+            'borderWidth': 1
+        }]
+    }
+
+def grafico_status_placas():
+    """Distribuição das placas por status"""
+    status_counts = db.session.query(
+        PlacaSolar.status,
+        func.count(PlacaSolar.id).label('total')
+    ).group_by(PlacaSolar.status).all()
+
+    return {
+        'labels': [status.capitalize() for status, _ in status_counts],
+        'datasets': [{
+            'data': [int(total) for _, total in status_counts],
+            'backgroundColor': [CORES_STATUS_PLACAS.get(status, '#4a9eff') for status, _ in status_counts],
+            'borderColor': '#252525',
+            'borderWidth': 2
+        }]
+    }
+
+def grafico_geracao_tempo(dias=7):
+    """Geração total por dia nos últimos `dias` dias, incluindo os dias sem medições"""
+    fim = date.today()
+    inicio = fim - timedelta(days=dias - 1)
+    return _geracao_tempo(_dias_parques(inicio, fim), inicio, dias)
+
+def grafico_temperatura_geracao(dias=7):
+    """Temperatura média e geração total por dia nos últimos `dias` dias"""
+    fim = date.today()
+    inicio = fim - timedelta(days=dias - 1)
+    return _temperatura_geracao(_dias_parques(inicio, fim), inicio)
+
+def grafico_parques_comparacao():
+    """Geração de hoje dos dez parques (com inversores) que mais geraram"""
+    hoje = date.today()
+    return _parques_comparacao(_dias_parques(hoje, hoje), hoje)
+
+def graficos_bundle(dias=7, dias_temperatura=7):
+    """Os cinco gráficos da página de gráficos em um dicionário.
+
+    As linhas diárias dos parques são lidas uma vez para o maior dos dois
+    períodos e compartilhadas pelos três gráficos diários.
+    """
+    hoje = date.today()
+    inicio_geracao = hoje - timedelta(days=dias - 1)
+    inicio_temperatura = hoje - timedelta(days=dias_temperatura - 1)
+    linhas = _dias_parques(min(inicio_geracao, inicio_temperatura, hoje), hoje)
+
+    return {
+        'geracao_tempo': _geracao_tempo(linhas, inicio_geracao, dias),
+        'status_placas': grafico_status_placas(),
+        'eficiencia_hora': grafico_eficiencia_hora(hoje),
+        'temperatura_geracao': _temperatura_geracao(linhas, inicio_temperatura),
+        'parques_comparacao': _parques_comparacao(linhas, hoje)
+    }
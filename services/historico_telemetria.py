@@ -0,0 +1,98 @@
+"""Histórico de medições de um inversor paginado por chave (keyset).
+
+As páginas vêm do mais recente para o mais antigo, ordenadas por
+(medido_em, id). O cursor de cada página guarda o par da última linha
+entregue e a próxima página começa logo depois dele, usando o índice
+ix_medicao_inversor_medido_em (que no InnoDB e no SQLite já termina na
+chave primária). Por isso uma página antiga custa o mesmo que a primeira,
+sem OFFSET. As linhas são lidas como tuplas só com as colunas pedidas.
+"""
+from models import MedicaoTelemetria, db
+from datetime import datetime, timedelta
+from sqlalchemy import select, or_, and_
+import base64
+
+# Colunas que podem ser pedidas em campos; id vem sempre
+CAMPOS_HISTORICO = ('data_medicao', 'hora_medicao', 'medido_em', 'geracao_kw', 'temperatura', 'tensao',
+                    'corrente', 'frequencia', 'eficiencia')
+
+# Campos retornados quando campos não é informado (as colunas da resposta original)
+CAMPOS_PADRAO = ('data_medicao', 'hora_medicao', 'geracao_kw', 'temperatura', 'tensao', 'corrente',
+                 'frequencia', 'eficiencia')
+
+# Maior quantidade de medições por página
+MAX_LIMITE_HISTORICO = 1000
+
+def codificar_cursor(medido_em, medicao_id):
+    """Cursor opaco da posição (medido_em, id)"""
+    texto = f'{medido_em.isoformat()}|{medicao_id}'
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decodificar_cursor(cursor):
+    """Retorna (medido_em, id) do cursor. Lança ValueError se ele for inválido."""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        medido_em, medicao_id = texto.split('|')
+        return datetime.fromisoformat(medido_em), int(medicao_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('cursor inválido')
+
+def ler_campos(texto):
+    """Converte o parâmetro campos (nomes separados por vírgula) na tupla de colunas"""
+    if not texto:
+        return CAMPOS_PADRAO
+    campos = tuple(dict.fromkeys(campo.strip() for campo in texto.split(',') if campo.strip()))
+    invalidos = [campo for campo in campos if campo not in CAMPOS_HISTORICO]
+    if invalidos or not campos:
+        raise ValueError(f'campos deve conter apenas: {", ".join(CAMPOS_HISTORICO)}')
+    return campos
+
+def ler_instante(texto, fim=False):
+    """Data ou data e hora ISO; uma data sem hora em fim inclui o dia inteiro"""
+    if not texto:
+        return None
+    instante = datetime.fromisoformat(texto)
+    if fim and len(texto) == 10:
+        instante += timedelta(days=1)
+    return instante
+
+def _serializar(valor):
+    return valor.isoformat() if hasattr(valor, 'isoformat') else valor
+
+def pagina_medicoes(inversor_id, limite=10, cursor=None, inicio=None, fim=None, campos=CAMPOS_PADRAO):
+    """Uma página do histórico do inversor, do mais recente para o mais antigo.
+
+    inicio e fim (datetimes, fim exclusivo) limitam o período. Retorna
+    (medições, próximo cursor), com o cursor None na última página.
+    """
+    colunas = [getattr(MedicaoTelemetria, campo) for campo in campos]
+    consulta = select(
+        MedicaoTelemetria.id, MedicaoTelemetria.medido_em, *colunas
+    ).where(MedicaoTelemetria.inversor_id == inversor_id)
+    if inicio is not None:
+        consulta = consulta.where(MedicaoTelemetria.medido_em >= inicio)
+    if fim is not None:
+        consulta = consulta.where(MedicaoTelemetria.medido_em < fim)
+    if cursor is not None:
+        medido_em, medicao_id = cursor
+        # Comparação de tuplas expandida: o MySQL não usa o índice com (a, b) < (x, y)
+        consulta = consulta.where(or_(
+            MedicaoTelemetria.medido_em < medido_em,
+            and_(MedicaoTelemetria.medido_em == medido_em, MedicaoTelemetria.id < medicao_id)
+        ))
+    # Uma linha a mais indica se há próxima página
+    linhas = db.session.execute(consulta.order_by(
+        MedicaoTelemetria.medido_em.desc(), MedicaoTelemetria.id.desc()
+    ).limit(limite + 1)).all()
+
+    proximo = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        proximo = codificar_cursor(linhas[-1][1], linhas[-1][0])
+
+    medicoes = []
+    for medicao_id, _, *valores in linhas:
+        medicao = {'id': medicao_id}
+        medicao.update((campo, _serializar(valor)) for campo, valor in zip(campos, valores))
+        medicoes.append(medicao)
+    return medicoes, proximo
@@ -0,0 +1,223 @@
+"""Importação de CSV de telemetria em segundo plano, em blocos de tamanho fixo"""
+from flask import current_app
+from models import ImportacaoCSV, db
+from services.telemetria_service import preparar_medicao, inserir_medicoes, METRICAS_OPCIONAIS
+from services.cache_inversores import obter_inversor
+from services.fila_ingestao import erro_transitorio
+from datetime import datetime, timedelta
+from sqlalchemy import func
+import csv
+import io
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Linhas gravadas por bloco (um INSERT em lote e um commit por bloco)
+TAMANHO_BLOCO = 2000
+
+# Quantidade máxima de erros por linha guardados no registro da importação
+MAX_ERROS_REGISTRADOS = 100
+
+# Importações sem progresso gravado há mais que isso são de um processo que parou
+EXPIRACAO_IMPORTACAO = timedelta(minutes=15)
+
+# Caractere que substitui bytes que não são UTF-8 válido na leitura do arquivo
+CARACTERE_INVALIDO = '\ufffd'
+
+def converter_linha_csv(linha, inversor):
+    """Converte uma linha do CSV em valores de medição com preparar_medicao. Lança ValueError se inválida."""
+    if any(CARACTERE_INVALIDO in valor for valor in linha.values() if isinstance(valor, str)):
+        raise ValueError('Linha com bytes inválidos. Salve o arquivo em UTF-8')
+    if not linha.get('data') or not linha.get('hora'):
+        raise ValueError('Campos data e hora são obrigatórios')
+
+    # Mesma validação da API (números finitos, data e hora); no CSV uma
+    # métrica opcional vazia é ausente e a coluna geracao_kw ausente vale 0
+    registro = {campo: linha.get(campo) or None for campo in METRICAS_OPCIONAIS}
+    registro['geracao_kw'] = linha.get('geracao_kw', 0)
+    registro['data_medicao'] = linha['data']
+    registro['hora_medicao'] = linha['hora']
+    return preparar_medicao(registro, inversor)
+
+def iniciar_importacao(filepath, inversor_id, nome_arquivo):
+    """Registra a importação e inicia o processamento em uma thread em segundo plano"""
+    importacao = ImportacaoCSV(
+        inversor_id=inversor_id,
+        nome_arquivo=nome_arquivo,
+        tamanho_bytes=os.path.getsize(filepath)
+    )
+    db.session.add(importacao)
+    db.session.commit()
+
+    thread = threading.Thread(
+        target=_executar_importacao,
+        args=(current_app._get_current_object(), importacao.id, filepath),
+        name=f'importacao-csv-{importacao.id}',
+        daemon=True
+    )
+    thread.start()
+    return importacao
+
+def _executar_importacao(app, importacao_id, filepath):
+    with app.app_context():
+        try:
+            processar_arquivo(importacao_id, filepath)
+        except Exception as e:
+            db.session.rollback()
+            logger.exception('Erro na importação CSV %s', importacao_id)
+            importacao = ImportacaoCSV.query.get(importacao_id)
+            importacao.status = 'falhou'
+            importacao.mensagem = f'Erro ao processar CSV: {str(e)}'
+            importacao.concluido_em = datetime.utcnow()
+            db.session.commit()
+        finally:
+            db.session.remove()
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+def processar_arquivo(importacao_id, filepath):
+    """Lê o CSV em streaming e grava as medições em blocos, registrando o progresso.
+
+    Linhas inválidas e blocos que o banco recusa são contados e registrados
+    sem interromper a importação; só uma falha transitória do banco
+    (conexão perdida) a interrompe.
+    """
+    importacao = ImportacaoCSV.query.get(importacao_id)
+    inversor = obter_inversor(importacao.inversor_id)
+    importacao.status = 'processando'
+    db.session.commit()
+
+    erros = []
+    bloco = []
+    linhas_bloco = []
+    linhas_lidas = 0
+    # Contadores mantidos fora da sessão: o rollback de um bloco recusado não os desfaz
+    contagem = {'processadas': 0, 'erro': 0}
+    # Medição gravada mais recente, avaliada pelas regras ao final
+    ultima = None
+
+    def registrar_erro(numero_linha, mensagem, quantidade=1):
+        contagem['erro'] += quantidade
+        if len(erros) < MAX_ERROS_REGISTRADOS:
+            erros.append({'linha': numero_linha, 'erro': mensagem})
+
+    with open(filepath, 'rb') as bruto:
+        # Bytes inválidos viram CARACTERE_INVALIDO e a linha é rejeitada na
+        # conversão, sem interromper a leitura do restante do arquivo
+        reader = csv.DictReader(io.TextIOWrapper(bruto, encoding='utf-8', errors='replace', newline=''))
+
+        def gravar_bloco():
+            nonlocal ultima
+            if bloco:
+                try:
+                    inserir_medicoes(bloco)
+                    contagem['processadas'] += len(bloco)
+                    mais_recente = max(bloco, key=lambda medicao: medicao['medido_em'])
+                    if ultima is None or mais_recente['medido_em'] > ultima['medido_em']:
+                        ultima = mais_recente
+                except Exception as e:
+                    db.session.rollback()
+                    if erro_transitorio(e):
+                        raise
+                    logger.warning('Importação CSV %s: bloco das linhas %d a %d recusado pelo banco: %s',
+                                   importacao_id, linhas_bloco[0], linhas_bloco[-1], e)
+                    registrar_erro(linhas_bloco[0], f'Bloco das linhas {linhas_bloco[0]} a {linhas_bloco[-1]} '
+                                   f'não gravado: {type(e).__name__}', quantidade=len(bloco))
+                bloco.clear()
+                linhas_bloco.clear()
+            importacao.linhas_processadas = contagem['processadas']
+            importacao.linhas_erro = contagem['erro']
+            importacao.bytes_processados = bruto.tell()
+            importacao.erros = json.dumps(erros)
+            db.session.commit()
+
+        while True:
+            try:
+                linha = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as e:
+                # O leitor descarta a linha malformada e continua na seguinte; o
+                # line_num do DictReader só avança em linhas lidas com sucesso
+                registrar_erro(reader.reader.line_num, f'Linha CSV malformada: {e}')
+                linha = None
+
+            if linha is not None:
+                try:
+                    bloco.append(converter_linha_csv(linha, inversor))
+                    linhas_bloco.append(reader.line_num)
+                except ValueError as e:
+                    # reader.line_num conta a linha de cabeçalho
+                    registrar_erro(reader.line_num, str(e))
+
+            # Grava o progresso também quando só há linhas com erro, para a
+            # importação não parecer interrompida
+            linhas_lidas += 1
+            if len(bloco) >= TAMANHO_BLOCO or linhas_lidas % TAMANHO_BLOCO == 0:
+                gravar_bloco()
+
+        gravar_bloco()
+
+    importacao.status = 'concluida'
+    importacao.concluido_em = datetime.utcnow()
+    importacao.mensagem = (
+        f'{importacao.linhas_processadas} linhas importadas. '
+        f'{importacao.linhas_erro} linhas com erro.'
+    )
+    db.session.commit()
+
+    # Verificar regras de alerta com a medição importada mais recente. As
+    # leituras importadas não passaram pelas janelas das regras, que são
+    # preenchidas de novo com o histórico
+    from services.regras_service import verificar_alertas_inversor
+    from services.janelas import descartar_janelas_inversor
+    descartar_janelas_inversor(importacao.inversor_id)
+    if ultima is not None:
+        verificar_alertas_inversor(importacao.inversor_id, [ultima])
+
+def marcar_importacoes_interrompidas():
+    """Marca como falhas as importações pendentes ou em andamento sem progresso recente.
+
+    A importação roda em uma thread do processo web; se o processo é
+    reiniciado no meio dela, o registro ficaria em 'processando' para
+    sempre. Chamada na inicialização do app: importações de outros
+    processos ainda ativos gravam progresso a cada bloco e não expiram.
+    Retorna a quantidade de importações marcadas.
+    """
+    limite = datetime.utcnow() - EXPIRACAO_IMPORTACAO
+    try:
+        marcadas = ImportacaoCSV.query.filter(
+            ImportacaoCSV.status.in_(['pendente', 'processando']),
+            func.coalesce(ImportacaoCSV.atualizado_em, ImportacaoCSV.criado_em) < limite
+        ).update({
+            'status': 'falhou',
+            'mensagem': 'Importação interrompida pela reinicialização do servidor. Envie o arquivo novamente.',
+            'concluido_em': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception('Erro ao marcar importações CSV interrompidas')
+        return 0
+    if marcadas:
+        logger.warning('%d importação(ões) CSV interrompida(s) marcada(s) como falha', marcadas)
+    return marcadas
+
+def status_importacao(importacao):
+    """Representação JSON do andamento de uma importação"""
+    return {
+        'id': importacao.id,
+        'inversor_id': importacao.inversor_id,
+        'arquivo': importacao.nome_arquivo,
+        'status': importacao.status,
+        'progresso': round(importacao.progresso(), 1),
+        'linhas_processadas': importacao.linhas_processadas,
+        'linhas_erro': importacao.linhas_erro,
+        'erros': json.loads(importacao.erros) if importacao.erros else [],
+        'mensagem': importacao.mensagem,
+        'criado_em': importacao.criado_em.isoformat() if importacao.criado_em else None,
+        'concluido_em': importacao.concluido_em.isoformat() if importacao.concluido_em else None
+    }
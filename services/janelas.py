@@ -0,0 +1,164 @@
+"""Janelas deslizantes por inversor para regras avaliadas sobre várias leituras.
+
+Cada par (inversor, regra com janela) tem um buffer circular de tamanho fixo
+em arrays NumPy, atualizado em O(1) com as leituras gravadas na ingestão,
+sem consultar o histórico a cada leitura. O estado é local ao processo: o
+buffer é preenchido com o histórico do banco uma vez, na primeira leitura do
+inversor após o início do processo (ou após a regra mudar). Leituras do
+mesmo inversor gravadas por outro processo depois disso não entram na
+janela deste; com vários workers web, a ingestão assíncrona
+(INGESTAO_ASSINCRONA) concentra a avaliação no processo da fila.
+"""
+from models import MedicaoTelemetria, db
+from datetime import datetime, timedelta
+import threading
+import numpy as np
+
+# Leituras mantidas por janela do tipo média (limita a memória por inversor e regra)
+CAPACIDADE_JANELA = 512
+
+# Leituras mínimas na janela para uma regra de média disparar (evita que uma
+# leitura isolada após uma falha de comunicação valha como média)
+MIN_LEITURAS_JANELA = 3
+
+# Referência para converter medido_em em segundos
+_EPOCA = datetime(1970, 1, 1)
+
+class JanelaDeslizante:
+    """Buffer circular de leituras com soma e contagem acumuladas.
+
+    Adicionar e descartar leituras é O(1); a soma é recalculada a cada volta
+    completa do buffer para não acumular erro de arredondamento.
+    """
+    __slots__ = ('capacidade', 'instantes', 'valores', 'satisfeitas',
+                 'inicio', 'tamanho', 'soma', 'qtd_satisfeitas', 'ultimo_instante')
+
+    def __init__(self, capacidade):
+        self.capacidade = capacidade
+        self.instantes = np.zeros(capacidade)
+        self.valores = np.zeros(capacidade)
+        self.satisfeitas = np.zeros(capacidade, dtype=bool)
+        self.inicio = 0
+        self.tamanho = 0
+        self.soma = 0.0
+        self.qtd_satisfeitas = 0
+        self.ultimo_instante = None
+
+    def adicionar(self, instante, valor, satisfeita):
+        """Inclui uma leitura. Leituras fora de ordem ou repetidas são ignoradas."""
+        if self.ultimo_instante is not None and instante <= self.ultimo_instante:
+            return False
+        if self.tamanho == self.capacidade:
+            self._remover_mais_antiga()
+        fim = (self.inicio + self.tamanho) % self.capacidade
+        self.instantes[fim] = instante
+        self.valores[fim] = valor
+        self.satisfeitas[fim] = satisfeita
+        self.tamanho += 1
+        self.soma += valor
+        self.qtd_satisfeitas += bool(satisfeita)
+        self.ultimo_instante = instante
+        if fim == self.capacidade - 1:
+            self._recalcular_soma()
+        return True
+
+    def descartar_anteriores(self, limite):
+        """Remove as leituras com instante anterior ao limite"""
+        while self.tamanho and self.instantes[self.inicio] < limite:
+            self._remover_mais_antiga()
+
+    def media(self):
+        return self.soma / self.tamanho if self.tamanho else None
+
+    def cheia(self):
+        return self.tamanho == self.capacidade
+
+    def _remover_mais_antiga(self):
+        self.soma -= self.valores[self.inicio]
+        self.qtd_satisfeitas -= bool(self.satisfeitas[self.inicio])
+        self.inicio = (self.inicio + 1) % self.capacidade
+        self.tamanho -= 1
+
+    def _recalcular_soma(self):
+        indices = (self.inicio + np.arange(self.tamanho)) % self.capacidade
+        self.soma = float(self.valores[indices].sum())
+
+def _segundos(medido_em):
+    return (medido_em - _EPOCA).total_seconds()
+
+def _historico(inversor_id, regra, antes_de):
+    """Leituras anteriores a antes_de usadas para preencher uma janela nova, em ordem cronológica"""
+    coluna = getattr(MedicaoTelemetria, regra.coluna)
+    consulta = db.session.query(MedicaoTelemetria.medido_em, coluna).filter(
+        MedicaoTelemetria.inversor_id == inversor_id,
+        MedicaoTelemetria.medido_em < antes_de,
+        coluna.isnot(None)
+    )
+    if regra.janela_tipo == 'media':
+        consulta = consulta.filter(MedicaoTelemetria.medido_em >= antes_de - timedelta(minutes=regra.janela))
+        limite = CAPACIDADE_JANELA
+    else:
+        limite = regra.janela
+    linhas = consulta.order_by(MedicaoTelemetria.medido_em.desc()).limit(limite).all()
+    return reversed(linhas)
+
+def _nova_janela(inversor_id, regra, antes_de):
+    capacidade = CAPACIDADE_JANELA if regra.janela_tipo == 'media' else regra.janela
+    janela = JanelaDeslizante(capacidade)
+    for medido_em, valor in _historico(inversor_id, regra, antes_de):
+        janela.adicionar(_segundos(medido_em), valor, regra.disparou(valor))
+    return janela
+
+# (inversor_id, regra_id) -> (assinatura da regra, JanelaDeslizante)
+_janelas = {}
+_lock = threading.Lock()
+
+def _assinatura(regra):
+    return (regra.janela_tipo, regra.janela, regra.coluna, regra.operador, regra.valor_threshold)
+
+def avaliar_janela(inversor_id, regra, medicoes):
+    """Atualiza a janela da regra com as medições (em ordem cronológica) e avalia a condição.
+
+    Retorna o valor que disparou a regra (média da janela ou última leitura da
+    sequência) ou None se a condição não foi satisfeita após a última medição.
+    """
+    medicoes = [m for m in medicoes if m.get(regra.coluna) is not None]
+    if not medicoes:
+        return None
+
+    chave = (inversor_id, regra.id)
+    assinatura = _assinatura(regra)
+    item = _janelas.get(chave)
+    if item is None or item[0] != assinatura:
+        janela = _nova_janela(inversor_id, regra, medicoes[0]['medido_em'])
+        with _lock:
+            item = _janelas.get(chave)
+            if item is None or item[0] != assinatura:
+                item = (assinatura, janela)
+                _janelas[chave] = item
+    janela = item[1]
+
+    with _lock:
+        for medicao in medicoes:
+            valor = medicao[regra.coluna]
+            janela.adicionar(_segundos(medicao['medido_em']), valor, regra.disparou(valor))
+
+        if regra.janela_tipo == 'media':
+            janela.descartar_anteriores(janela.ultimo_instante - regra.janela * 60)
+            if janela.tamanho < MIN_LEITURAS_JANELA:
+                return None
+            media = janela.media()
+            return media if regra.disparou(media) else None
+
+        if janela.cheia() and janela.qtd_satisfeitas == janela.tamanho:
+            return medicoes[-1][regra.coluna]
+        return None
+
+def descartar_janelas_inversor(inversor_id):
+    """Descarta as janelas do inversor; a próxima leitura as preenche de novo com o histórico do banco.
+
+    Usado quando medições são gravadas sem passar pelas janelas (importação de CSV).
+    """
+    with _lock:
+        for chave in [chave for chave in _janelas if chave[0] == inversor_id]:
+            del _janelas[chave]
@@ -0,0 +1,141 @@
+"""Instantâneo das métricas da frota exibidas na página inicial e no dashboard.
+
+As métricas são calculadas com duas consultas (totais em subconsultas
+escalares e performance por parque) e mantidas em memória por
+METRICAS_FROTA_TTL segundos. Depois de expirado, o instantâneo anterior
+continua sendo servido enquanto uma thread em segundo plano calcula o novo,
+então as páginas só esperam pelo banco no primeiro acesso do processo.
+"""
+from flask import current_app
+from models import (Parque, Inversor, PlacaSolar, Alerta, AgregadoInversorDia,
+                    AgregadoParqueHora, AgregadoParqueDia, db)
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, case
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def _escalar(*colunas, filtros=()):
+    """Subconsulta escalar de um agregado"""
+    return db.session.query(*colunas).filter(*filtros).scalar_subquery()
+
+def calcular_metricas_frota():
+    """Calcula as métricas da frota a partir das tabelas cadastrais e dos agregados de telemetria"""
+    hoje = date.today()
+    semana_atras = hoje - timedelta(days=7)
+    mes_atras = hoje - timedelta(days=30)
+    ultimas_24h = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=24)
+
+    totais = db.session.query(
+        _escalar(func.count(Parque.id)).label('total_parques'),
+        _escalar(func.count(Inversor.id)).label('total_inversores'),
+        _escalar(func.coalesce(func.sum(Inversor.capacidade_kw), 0)).label('capacidade_total_inversores'),
+        _escalar(func.coalesce(func.sum(case((Inversor.status == 'operacional', 1), else_=0)), 0)
+                 ).label('inversores_operacionais'),
+        _escalar(func.count(PlacaSolar.id)).label('total_placas'),
+        _escalar(func.coalesce(func.sum(case((PlacaSolar.status == 'ligada', 1), else_=0)), 0)
+                 ).label('placas_ligadas'),
+        _escalar(func.coalesce(func.sum(case((PlacaSolar.status == 'ligada', PlacaSolar.potencia_wp), else_=0)), 0)
+                 ).label('potencia_placas_ligadas_wp'),
+        _escalar(func.count(Alerta.id), filtros=[Alerta.resolvido == False]).label('alertas_ativos'),
+        _escalar(AgregadoParqueDia.soma('geracao_kw'), filtros=[AgregadoParqueDia.data == hoje]).label('geracao_hoje'),
+        _escalar(AgregadoParqueDia.soma('geracao_kw'), filtros=[AgregadoParqueDia.data >= semana_atras]
+                 ).label('geracao_semana'),
+        _escalar(AgregadoParqueDia.soma('geracao_kw'), filtros=[AgregadoParqueDia.data >= mes_atras]
+                 ).label('geracao_mes'),
+        _escalar(AgregadoParqueDia.media('eficiencia'), filtros=[AgregadoParqueDia.data == hoje]
+                 ).label('eficiencia_hoje'),
+        _escalar(AgregadoParqueHora.media('eficiencia'), filtros=[AgregadoParqueHora.inicio >= ultimas_24h]
+                 ).label('eficiencia_24h')
+    ).one()
+
+    # Performance por parque
+    parques_performance = db.session.query(
+        Parque.id,
+        Parque.nome,
+        func.coalesce(func.sum(Inversor.capacidade_kw), 0).label('capacidade'),
+        func.coalesce(func.sum(AgregadoInversorDia.geracao_kw_soma), 0).label('geracao_hoje')
+    ).select_from(Parque).join(
+        Inversor, Parque.id == Inversor.parque_id
+    ).outerjoin(
+        AgregadoInversorDia,
+        (Inversor.id == AgregadoInversorDia.inversor_id) &
+        (AgregadoInversorDia.data == hoje)
+    ).group_by(Parque.id, Parque.nome).all()
+
+    capacidade_total_placas_kw = float(totais.potencia_placas_ligadas_wp) / 1000.0
+    capacidade_total_inversores = float(totais.capacidade_total_inversores)
+
+    return {
+        'total_parques': totais.total_parques,
+        'total_inversores': totais.total_inversores,
+        'total_placas': totais.total_placas,
+        'placas_ligadas': int(totais.placas_ligadas),
+        # Usar a maior capacidade (placas ligadas ou inversores)
+        'capacidade_total': max(capacidade_total_placas_kw, capacidade_total_inversores),
+        'capacidade_total_placas_kw': capacidade_total_placas_kw,
+        'capacidade_total_inversores': capacidade_total_inversores,
+        'geracao_hoje': totais.geracao_hoje or 0.0,
+        'geracao_semana': totais.geracao_semana or 0.0,
+        'geracao_mes': totais.geracao_mes or 0.0,
+        # Sem medições hoje, usa a eficiência das últimas 24h
+        'eficiencia_media': totais.eficiencia_hoje or totais.eficiencia_24h or 0.0,
+        'alertas_ativos': totais.alertas_ativos,
+        'inversores_operacionais': int(totais.inversores_operacionais),
+        'parques_performance': [dict(parque._mapping) for parque in parques_performance],
+        'calculado_em': datetime.utcnow()
+    }
+
+class InstantaneoMetricas:
+    """Métricas da frota em memória com expiração e atualização em segundo plano"""
+
+    def __init__(self):
+        self._metricas = None
+        self._calculado_em = 0.0
+        self._atualizando = False
+        self._lock = threading.Lock()
+
+    def obter(self, ttl):
+        """Retorna o instantâneo atual, calculando na hora só se ainda não houver nenhum"""
+        agora = time.monotonic()
+        metricas = self._metricas
+        if metricas is None:
+            return self.atualizar()
+        if agora - self._calculado_em >= ttl:
+            self._atualizar_em_segundo_plano(current_app._get_current_object())
+        return metricas
+
+    def atualizar(self):
+        """Recalcula o instantâneo no contexto de app atual e o retorna"""
+        metricas = calcular_metricas_frota()
+        with self._lock:
+            self._metricas = metricas
+            self._calculado_em = time.monotonic()
+        return metricas
+
+    def _atualizar_em_segundo_plano(self, app):
+        with self._lock:
+            if self._atualizando:
+                return
+            self._atualizando = True
+        threading.Thread(target=self._executar, args=(app,), name='metricas-frota', daemon=True).start()
+
+    def _executar(self, app):
+        with app.app_context():
+            try:
+                self.atualizar()
+            except Exception:
+                logger.exception('Erro ao atualizar as métricas da frota')
+            finally:
+                db.session.remove()
+                with self._lock:
+                    self._atualizando = False
+
+_instantaneo = InstantaneoMetricas()
+
+def obter_metricas_frota():
+    """Retorna as métricas da frota do processo (no máximo METRICAS_FROTA_TTL segundos desatualizadas
+    antes de uma nova atualização ser disparada)"""
+    return _instantaneo.obter(current_app.config['METRICAS_FROTA_TTL'])
@@ -0,0 +1,221 @@
+"""Distribuição e entrega das notificações de alertas, executadas pelo worker_notificacoes.py.
+
+A ingestão e a varredura de regras só gravam o alerta (com notificado falso).
+distribuir_alertas cria um EnvioNotificacao por alerta novo e destino, e
+entregar_pendentes reserva os envios vencidos de um destino em lotes
+(SELECT ... FOR UPDATE SKIP LOCKED e um prazo em proxima_tentativa_em,
+gravados antes do envio), então dois workers nunca enviam o mesmo lote, e
+reagenda as falhas com backoff exponencial.
+"""
+from models import Alerta, EnvioNotificacao, Inversor, Parque, Regra, db
+from database import insert_ignorando_duplicatas
+from datetime import datetime, timedelta
+from sqlalchemy import func
+import logging
+import random
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Alertas novos distribuídos por transação (e envios por comando INSERT)
+TAMANHO_BLOCO_DISTRIBUICAO = 1000
+
+# Atraso antes da segunda tentativa, dobrado a cada falha até ATRASO_MAXIMO (segundos)
+ATRASO_INICIAL = 30
+ATRASO_MAXIMO = 3600
+
+# Segundos em que um lote reservado fica com o worker que o reservou; se ele
+# parar no meio do envio, o lote volta a vencer e é reenviado (entrega ao menos uma vez)
+PRAZO_RESERVA = 300
+
+def atraso_tentativa(tentativas):
+    """Segundos até a próxima tentativa após `tentativas` falhas, com variação de 20%
+    para que envios que falharam juntos não sejam repetidos todos no mesmo instante"""
+    atraso = min(ATRASO_MAXIMO, ATRASO_INICIAL * 2 ** (tentativas - 1))
+    return atraso * random.uniform(0.8, 1.2)
+
+def distribuir_alertas(destinos):
+    """Cria os envios pendentes dos alertas ainda não distribuídos, um por destino.
+
+    Processa até TAMANHO_BLOCO_DISTRIBUICAO alertas em uma transação; a chave
+    única (destino, alerta_id) torna a operação segura se for repetida.
+    Retorna a quantidade de alertas distribuídos.
+    """
+    if not destinos:
+        return 0
+
+    ids = [alerta_id for (alerta_id,) in db.session.query(Alerta.id).filter(
+        Alerta.notificado == False
+    ).order_by(Alerta.id).limit(TAMANHO_BLOCO_DISTRIBUICAO).all()]
+    if not ids:
+        return 0
+
+    agora = datetime.utcnow()
+    envios = [{
+        'destino': destino,
+        'alerta_id': alerta_id,
+        'status': 'pendente',
+        'tentativas': 0,
+        'proxima_tentativa_em': agora,
+        'criado_em': agora
+    } for alerta_id in ids for destino in destinos]
+    for inicio in range(0, len(envios), TAMANHO_BLOCO_DISTRIBUICAO):
+        bloco = envios[inicio:inicio + TAMANHO_BLOCO_DISTRIBUICAO]
+        db.session.execute(insert_ignorando_duplicatas(EnvioNotificacao.__table__, bloco))
+    Alerta.query.filter(Alerta.id.in_(ids)).update({'notificado': True}, synchronize_session=False)
+    db.session.commit()
+    return len(ids)
+
+def _reservar_lote(destino, tamanho, agora):
+    """Reserva os envios vencidos de um destino e faz o commit. Retorna as linhas com os dados do alerta.
+
+    As linhas são travadas com FOR UPDATE SKIP LOCKED (ignorado no SQLite),
+    e a próxima tentativa é adiada por PRAZO_RESERVA antes do commit: outros
+    workers pulam as linhas travadas enquanto a reserva é gravada e, depois
+    dela, não as veem mais como vencidas.
+    """
+    lote = db.session.query(
+        EnvioNotificacao.id,
+        EnvioNotificacao.tentativas,
+        Alerta.id,
+        Alerta.inversor_id,
+        Inversor.codigo_serie,
+        Parque.nome,
+        Alerta.regra_id,
+        Regra.nome,
+        Alerta.severidade,
+        Alerta.mensagem,
+        Alerta.criado_em
+    ).join(
+        Alerta, Alerta.id == EnvioNotificacao.alerta_id
+    ).join(
+        Inversor, Inversor.id == Alerta.inversor_id
+    ).join(
+        Parque, Parque.id == Inversor.parque_id
+    ).join(
+        Regra, Regra.id == Alerta.regra_id
+    ).filter(
+        EnvioNotificacao.destino == destino,
+        EnvioNotificacao.status == 'pendente',
+        EnvioNotificacao.proxima_tentativa_em <= agora
+    ).order_by(EnvioNotificacao.id).limit(tamanho).with_for_update(
+        skip_locked=True, of=EnvioNotificacao
+    ).all()
+    if lote:
+        EnvioNotificacao.query.filter(EnvioNotificacao.id.in_([linha[0] for linha in lote])).update({
+            'proxima_tentativa_em': agora + timedelta(seconds=PRAZO_RESERVA)
+        }, synchronize_session=False)
+    db.session.commit()
+    return lote
+
+def _reagendar_falhas(lote, mensagem, max_tentativas):
+    """Registra a falha de um lote com um UPDATE por quantidade de tentativas e faz o commit"""
+    agora = datetime.utcnow()
+    por_tentativas = {}
+    for linha in lote:
+        por_tentativas.setdefault(linha[1] + 1, []).append(linha[0])
+    for tentativas, ids in por_tentativas.items():
+        valores = {'tentativas': tentativas, 'erro': mensagem}
+        if tentativas >= max_tentativas:
+            valores['status'] = 'falhou'
+        else:
+            valores['proxima_tentativa_em'] = agora + timedelta(seconds=atraso_tentativa(tentativas))
+        EnvioNotificacao.query.filter(EnvioNotificacao.id.in_(ids)).update(valores, synchronize_session=False)
+    db.session.commit()
+
+def _conteudo(linha):
+    return {
+        'id': linha[2],
+        'inversor_id': linha[3],
+        'inversor': linha[4],
+        'parque': linha[5],
+        'regra_id': linha[6],
+        'regra': linha[7],
+        'severidade': linha[8],
+        'mensagem': linha[9],
+        'criado_em': linha[10].isoformat()
+    }
+
+def entregar_pendentes(notificador, max_tentativas):
+    """Envia os envios vencidos do destino em lotes de notificador.tamanho_lote.
+
+    Cada lote é reservado antes do envio (ver _reservar_lote). Se um lote
+    falhar, seus envios são reagendados com atraso_tentativa (ou marcados
+    como falhou após max_tentativas) e o destino não recebe mais lotes neste
+    ciclo. Retorna (alertas enviados, alertas com falha).
+    """
+    enviados = 0
+    falhas = 0
+    while True:
+        agora = datetime.utcnow()
+        lote = _reservar_lote(notificador.nome, notificador.tamanho_lote, agora)
+        if not lote:
+            break
+
+        try:
+            notificador.enviar([_conteudo(linha) for linha in lote])
+        except Exception as erro:
+            db.session.rollback()
+            mensagem = f'{type(erro).__name__}: {erro}'[:500]
+            _reagendar_falhas(lote, mensagem, max_tentativas)
+            falhas += len(lote)
+            logger.warning('Falha ao enviar %d alerta(s) para %s: %s', len(lote), notificador.nome, mensagem)
+            break
+
+        EnvioNotificacao.query.filter(EnvioNotificacao.id.in_([linha[0] for linha in lote])).update({
+            'status': 'enviado',
+            'tentativas': EnvioNotificacao.tentativas + 1,
+            'enviado_em': datetime.utcnow(),
+            'erro': None
+        }, synchronize_session=False)
+        db.session.commit()
+        enviados += len(lote)
+
+        if len(lote) < notificador.tamanho_lote:
+            break
+
+    return enviados, falhas
+
+def estatisticas_notificacoes(destinos):
+    """Retorna backlog e latência de entrega por destino.
+
+    Latência é o tempo entre a criação do alerta e a entrega, medido sobre os
+    envios da última hora.
+    """
+    agora = datetime.utcnow()
+    desde = agora - timedelta(hours=1)
+    resultado = {
+        'alertas_nao_distribuidos': db.session.query(func.count(Alerta.id)).filter(
+            Alerta.notificado == False
+        ).scalar(),
+        'destinos': {}
+    }
+
+    for destino in destinos:
+        contagens = dict(db.session.query(EnvioNotificacao.status, func.count(EnvioNotificacao.id)).filter(
+            EnvioNotificacao.destino == destino,
+            EnvioNotificacao.status.in_(['pendente', 'falhou'])
+        ).group_by(EnvioNotificacao.status).all())
+        mais_antigo = db.session.query(func.min(EnvioNotificacao.criado_em)).filter(
+            EnvioNotificacao.destino == destino,
+            EnvioNotificacao.status == 'pendente'
+        ).scalar()
+        entregas = db.session.query(EnvioNotificacao.enviado_em, Alerta.criado_em).join(
+            Alerta, Alerta.id == EnvioNotificacao.alerta_id
+        ).filter(
+            EnvioNotificacao.destino == destino,
+            EnvioNotificacao.enviado_em >= desde
+        ).all()
+        latencias = np.array([(enviado_em - criado_em).total_seconds() for enviado_em, criado_em in entregas])
+
+        resultado['destinos'][destino] = {
+            'pendentes': contagens.get('pendente', 0),
+            'falhas_definitivas': contagens.get('falhou', 0),
+            'pendente_mais_antigo_s': round((agora - mais_antigo).total_seconds(), 1) if mais_antigo else None,
+            'enviados_ultima_hora': len(latencias),
+            'latencia_media_s': round(float(latencias.mean()), 2) if len(latencias) else None,
+            'latencia_p95_s': round(float(np.percentile(latencias, 95)), 2) if len(latencias) else None,
+            'latencia_maxima_s': round(float(latencias.max()), 2) if len(latencias) else None
+        }
+
+    return resultado
@@ -0,0 +1,146 @@
+"""Destinos de notificação de alertas: webhook, e-mail (SMTP) e arquivo local.
+
+Cada notificador recebe um lote de alertas (dicionários montados pelo
+serviço de notificações) e lança exceção se a entrega falhar; o lote
+inteiro é então reenviado mais tarde. Os destinos são configurados pelas
+variáveis NOTIFICACAO_* do app.
+"""
+from email.message import EmailMessage
+from flask import current_app
+import json
+import os
+import smtplib
+import threading
+import urllib.request
+
+class Notificador:
+    """Destino de notificação. Subclasses implementam enviar(alertas)."""
+
+    nome = None
+
+    def __init__(self, tamanho_lote=100):
+        self.tamanho_lote = tamanho_lote
+
+    def enviar(self, alertas):
+        raise NotImplementedError
+
+class NotificadorWebhook(Notificador):
+    """Envia o lote como JSON ({"alertas": [...]}) em um POST para a URL configurada"""
+
+    nome = 'webhook'
+
+    def __init__(self, url, token=None, timeout=10, tamanho_lote=100):
+        super().__init__(tamanho_lote)
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def enviar(self, alertas):
+        corpo = json.dumps({'alertas': alertas}).encode('utf-8')
+        requisicao = urllib.request.Request(self.url, data=corpo, method='POST')
+        requisicao.add_header('Content-Type', 'application/json')
+        if self.token:
+            requisicao.add_header('Authorization', f'Bearer {self.token}')
+        # Respostas 4xx e 5xx lançam HTTPError
+        with urllib.request.urlopen(requisicao, timeout=self.timeout) as resposta:
+            resposta.read()
+
+class NotificadorEmail(Notificador):
+    """Envia um e-mail por lote, com um alerta por linha, a um servidor SMTP"""
+
+    nome = 'email'
+
+    def __init__(self, host, porta, remetente, destinatarios, usuario=None, senha=None,
+                 tls=True, timeout=10, tamanho_lote=100):
+        super().__init__(tamanho_lote)
+        self.host = host
+        self.porta = porta
+        self.remetente = remetente
+        self.destinatarios = destinatarios
+        self.usuario = usuario
+        self.senha = senha
+        self.tls = tls
+        self.timeout = timeout
+
+    def _mensagem(self, alertas):
+        mensagem = EmailMessage()
+        mensagem['From'] = self.remetente
+        mensagem['To'] = ', '.join(self.destinatarios)
+        if len(alertas) == 1:
+            mensagem['Subject'] = f"[HELIOS] Alerta {alertas[0]['severidade']}: {alertas[0]['regra']}"
+        else:
+            mensagem['Subject'] = f'[HELIOS] {len(alertas)} novos alertas'
+        linhas = [
+            f"{alerta['criado_em']} [{alerta['severidade']}] {alerta['parque']} / "
+            f"{alerta['inversor']}: {alerta['mensagem']}"
+            for alerta in alertas
+        ]
+        mensagem.set_content('\n'.join(linhas))
+        return mensagem
+
+    def enviar(self, alertas):
+        with smtplib.SMTP(self.host, self.porta, timeout=self.timeout) as servidor:
+            if self.tls:
+                servidor.starttls()
+            if self.usuario:
+                servidor.login(self.usuario, self.senha)
+            servidor.send_message(self._mensagem(alertas))
+
+class NotificadorArquivo(Notificador):
+    """Acrescenta os alertas a um arquivo, um JSON por linha (útil para testes)"""
+
+    nome = 'arquivo'
+
+    def __init__(self, caminho, tamanho_lote=100):
+        super().__init__(tamanho_lote)
+        self.caminho = caminho
+        self._lock = threading.Lock()
+
+    def enviar(self, alertas):
+        linhas = ''.join(json.dumps(alerta, ensure_ascii=False) + '\n' for alerta in alertas)
+        with self._lock:
+            with open(self.caminho, 'a', encoding='utf-8') as arquivo:
+                arquivo.write(linhas)
+                arquivo.flush()
+                os.fsync(arquivo.fileno())
+
+def criar_notificadores(config):
+    """Monta os notificadores configurados no app. Retorna {nome do destino: notificador}."""
+    tamanho_lote = config['NOTIFICACAO_LOTE']
+    notificadores = []
+
+    if config.get('NOTIFICACAO_WEBHOOK_URL'):
+        notificadores.append(NotificadorWebhook(
+            config['NOTIFICACAO_WEBHOOK_URL'],
+            token=config.get('NOTIFICACAO_WEBHOOK_TOKEN'),
+            tamanho_lote=tamanho_lote
+        ))
+
+    if config.get('NOTIFICACAO_SMTP_HOST') and config.get('NOTIFICACAO_EMAIL_PARA'):
+        notificadores.append(NotificadorEmail(
+            config['NOTIFICACAO_SMTP_HOST'],
+            config['NOTIFICACAO_SMTP_PORTA'],
+            config['NOTIFICACAO_EMAIL_DE'],
+            [email.strip() for email in config['NOTIFICACAO_EMAIL_PARA'].split(',') if email.strip()],
+            usuario=config.get('NOTIFICACAO_SMTP_USUARIO'),
+            senha=config.get('NOTIFICACAO_SMTP_SENHA'),
+            tls=config['NOTIFICACAO_SMTP_TLS'],
+            tamanho_lote=tamanho_lote
+        ))
+
+    if config.get('NOTIFICACAO_ARQUIVO'):
+        notificadores.append(NotificadorArquivo(config['NOTIFICACAO_ARQUIVO'], tamanho_lote=tamanho_lote))
+
+    return {notificador.nome: notificador for notificador in notificadores}
+
+_destinos = None
+_destinos_lock = threading.Lock()
+
+def obter_destinos():
+    """Retorna os nomes dos destinos configurados, montados uma vez por processo a partir do app"""
+    global _destinos
+    if _destinos is None:
+        with _destinos_lock:
+            if _destinos is None:
+                _destinos = list(criar_notificadores(current_app.config))
+    return _destinos
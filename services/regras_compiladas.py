@@ -0,0 +1,189 @@
+"""Conjunto de regras ativas compilado em memória, recarregado quando a versão das regras muda"""
+from models import Regra, VersaoCache, OPERADORES_REGRA, METRICAS_REGRA, db
+from services.expressoes import compilar_expressao
+from collections import namedtuple
+import threading
+import time
+
+# Chave em versoes_cache incrementada a cada alteração de regra
+CHAVE_VERSAO = 'regras'
+
+# Intervalo mínimo em segundos entre consultas à versão das regras no banco
+INTERVALO_VERIFICACAO = 5
+
+RegraCompilada = namedtuple('RegraCompilada', [
+    'id', 'nome', 'tipo', 'coluna', 'operador', 'valor_threshold', 'severidade',
+    'janela_tipo', 'janela', 'expressao', 'disparou',
+    'parque_id', 'modelo_inversor', 'inversores_ids'
+])
+
+# Quantidade máxima de inversores com regras aplicáveis memorizadas
+MAX_INVERSORES_INDICE = 50000
+
+def aplica_ao_inversor(regra, inversor):
+    """Indica se a regra compilada vale para o inversor (InversorMeta)"""
+    return ((regra.parque_id is None or regra.parque_id == inversor.parque_id) and
+            (regra.modelo_inversor is None or regra.modelo_inversor == inversor.modelo) and
+            (regra.inversores_ids is None or inversor.id in regra.inversores_ids))
+
+class GrupoRegras:
+    """Regras agrupadas pela forma de avaliação, com os operadores já resolvidos.
+
+    Regras sobre a última leitura ficam em por_tipo; regras com janela
+    (média ou leituras consecutivas) ficam em janeladas e regras com
+    expressão composta em expressoes. instantaneas reúne as regras avaliadas
+    só com a última leitura (por_tipo e expressoes).
+    """
+
+    def __init__(self, regras):
+        self.regras = tuple(regras)
+        self.instantaneas = tuple(regra for regra in self.regras if regra.janela_tipo == 'instantanea')
+        self.janeladas = tuple(regra for regra in self.regras if regra.janela_tipo != 'instantanea')
+        self.expressoes = tuple(regra for regra in self.regras if regra.expressao is not None)
+        por_tipo = {}
+        for regra in self.instantaneas:
+            if regra.expressao is None:
+                por_tipo.setdefault(regra.tipo, []).append(regra)
+        # tipo -> (coluna da medição, regras do tipo)
+        self.por_tipo = {tipo: (grupo[0].coluna, tuple(grupo)) for tipo, grupo in por_tipo.items()}
+
+    def __len__(self):
+        return len(self.regras)
+
+class ConjuntoRegras(GrupoRegras):
+    """Todas as regras ativas, com um índice de inversor para as regras que se aplicam a ele.
+
+    Cada regra é indexada pelo campo de escopo mais seletivo (ids, parque,
+    modelo ou nenhum). As regras de um inversor são montadas a partir desses
+    índices na primeira leitura dele e memorizadas pela chave (id, parque,
+    modelo), então mudar o inversor de parque ou de modelo gera outra chave.
+    """
+
+    def __init__(self, versao, regras):
+        super().__init__(regras)
+        self.versao = versao
+        self._globais = []
+        self._por_inversor = {}
+        self._por_parque = {}
+        self._por_modelo = {}
+        for regra in self.regras:
+            if regra.inversores_ids is not None:
+                for inversor_id in regra.inversores_ids:
+                    self._por_inversor.setdefault(inversor_id, []).append(regra)
+            elif regra.parque_id is not None:
+                self._por_parque.setdefault(regra.parque_id, []).append(regra)
+            elif regra.modelo_inversor is not None:
+                self._por_modelo.setdefault(regra.modelo_inversor, []).append(regra)
+            else:
+                self._globais.append(regra)
+        self._grupos = {}
+
+    def para_inversor(self, inversor):
+        """Retorna o GrupoRegras com as regras que valem para o inversor (InversorMeta)"""
+        chave = (inversor.id, inversor.parque_id, inversor.modelo)
+        grupo = self._grupos.get(chave)
+        if grupo is None:
+            candidatas = (self._globais + self._por_inversor.get(inversor.id, []) +
+                          self._por_parque.get(inversor.parque_id, []) +
+                          self._por_modelo.get(inversor.modelo, []))
+            aplicaveis = {regra.id: regra for regra in candidatas if aplica_ao_inversor(regra, inversor)}
+            grupo = GrupoRegras(sorted(aplicaveis.values(), key=lambda regra: regra.id))
+            if len(self._grupos) >= MAX_INVERSORES_INDICE:
+                self._grupos.clear()
+            self._grupos[chave] = grupo
+        return grupo
+
+def _escopo(regra):
+    """Campos de escopo da regra no formato de RegraCompilada"""
+    ids = regra.lista_inversores_ids()
+    return {
+        'parque_id': regra.parque_id or None,
+        'modelo_inversor': regra.modelo_inversor or None,
+        'inversores_ids': frozenset(ids) if ids else None
+    }
+
+def compilar_regra(regra):
+    """Converte uma Regra em RegraCompilada, ou None se o tipo, operador ou expressão não for suportado"""
+    if regra.tipo == 'expressao':
+        try:
+            expressao = compilar_expressao(regra.expressao)
+        except ValueError:
+            return None
+        return RegraCompilada(
+            id=regra.id,
+            nome=regra.nome,
+            tipo=regra.tipo,
+            coluna=None,
+            operador=None,
+            valor_threshold=None,
+            severidade=regra.severidade,
+            janela_tipo='instantanea',
+            janela=None,
+            expressao=expressao,
+            disparou=None,
+            **_escopo(regra)
+        )
+
+    coluna = METRICAS_REGRA.get(regra.tipo)
+    comparar = OPERADORES_REGRA.get(regra.operador)
+    if coluna is None or comparar is None:
+        return None
+    janela_tipo = regra.janela_tipo or 'instantanea'
+    if janela_tipo != 'instantanea' and not regra.janela:
+        return None
+    limite = regra.valor_threshold
+    return RegraCompilada(
+        id=regra.id,
+        nome=regra.nome,
+        tipo=regra.tipo,
+        coluna=coluna,
+        operador=regra.operador,
+        valor_threshold=limite,
+        severidade=regra.severidade,
+        janela_tipo=janela_tipo,
+        janela=regra.janela,
+        expressao=None,
+        disparou=lambda valor: comparar(valor, limite),
+        **_escopo(regra)
+    )
+
+def compilar_regras(versao):
+    """Carrega as regras ativas do banco e monta o conjunto compilado"""
+    regras = (compilar_regra(regra) for regra in Regra.query.filter_by(ativo=True).all())
+    return ConjuntoRegras(versao, [regra for regra in regras if regra is not None])
+
+_conjunto = None
+_verificado_em = 0.0
+_lock = threading.Lock()
+
+def obter_regras_compiladas():
+    """Retorna o conjunto de regras ativas do processo.
+
+    A versão no banco é consultada no máximo a cada INTERVALO_VERIFICACAO
+    segundos; as regras só são recarregadas quando a versão mudou.
+    """
+    global _conjunto, _verificado_em
+    agora = time.monotonic()
+    conjunto = _conjunto
+    if conjunto is not None and agora - _verificado_em < INTERVALO_VERIFICACAO:
+        return conjunto
+
+    with _lock:
+        if _conjunto is not None and agora - _verificado_em < INTERVALO_VERIFICACAO:
+            return _conjunto
+        versao = VersaoCache.obter(CHAVE_VERSAO)
+        if _conjunto is None or _conjunto.versao != versao:
+            _conjunto = compilar_regras(versao)
+        _verificado_em = agora
+        return _conjunto
+
+def invalidar_regras():
+    """Registra uma alteração nas regras.
+
+    Incrementa a versão na transação atual (o commit fica com quem chama) e
+    descarta o conjunto local; os demais processos recarregam ao ver a nova versão.
+    """
+    global _conjunto
+    VersaoCache.incrementar(CHAVE_VERSAO)
+    with _lock:
+        _conjunto = None
@@ -1,70 +1,262 @@
 """Serviço para verificação de regras e geração de alertas"""
-from models import Regra, MedicaoTelemetria, Alerta, Inversor, db
+from models import MedicaoTelemetria, Alerta, Inversor, db
+from database import insert_ignorando_duplicatas
+from services.cache_inversores import obter_inversor
+from services.regras_compiladas import obter_regras_compiladas
+from services.janelas import avaliar_janela
+from services.dashboard_eventos import notificar_dashboard
+from services.expressoes import COLUNAS_EXPRESSAO, contexto_medicao
+from services.alertas_abertos import (
+    alerta_aberto, obter_alertas_abertos, marcar_alteracao_alertas,
+    registrar_alertas_abertos, registrar_alertas_resolvidos
+)
 from datetime import datetime
+from sqlalchemy import func
+import numpy as np
+import threading
 
-def verificar_alertas_inversor(inversor_id):
-    """Verifica todas as regras ativas para um inversor e gera alertas se necessário"""
-    inversor = Inversor.query.get(inversor_id)
+# Alertas por comando INSERT ao gravar em lote
+TAMANHO_BLOCO_ALERTAS = 1000
+
+# Operadores das regras aplicados sobre colunas inteiras
+OPERADORES_NUMPY = {
+    '<': np.less,
+    '>': np.greater,
+    '<=': np.less_equal,
+    '>=': np.greater_equal,
+    '==': np.equal
+}
+
+# Instante da medição mais recente de cada inversor vista por este processo
+_ultimas_medicoes = {}
+_ultimas_lock = threading.Lock()
+
+def _medicao_atual(inversor_id, medicoes):
+    """Retorna a medição mais recente do lote se ela for a atual do inversor, ou None em um backfill.
+
+    O instante mais recente de cada inversor fica em memória; só a primeira
+    verificação do inversor no processo consulta o banco. Como as janelas,
+    não enxerga medições mais novas gravadas por outros processos.
+    """
+    medicao = max(medicoes, key=lambda linha: linha['medido_em'])
+    with _ultimas_lock:
+        conhecida = _ultimas_medicoes.get(inversor_id)
+    if conhecida is None:
+        conhecida = db.session.query(func.max(MedicaoTelemetria.medido_em)).filter(
+            MedicaoTelemetria.inversor_id == inversor_id
+        ).scalar()
+    with _ultimas_lock:
+        conhecida = max(filter(None, (conhecida, _ultimas_medicoes.get(inversor_id))), default=None)
+        if conhecida is not None and medicao['medido_em'] < conhecida:
+            _ultimas_medicoes[inversor_id] = conhecida
+            return None
+        _ultimas_medicoes[inversor_id] = medicao['medido_em']
+    return medicao
+
+def mensagem_alerta(regra, valor):
+    """Texto do alerta gerado por uma regra compilada"""
+    if regra.expressao is not None:
+        return f"{regra.nome}: {regra.expressao.texto}"
+    if regra.janela_tipo == 'media':
+        return (f"{regra.nome}: média de {regra.tipo} em {regra.janela} min ({valor:.2f}) "
+                f"{regra.operador} {regra.valor_threshold}")
+    if regra.janela_tipo == 'consecutivas':
+        return (f"{regra.nome}: {regra.tipo} {regra.operador} {regra.valor_threshold} "
+                f"por {regra.janela} leituras consecutivas (última: {valor:.2f})")
+    return f"{regra.nome}: {regra.tipo} ({valor:.2f}) {regra.operador} {regra.valor_threshold}"
+
+def gravar_alertas(novos_alertas):
+    """Grava alertas novos ignorando os pares (inversor, regra) que já têm alerta aberto.
+
+    A unicidade é garantida pelo índice único uq_alerta_aberto_inversor_regra,
+    então processos gravando alertas ao mesmo tempo não criam duplicados e
+    não precisam de lock. Faz o commit e retorna a quantidade inserida.
+    """
+    if not novos_alertas:
+        return 0
+    
+    inseridos = 0
+    for inicio in range(0, len(novos_alertas), TAMANHO_BLOCO_ALERTAS):
+        bloco = novos_alertas[inicio:inicio + TAMANHO_BLOCO_ALERTAS]
+        inseridos += db.session.execute(insert_ignorando_duplicatas(Alerta.__table__, bloco)).rowcount
+    
+    if inseridos:
+        marcar_alteracao_alertas()
+    db.session.commit()
+    # Pares ignorados foram abertos por outro processo: também estão abertos no banco
+    registrar_alertas_abertos(
+        ((alerta['inversor_id'], alerta['regra_id']) for alerta in novos_alertas),
+        versao_incrementada=bool(inseridos)
+    )
+    if inseridos:
+        notificar_dashboard()
+    return inseridos
+
+def verificar_alertas_inversor(inversor_id, medicoes):
+    """Verifica todas as regras ativas para um inversor e gera alertas se necessário.
+
+    medicoes é a lista, em ordem cronológica, das leituras recém-gravadas
+    (por exemplo as retornadas por preparar_medicao) e alimenta as janelas
+    das regras com janela. Regras sobre a última leitura e com expressão
+    avaliam a mais recente delas, e só se nenhuma leitura mais nova do
+    inversor já foi vista: um reenvio ou backfill de leituras antigas não
+    abre alerta por uma condição que já não é a atual. Não consulta as
+    medições gravadas.
+    """
+    if not medicoes:
+        return
+    inversor = obter_inversor(inversor_id)
     if not inversor:
         return
     
-    # Obter última medição do inversor
-    ultima_medicao = MedicaoTelemetria.query.filter_by(
-        inversor_id=inversor_id
+    # Só as regras cujo escopo inclui este inversor
+    conjunto = obter_regras_compiladas().para_inversor(inversor)
+    if not conjunto:
+        return
+    
+    medicao = _medicao_atual(inversor_id, medicoes)
+    
+    disparadas = []
+    if medicao is not None:
+        for coluna, regras in conjunto.por_tipo.values():
+            valor_verificar = medicao.get(coluna)
+            if valor_verificar is None:
+                continue
+            for regra in regras:
+                if regra.disparou(valor_verificar):
+                    disparadas.append((regra, valor_verificar))
+        
+        if conjunto.expressoes:
+            contexto = contexto_medicao(medicao, inversor.capacidade_kw)
+            for regra in conjunto.expressoes:
+                if regra.expressao.avaliar(contexto):
+                    disparadas.append((regra, None))
+    
+    for regra in conjunto.janeladas:
+        valor_verificar = avaliar_janela(inversor_id, regra, medicoes)
+        if valor_verificar is not None:
+            disparadas.append((regra, valor_verificar))
+    
+    agora = datetime.utcnow()
+    novos_alertas = []
+    for regra, valor_verificar in disparadas:
+        # Pular se já existe alerta não resolvido para esta regra e inversor
+        if alerta_aberto(inversor_id, regra.id):
+            continue
+        
+        novos_alertas.append({
+            'inversor_id': inversor_id,
+            'regra_id': regra.id,
+            'mensagem': mensagem_alerta(regra, valor_verificar),
+            'severidade': regra.severidade,
+            'resolvido': False,
+            'criado_em': agora
+        })
+    
+    gravar_alertas(novos_alertas)
+
+def verificar_todos_alertas(parque_id=None):
+    """Verifica as regras ativas para todos os inversores (ou os de um parque) com operações em conjunto.
+    
+    Usa uma consulta para a última medição de cada inversor, o conjunto de regras
+    compilado e o índice de alertas abertos, avalia cada regra sobre as colunas com NumPy e
+    grava os alertas novos com INSERTs em lote que ignoram pares já abertos e um commit.
+    Regras com janela dependem da série de leituras e são avaliadas na ingestão.
+    Retorna a quantidade de alertas criados.
+    """
+    regras_ativas = obter_regras_compiladas().instantaneas
+    if not regras_ativas:
+        return 0
+    
+    # Última medição de cada inversor: subconsulta correlacionada que usa o
+    # índice (inversor_id, medido_em) para buscar só uma linha por inversor
+    ultima_medicao_id = db.session.query(MedicaoTelemetria.id).filter(
+        MedicaoTelemetria.inversor_id == Inversor.id
     ).order_by(
-        MedicaoTelemetria.data_medicao.desc(),
-        MedicaoTelemetria.hora_medicao.desc()
-    ).first()
+        MedicaoTelemetria.medido_em.desc()
+    ).limit(1).correlate(Inversor).scalar_subquery()
     
-    if not ultima_medicao:
-        return
+    colunas = list(COLUNAS_EXPRESSAO)
+    consulta = db.session.query(
+        Inversor.id,
+        Inversor.capacidade_kw,
+        Inversor.parque_id,
+        Inversor.modelo,
+        MedicaoTelemetria.medido_em,
+        *[getattr(MedicaoTelemetria, coluna) for coluna in colunas]
+    ).join(
+        MedicaoTelemetria, MedicaoTelemetria.id == ultima_medicao_id
+    )
+    if parque_id is not None:
+        consulta = consulta.filter(Inversor.parque_id == parque_id)
+    ultimas_medicoes = consulta.all()
+    
+    if not ultimas_medicoes:
+        return 0
+    
+    # Pares (inversor, regra) que já possuem alerta aberto
+    alertas_abertos = obter_alertas_abertos()
     
-    # Obter todas as regras ativas
-    regras_ativas = Regra.query.filter_by(ativo=True).all()
+    inversores_ids = np.array([linha[0] for linha in ultimas_medicoes])
+    valores = {
+        coluna: np.array([linha[i + 5] for linha in ultimas_medicoes], dtype=float)
+        for i, coluna in enumerate(colunas)
+    }
+    # Contexto das regras com expressão: colunas inteiras em vez de escalares
+    valores['capacidade'] = np.array([linha[1] for linha in ultimas_medicoes], dtype=float)
+    valores['hora'] = np.array([linha[4].hour for linha in ultimas_medicoes], dtype=float)
+    parques = np.array([linha[2] for linha in ultimas_medicoes])
+    modelos = np.array([linha[3] for linha in ultimas_medicoes], dtype=object)
     
-    # Verificar cada regra
+    agora = datetime.utcnow()
+    novos_alertas = []
     for regra in regras_ativas:
-        valor_verificar = None
+        if regra.expressao is not None:
+            disparou = np.broadcast_to(regra.expressao.avaliar(valores), inversores_ids.shape)
+        else:
+            operador = OPERADORES_NUMPY[regra.operador]
+            # Valores ausentes (NaN) nunca satisfazem a condição
+            with np.errstate(invalid='ignore'):
+                disparou = operador(valores[regra.coluna], regra.valor_threshold)
         
-        # Determinar qual valor verificar baseado no tipo da regra
-        if regra.tipo == 'eficiencia':
-            valor_verificar = ultima_medicao.eficiencia
-        elif regra.tipo == 'temperatura':
-            valor_verificar = ultima_medicao.temperatura
-        elif regra.tipo == 'geracao':
-            valor_verificar = ultima_medicao.geracao_kw
-        elif regra.tipo == 'tensao':
-            valor_verificar = ultima_medicao.tensao
-        elif regra.tipo == 'corrente':
-            valor_verificar = ultima_medicao.corrente
+        # Restringir ao escopo da regra
+        if regra.parque_id is not None:
+            disparou = disparou & (parques == regra.parque_id)
+        if regra.modelo_inversor is not None:
+            disparou = disparou & (modelos == regra.modelo_inversor)
+        if regra.inversores_ids is not None:
+            disparou = disparou & np.isin(inversores_ids, list(regra.inversores_ids))
         
-        # Se o valor está disponível, verificar condição
-        if valor_verificar is not None:
-            if regra.verificar_condicao(valor_verificar):
-                # Verificar se já existe alerta não resolvido para esta regra e inversor
-                alerta_existente = Alerta.query.filter_by(
-                    inversor_id=inversor_id,
-                    regra_id=regra.id,
-                    resolvido=False
-                ).first()
-                
-                # Se não existe, criar novo alerta
-                if not alerta_existente:
-                    mensagem = f"{regra.nome}: {regra.tipo} ({valor_verificar:.2f}) {regra.operador} {regra.valor_threshold}"
-                    
-                    alerta = Alerta(
-                        inversor_id=inversor_id,
-                        regra_id=regra.id,
-                        mensagem=mensagem,
-                        severidade=regra.severidade
-                    )
-                    
-                    db.session.add(alerta)
-                    db.session.commit()
+        for indice in np.flatnonzero(disparou):
+            inversor_id = int(inversores_ids[indice])
+            if (inversor_id, regra.id) in alertas_abertos:
+                continue
+            valor_verificar = valores[regra.coluna][indice] if regra.coluna else None
+            novos_alertas.append({
+                'inversor_id': inversor_id,
+                'regra_id': regra.id,
+                'mensagem': mensagem_alerta(regra, valor_verificar),
+                'severidade': regra.severidade,
+                'resolvido': False,
+                'criado_em': agora
+            })
+    
+    return gravar_alertas(novos_alertas)
 
-def verificar_todos_alertas():
-    """Verifica alertas para todos os inversores"""
-    inversores = Inversor.query.all()
-    for inversor in inversores:
-        verificar_alertas_inversor(inversor.id)
+def resolver_alertas(inversor_id, regra_id):
+    """Marca como resolvidos os alertas abertos de uma regra em um inversor.
 
+    Retorna a quantidade de alertas resolvidos.
+    """
+    resolvidos = Alerta.query.filter_by(
+        inversor_id=inversor_id,
+        regra_id=regra_id,
+        resolvido=False
+    ).update({'resolvido': True, 'resolvido_em': datetime.utcnow()})
+    
+    if resolvidos:
+        marcar_alteracao_alertas()
+    db.session.commit()
+    if resolvidos:
+        registrar_alertas_resolvidos([(inversor_id, regra_id)])
+    return resolvidos
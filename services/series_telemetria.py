@@ -0,0 +1,193 @@
+"""Séries de telemetria de longo prazo reduzidas a uma quantidade de pontos para gráficos.
+
+A origem é escolhida pelo tamanho do período: medições brutas (só para
+inversores) enquanto couberem em MAX_LINHAS_POR_PONTO linhas por ponto
+pedido, senão agregados por hora e, por fim, agregados por dia. As linhas
+são lidas como colunas e reduzidas com NumPy por LTTB (largest triangle
+three buckets) ou por mínimo/máximo em baldes de tempo, então o trabalho e
+o tamanho da resposta ficam limitados para qualquer período.
+"""
+from models import (MedicaoTelemetria, AgregadoInversorHora, AgregadoInversorDia, AgregadoParqueHora,
+                    AgregadoParqueDia, db)
+from datetime import datetime, timedelta
+from sqlalchemy import select, func
+import numpy as np
+
+METODOS_REDUCAO = ('lttb', 'minmax')
+
+# Limites da quantidade de pontos pedida
+MIN_PONTOS = 3
+MAX_PONTOS = 5000
+
+# Linhas lidas do banco por ponto da série reduzida, no máximo
+MAX_LINHAS_POR_PONTO = 20
+
+_EPOCA = datetime(1970, 1, 1)
+
+def reduzir_lttb(x, y, pontos):
+    """Índices dos pontos escolhidos por largest triangle three buckets.
+
+    x deve estar em ordem crescente. O primeiro e o último ponto são sempre
+    mantidos; entre eles, cada balde contribui com o ponto que forma o maior
+    triângulo com o ponto escolhido no balde anterior e a média do próximo.
+    """
+    n = len(x)
+    if pontos >= n or pontos < 3:
+        return np.arange(n)
+
+    indices = np.empty(pontos, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    # pontos - 2 baldes entre o primeiro e o último ponto
+    limites = np.linspace(1, n - 1, pontos - 1).astype(np.int64)
+    a = 0
+    for i in range(pontos - 2):
+        inicio, fim = limites[i], limites[i + 1]
+        proximo_fim = limites[i + 2] if i + 2 < len(limites) else n
+        media_x = x[fim:proximo_fim].mean()
+        media_y = y[fim:proximo_fim].mean()
+        areas = np.abs((x[a] - media_x) * (y[inicio:fim] - y[a]) - (x[a] - x[inicio:fim]) * (media_y - y[a]))
+        a = inicio + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+def reduzir_minmax(x, minimos, maximos, somas, quantidades, pontos):
+    """Agrupa as linhas em `pontos` baldes de tempo de mesma largura.
+
+    Retorna (início de cada balde não vazio, mínimo, máximo, média). Para
+    medições brutas, mínimos e máximos são os próprios valores e cada linha
+    tem quantidade 1.
+    """
+    if not len(x):
+        return x, minimos, maximos, somas
+    largura = max((x[-1] - x[0] + 1) / pontos, 1.0)
+    baldes = ((x - x[0]) // largura).astype(np.int64)
+    inicios = np.flatnonzero(np.concatenate([[True], baldes[1:] != baldes[:-1]]))
+    qtd = np.add.reduceat(quantidades, inicios)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        medias = np.add.reduceat(somas, inicios) / qtd
+    return (x[0] + baldes[inicios] * largura, np.fmin.reduceat(minimos, inicios),
+            np.fmax.reduceat(maximos, inicios), medias)
+
+def _origem(modelo_hora, filtro_hora, inicio, fim, pontos, brutas_permitidas):
+    """Escolhe 'medicoes', 'hora' ou 'dia' pela quantidade de linhas no período"""
+    limite = pontos * MAX_LINHAS_POR_PONTO
+    leituras, horas = db.session.query(
+        func.coalesce(func.sum(modelo_hora.leituras), 0), func.count()
+    ).filter(
+        filtro_hora,
+        modelo_hora.inicio >= inicio,
+        modelo_hora.inicio < fim
+    ).one()
+    if brutas_permitidas and leituras <= limite:
+        return 'medicoes'
+    if horas <= limite:
+        return 'hora'
+    return 'dia'
+
+def _colunas(consulta):
+    """Executa a consulta e retorna cada coluna como array (NULL vira NaN)"""
+    linhas = db.session.execute(consulta).all()
+    if not linhas:
+        return None
+    instantes, *colunas = zip(*linhas)
+    tempos = np.array(instantes, dtype='datetime64[s]').astype(np.int64).astype(float)
+    return [tempos] + [np.array(coluna, dtype=float) for coluna in colunas]
+
+def _para_iso(segundos):
+    return (_EPOCA + timedelta(seconds=int(segundos))).isoformat()
+
+def _arredondar(valor):
+    return None if np.isnan(valor) else round(float(valor), 3)
+
+def serie_telemetria(metrica, inicio, fim, pontos, metodo='lttb', inversor_id=None, parque_id=None):
+    """Série da métrica de um inversor ou parque entre inicio e fim (datetimes, fim exclusivo).
+
+    Com lttb, cada ponto é [instante, valor] (a média das leituras na linha
+    de origem). Com minmax, cada ponto é [início do balde, mínimo, máximo,
+    média]. Séries de parque vêm sempre dos agregados do parque e trazem a
+    média das leituras dos seus inversores.
+    """
+    if inversor_id is not None:
+        modelos = {'hora': AgregadoInversorHora, 'dia': AgregadoInversorDia}
+        filtros = {modelo: modelo.inversor_id == inversor_id for modelo in modelos.values()}
+    else:
+        modelos = {'hora': AgregadoParqueHora, 'dia': AgregadoParqueDia}
+        filtros = {modelo: modelo.parque_id == parque_id for modelo in modelos.values()}
+
+    origem = _origem(modelos['hora'], filtros[modelos['hora']], inicio, fim, pontos,
+                     brutas_permitidas=inversor_id is not None)
+
+    if origem == 'medicoes':
+        valor = getattr(MedicaoTelemetria, metrica)
+        colunas = _colunas(select(MedicaoTelemetria.medido_em, valor).where(
+            MedicaoTelemetria.inversor_id == inversor_id,
+            MedicaoTelemetria.medido_em >= inicio,
+            MedicaoTelemetria.medido_em < fim,
+            valor.isnot(None)
+        ).order_by(MedicaoTelemetria.medido_em))
+        if colunas is not None:
+            tempos, valores = colunas
+            minimos = maximos = somas = valores
+            quantidades = np.ones(len(valores))
+    else:
+        modelo = modelos[origem]
+        if origem == 'hora':
+            instante = modelo.inicio
+            periodo = [modelo.inicio >= inicio, modelo.inicio < fim]
+        else:
+            instante = modelo.data
+            periodo = [modelo.data >= inicio.date(), modelo.data < (fim - timedelta(microseconds=1)).date() + timedelta(days=1)]
+        colunas = _colunas(select(
+            instante,
+            getattr(modelo, f'{metrica}_soma'),
+            getattr(modelo, f'{metrica}_qtd'),
+            getattr(modelo, f'{metrica}_min'),
+            getattr(modelo, f'{metrica}_max')
+        ).where(
+            filtros[modelo], *periodo, getattr(modelo, f'{metrica}_qtd') > 0
+        ).order_by(instante))
+        if colunas is not None:
+            tempos, somas, quantidades, minimos, maximos = colunas
+            valores = somas / quantidades
+
+    resultado = {
+        'metrica': metrica,
+        'inicio': inicio.isoformat(),
+        'fim': fim.isoformat(),
+        'metodo': metodo,
+        'origem': {'medicoes': 'medicoes', 'hora': 'agregados_hora', 'dia': 'agregados_dia'}[origem],
+        'pontos_originais': 0 if colunas is None else len(tempos),
+        'serie': []
+    }
+    if colunas is None:
+        return resultado
+
+    if metodo == 'lttb':
+        indices = reduzir_lttb(tempos, valores, pontos)
+        resultado['serie'] = [[_para_iso(tempos[i]), _arredondar(valores[i])] for i in indices]
+    else:
+        baldes, minimos, maximos, medias = reduzir_minmax(tempos, minimos, maximos, somas, quantidades, pontos)
+        resultado['serie'] = [
+            [_para_iso(t), _arredondar(minimo), _arredondar(maximo), _arredondar(media)]
+            for t, minimo, maximo, media in zip(baldes, minimos, maximos, medias)
+        ]
+    return resultado
+
+def periodo_serie(inicio_texto, fim_texto, agora=None):
+    """Converte os parâmetros inicio e fim (ISO, data ou data e hora) em datetimes com fim exclusivo.
+
+    Uma data sem hora em fim inclui o dia inteiro. Sem fim, usa agora; sem
+    inicio, os 7 dias anteriores ao fim. Lança ValueError se forem inválidos.
+    """
+    agora = agora or datetime.now()
+    if fim_texto:
+        fim = datetime.fromisoformat(fim_texto)
+        if len(fim_texto) == 10:
+            fim += timedelta(days=1)
+    else:
+        fim = agora
+    inicio = datetime.fromisoformat(inicio_texto) if inicio_texto else fim - timedelta(days=7)
+    if inicio >= fim:
+        raise ValueError('inicio deve ser anterior a fim')
+    return inicio, fim
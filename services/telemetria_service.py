@@ -0,0 +1,122 @@
+"""Serviço para validação e gravação de medições de telemetria"""
+from models import MedicaoTelemetria, db
+from database import upsert, upsert_linha
+from services.agregados import acumular_agregados, marcar_alteracao_telemetria
+from services.dashboard_eventos import notificar_dashboard
+from services.cache_respostas import verificar_marcas_telemetria
+from datetime import datetime
+import math
+
+# Quantidade de linhas enviadas em cada INSERT em lote
+TAMANHO_LOTE = 500
+
+# Colunas sobrescritas quando uma medição com a mesma chave natural é reenviada
+CHAVE_NATURAL = ['inversor_id', 'data_medicao', 'hora_medicao']
+COLUNAS_ATUALIZAVEIS = ['geracao_kw', 'temperatura', 'tensao', 'corrente', 'frequencia', 'eficiencia']
+
+# Métricas opcionais do registro; ausentes ou null ficam como NULL
+METRICAS_OPCIONAIS = ['temperatura', 'tensao', 'corrente', 'frequencia']
+
+def _numero(dados, campo, obrigatorio=False):
+    """Converte o campo do registro em float finito. Lança ValueError se for inválido."""
+    valor = dados.get(campo)
+    if valor is None and not obrigatorio:
+        return None
+    # bool é subclasse de int, mas true/false não são medições
+    if isinstance(valor, bool):
+        raise ValueError(f'Valor de {campo} inválido')
+    try:
+        valor = float(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f'Valor de {campo} inválido')
+    if not math.isfinite(valor):
+        raise ValueError(f'Valor de {campo} inválido')
+    return valor
+
+def preparar_medicao(dados, inversor):
+    """Valida um registro de telemetria do inversor e retorna os valores prontos para inserção.
+
+    Lança ValueError com a mensagem de erro quando o registro é inválido.
+    """
+    geracao_kw = _numero(dados, 'geracao_kw', obrigatorio=True)
+    metricas = {campo: _numero(dados, campo) for campo in METRICAS_OPCIONAIS}
+    data_medicao = dados.get('data_medicao')
+    hora_medicao = dados.get('hora_medicao')
+    
+    # Processar data e hora
+    if data_medicao:
+        try:
+            data_med = datetime.strptime(data_medicao, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            raise ValueError('Formato de data inválido. Use YYYY-MM-DD')
+    else:
+        data_med = datetime.now().date()
+    
+    if hora_medicao:
+        try:
+            hora_med = datetime.strptime(hora_medicao, '%H:%M:%S').time()
+        except (TypeError, ValueError):
+            raise ValueError('Formato de hora inválido. Use HH:MM:SS')
+    else:
+        hora_med = datetime.now().replace(microsecond=0).time()
+    
+    # Calcular eficiência
+    eficiencia = None
+    if inversor.capacidade_kw > 0:
+        eficiencia = (geracao_kw / inversor.capacidade_kw) * 100
+    
+    return {
+        'inversor_id': inversor.id,
+        'data_medicao': data_med,
+        'hora_medicao': hora_med,
+        'medido_em': datetime.combine(data_med, hora_med),
+        'geracao_kw': geracao_kw,
+        **metricas,
+        'eficiencia': eficiencia
+    }
+
+def inserir_medicoes(linhas):
+    """Grava medições já validadas com um upsert em lote por bloco e um único commit.
+
+    Medições com a mesma chave natural (inversor, data, hora) substituem as
+    existentes, então reenvios e reprocessamentos de lotes são idempotentes.
+    Os agregados e a versão da telemetria são atualizados na mesma
+    transação; depois do commit, avisa o cache de respostas e o dashboard em
+    tempo real deste processo.
+    """
+    # Dentro do mesmo lote, prevalece a última ocorrência de cada chave
+    linhas = list({tuple(linha[c] for c in CHAVE_NATURAL): linha for linha in linhas}.values())
+    
+    acumular_agregados(linhas)
+    stmt = upsert(MedicaoTelemetria.__table__, CHAVE_NATURAL, COLUNAS_ATUALIZAVEIS)
+    for inicio in range(0, len(linhas), TAMANHO_LOTE):
+        db.session.execute(stmt, linhas[inicio:inicio + TAMANHO_LOTE])
+    _concluir_gravacao(linhas)
+
+def agrupar_por_inversor(linhas):
+    """Retorna {inversor_id: medições do lote em ordem cronológica}"""
+    grupos = {}
+    for linha in linhas:
+        grupos.setdefault(linha['inversor_id'], []).append(linha)
+    for medicoes in grupos.values():
+        medicoes.sort(key=lambda linha: linha['medido_em'])
+    return grupos
+
+def inserir_medicao(valores):
+    """Grava uma medição já validada como inserir_medicoes e retorna o seu id.
+
+    O id vem do próprio upsert (RETURNING ou LAST_INSERT_ID), sem uma
+    consulta pela chave natural depois do commit.
+    """
+    acumular_agregados([valores])
+    medicao_id = upsert_linha(MedicaoTelemetria.__table__, CHAVE_NATURAL, COLUNAS_ATUALIZAVEIS, valores)
+    _concluir_gravacao([valores])
+    return medicao_id
+
+def _concluir_gravacao(linhas):
+    # A versão é o último comando antes do commit: a linha 'telemetria' de
+    # versoes_cache, disputada por todas as gravações, fica travada só no commit
+    marcar_alteracao_telemetria({linha['medido_em'].date() for linha in linhas})
+    db.session.commit()
+    verificar_marcas_telemetria()
+    notificar_dashboard()
@@ -0,0 +1,97 @@
+"""
+Worker de notificação de alertas
+Execute: python worker_notificacoes.py [--intervalo 5] [--uma-vez]
+
+A cada intervalo, distribui os alertas novos aos destinos configurados
+(variáveis NOTIFICACAO_*) e entrega os envios pendentes de cada destino em
+lotes, com uma thread por destino para que um destino lento não atrase os
+demais. Falhas são reenviadas com backoff exponencial.
+"""
+
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('worker_notificacoes')
+
+def entregar_destino(app, notificador):
+    """Entrega os envios pendentes de um destino. Retorna (destino, enviados, falhas)."""
+    from database import db
+    from services.notificacoes_service import entregar_pendentes
+
+    with app.app_context():
+        try:
+            enviados, falhas = entregar_pendentes(notificador, app.config['NOTIFICACAO_TENTATIVAS'])
+        finally:
+            db.session.remove()
+    return notificador.nome, enviados, falhas
+
+def executar_ciclo(app, notificadores, executor):
+    """Distribui os alertas novos e entrega os pendentes. Retorna a quantidade de alertas enviados."""
+    from database import db
+    from services.notificacoes_service import distribuir_alertas
+
+    inicio = time.monotonic()
+    with app.app_context():
+        try:
+            distribuidos = 0
+            while True:
+                quantidade = distribuir_alertas(list(notificadores))
+                distribuidos += quantidade
+                if not quantidade:
+                    break
+        except Exception:
+            db.session.rollback()
+            logger.exception('Erro ao distribuir alertas')
+        finally:
+            db.session.remove()
+
+    total = 0
+    tarefas = [executor.submit(entregar_destino, app, notificador) for notificador in notificadores.values()]
+    for tarefa in tarefas:
+        try:
+            destino, enviados, falhas = tarefa.result()
+        except Exception:
+            logger.exception('Erro na entrega de notificações')
+            continue
+        total += enviados
+        if enviados or falhas:
+            logger.info('%s: %d alerta(s) enviado(s), %d com falha', destino, enviados, falhas)
+
+    if distribuidos or total:
+        logger.info('Ciclo concluído: %d alerta(s) distribuído(s), %d enviado(s) em %.2fs',
+                    distribuidos, total, time.monotonic() - inicio)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description='Distribuição e entrega das notificações de alertas')
+    parser.add_argument('--intervalo', type=float, default=float(os.getenv('NOTIFICACAO_INTERVALO', 5)),
+                        help='Segundos entre dois ciclos de entrega (padrão: 5)')
+    parser.add_argument('--uma-vez', action='store_true', help='Executa um ciclo e termina')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from app import app
+    from services.notificadores import criar_notificadores
+
+    notificadores = criar_notificadores(app.config)
+    if not notificadores:
+        logger.error('Nenhum destino de notificação configurado (NOTIFICACAO_WEBHOOK_URL, '
+                     'NOTIFICACAO_SMTP_HOST ou NOTIFICACAO_ARQUIVO)')
+        return
+    logger.info('Destinos de notificação: %s', ', '.join(notificadores))
+
+    with ThreadPoolExecutor(max_workers=len(notificadores)) as executor:
+        while True:
+            inicio = time.monotonic()
+            executar_ciclo(app, notificadores, executor)
+            if args.uma_vez:
+                break
+            time.sleep(max(0.0, args.intervalo - (time.monotonic() - inicio)))
+
+
+if __name__ == '__main__':
+    main()
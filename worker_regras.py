@@ -0,0 +1,101 @@
+"""
+Worker de varredura periódica das regras de alerta
+Execute: python worker_regras.py [--intervalo 60] [--processos N] [--uma-vez]
+
+A cada intervalo, divide os inversores por parque e avalia as regras ativas
+de cada parque em um processo do pool, com sessão de banco própria. Registra
+a duração da varredura e os alertas criados por parque.
+"""
+
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+logger = logging.getLogger('worker_regras')
+
+def _inicializar_processo():
+    """Descarta as conexões herdadas do processo pai; cada processo abre as suas"""
+    from app import app
+    from database import db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+def varrer_parque(parque_id):
+    """Avalia as regras para os inversores de um parque. Retorna (parque_id, alertas criados, duração)."""
+    from app import app
+    from database import db
+    from services.regras_service import verificar_todos_alertas
+
+    inicio = time.monotonic()
+    with app.app_context():
+        try:
+            criados = verificar_todos_alertas(parque_id)
+        finally:
+            db.session.remove()
+    return parque_id, criados, time.monotonic() - inicio
+
+def listar_parques(app):
+    """Retorna os ids dos parques com inversores cadastrados"""
+    from database import db
+    from models import Inversor
+
+    with app.app_context():
+        try:
+            return [parque_id for (parque_id,) in db.session.query(Inversor.parque_id).distinct().all()]
+        finally:
+            db.session.remove()
+
+def executar_varredura(app, executor):
+    """Executa uma varredura completa, um parque por tarefa do pool. Retorna o total de alertas criados."""
+    inicio = time.monotonic()
+    parques = listar_parques(app)
+    total = 0
+    falhas = 0
+
+    tarefas = {executor.submit(varrer_parque, parque_id): parque_id for parque_id in parques}
+    for tarefa in as_completed(tarefas):
+        try:
+            parque_id, criados, duracao = tarefa.result()
+        except Exception:
+            falhas += 1
+            logger.exception('Erro na varredura do parque %s', tarefas[tarefa])
+            continue
+        total += criados
+        logger.info('Parque %s: %d alerta(s) criado(s) em %.2fs', parque_id, criados, duracao)
+
+    logger.info('Varredura concluída: %d parque(s), %d alerta(s), %d falha(s) em %.2fs',
+                len(parques), total, falhas, time.monotonic() - inicio)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description='Varredura periódica das regras de alerta por parque')
+    parser.add_argument('--intervalo', type=float, default=float(os.getenv('VARREDURA_INTERVALO', 60)),
+                        help='Segundos entre o início de duas varreduras (padrão: 60)')
+    parser.add_argument('--processos', type=int, default=int(os.getenv('VARREDURA_PROCESSOS', os.cpu_count() or 1)),
+                        help='Processos avaliando parques em paralelo (padrão: núcleos da máquina)')
+    parser.add_argument('--uma-vez', action='store_true', help='Executa uma varredura e termina')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from app import app
+
+    with ProcessPoolExecutor(max_workers=args.processos, initializer=_inicializar_processo) as executor:
+        while True:
+            inicio = time.monotonic()
+            executar_varredura(app, executor)
+            if args.uma_vez:
+                break
+
+            duracao = time.monotonic() - inicio
+            if duracao > args.intervalo:
+                logger.warning('Varredura levou %.2fs, acima do intervalo de %.0fs', duracao, args.intervalo)
+                continue
+            time.sleep(args.intervalo - duracao)
+
+
+if __name__ == '__main__':
+    main()